@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+"""
+    Provide an index of apps which are hard to match with their .desktop files
+
+    The list of apps in app_match.xml which apply to the current distro and
+    release is compiled into dictionaries keyed by app name and by wm_class,
+    with each app's .desktop file already resolved to its full path.
+
+    The compiled index is cached on disk, along with the details of the files
+    it was compiled from: app_match.xml itself, the files used to identify the
+    distro and release, and the directories searched for .desktop files. The
+    index is only recompiled when one of these changes, so normally neither
+    the xml nor the distro information has to be read at startup.
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+import os
+import os.path
+import json
+
+import xdg.BaseDirectory as BaseDirectory
+
+import dock_xml
+
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                         "mate-dock-applet")
+CACHE_FILE = os.path.join(CACHE_DIR, "app_match.json")
+
+# the files the distro name and release are read from
+DISTRO_FILES = ["/etc/os-release", "/usr/lib/os-release", "/etc/lsb-release"]
+
+
+class AppMatchIndex(object):
+    """ The compiled list of hard to match apps
+
+        Attributes:
+            by_name : a dict of app name (as reported by bamf/wnck) -> the
+                      full path of the app's .desktop file
+            by_class : a dict of lower cased wm_class -> the full path of the
+                       app's .desktop file
+    """
+
+    def __init__(self, by_name=None, by_class=None):
+        """ Init for the AppMatchIndex class
+
+        Args:
+            by_name : a dict of app name -> .desktop file
+            by_class : a dict of lower cased wm_class -> .desktop file
+        """
+
+        super().__init__()
+
+        self.by_name = by_name or {}
+        self.by_class = by_class or {}
+
+    def lookup(self, app_name, wm_classes):
+        """ Find the .desktop file of an app
+
+        Args:
+            app_name : the app's name
+            wm_classes : a list of the wm_class names of the app's window
+                         (e.g. the class group and instance names)
+
+        Returns:
+            the full path of the .desktop file, or None if the app isn't in
+            the index
+        """
+
+        desktop_file = self.by_name.get(app_name)
+        if desktop_file is not None:
+            return desktop_file
+
+        for wm_class in wm_classes:
+            if wm_class:
+                desktop_file = self.by_class.get(wm_class.lower())
+                if desktop_file is not None:
+                    return desktop_file
+
+        return None
+
+
+def _app_dirs():
+    """ Get the directories .desktop files are searched for in
+
+    Returns:
+        a list of directories
+    """
+
+    return [os.path.join(data_dir, "applications") for data_dir in BaseDirectory.xdg_data_dirs]
+
+
+def _file_ids(filenames):
+    """ Get the modification times and sizes of a list of files or
+        directories
+
+    Args:
+        filenames : the list of files
+
+    Returns:
+        a list of [filename, mtime, size] lists. mtime and size are None for
+        files which don't exist
+    """
+
+    ids = []
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+            ids.append([filename, stat.st_mtime, stat.st_size])
+        except OSError:
+            ids.append([filename, None, None])
+
+    return ids
+
+
+def _resolve_desktop_file(desktop, app_dirs):
+    """ Find the full path of a .desktop file
+
+    Args:
+        desktop : the name of the .desktop file, with or without the .desktop
+                  extension
+        app_dirs : the directories to search
+
+    Returns:
+        the full path, or None if the file could not be found
+    """
+
+    if not desktop:
+        return None
+
+    names = [desktop]
+    if not desktop.endswith(".desktop"):
+        names.insert(0, "%s.desktop" % desktop)
+
+    for app_dir in app_dirs:
+        for name in names:
+            desktop_file = os.path.join(app_dir, name)
+            if os.path.isfile(desktop_file):
+                return desktop_file
+
+    return None
+
+
+def compile_index(xml_filename, app_dirs):
+    """ Read app_match.xml and compile the entries relating to the current
+        distro into an index
+
+    Args:
+        xml_filename : the app_match.xml filename
+        app_dirs : the directories to search for .desktop files
+
+    Returns:
+        an AppMatchIndex
+    """
+
+    results = dock_xml.read_app_xml(xml_filename)
+    if not results[0]:
+        return AppMatchIndex()
+
+    by_name = {}
+    by_class = {}
+    for name, wm_class, desktop in results[1]:
+        desktop_file = _resolve_desktop_file(desktop, app_dirs)
+        if desktop_file is None:
+            continue
+
+        # the first entry for a name or class takes priority, as it did when
+        # the list was searched in order
+        if name:
+            by_name.setdefault(name, desktop_file)
+        if wm_class:
+            by_class.setdefault(wm_class.lower(), desktop_file)
+
+    return AppMatchIndex(by_name, by_class)
+
+
+def load_index(xml_filename):
+    """ Get the index of hard to match apps, from the cache if possible
+
+    Args:
+        xml_filename : the app_match.xml filename
+
+    Returns:
+        an AppMatchIndex
+    """
+
+    app_dirs = _app_dirs()
+    sources = _file_ids([xml_filename] + DISTRO_FILES + app_dirs)
+
+    try:
+        with open(CACHE_FILE, "r") as cache_file:
+            cached = json.load(cache_file)
+        if cached["sources"] == sources:
+            return AppMatchIndex(cached["by_name"], cached["by_class"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    index = compile_index(xml_filename, app_dirs)
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_file = "%s.%d.tmp" % (CACHE_FILE, os.getpid())
+        with open(tmp_file, "w") as cache_file:
+            json.dump({"sources": sources,
+                       "by_name": index.by_name,
+                       "by_class": index.by_class}, cache_file)
+        os.replace(tmp_file, CACHE_FILE)
+    except OSError:
+        pass
+
+    return index
+
+
+def main():
+    """Main function.
+
+    Debugging code can go here
+    """
+
+    d, f = os.path.split(os.path.abspath(__file__))
+    index = load_index("%s/app_match.xml" % d)
+    for name, desktop_file in index.by_name.items():
+        print("App name = %s -> %s" % (name, desktop_file))
+    for wm_class, desktop_file in index.by_class.items():
+        print("App class = %s -> %s" % (wm_class, desktop_file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+"""
+    Cache the properties of Bamf views (applications and windows)
+
+    Reading a property of a Bamf.View can mean a call to the bamf daemon
+    over D-Bus, and the dock reads the same properties many times e.g. when
+    counting an app's windows each time its icon is drawn.
+
+    Properties which never change (a window's type) are read from bamf once.
+    Properties which can change (names, visibility, running and starting
+    states, an app's .desktop file and its list of windows) are read once and
+    then kept up to date from the view's change signals.
+
+    The number of property lookups and the number of these which needed a
+    call to bamf are counted and the rates are logged periodically, so that
+    the number of calls which would have been made without the cache can be
+    compared with the number actually made.
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+import gi
+
+gi.require_version("Bamf", "3")
+
+from gi.repository import GObject
+from gi.repository import Bamf
+
+import time
+import weakref
+
+from log_it import log_it as log_it
+
+# the interval (in seconds) at which lookup and call rates are logged
+REPORT_INTERVAL = 60
+
+# the cached properties - a dict of Bamf.View -> dict of property name -> value
+_views = weakref.WeakKeyDictionary()
+
+# the attribute of a view which holds the ids of the signal handlers
+# connected to it, or an empty list once the view has closed. Keeping these
+# on the view rather than in _views means that handlers are never connected
+# twice, even after the view's entry has been removed. Setting an attribute
+# on a PyGObject wrapper also keeps the wrapper alive for as long as the
+# view itself, so that it is never recreated without the attribute
+_HANDLERS_ATTR = "_bamf_cache_handler_ids"
+
+# the number of lookups and bamf calls since the last report
+_num_lookups = 0
+_num_calls = 0
+_report_timer_id = 0
+_last_report = 0
+
+
+def _do_report():
+    """ Timer callback to log the lookup and call rates
+
+    Returns:
+        True, so that the timer continues
+    """
+
+    global _num_lookups, _num_calls, _last_report
+
+    now = time.monotonic()
+    if _num_lookups > 0:
+        elapsed = now - _last_report
+        log_it("bamf_cache: %.1f lookups/s, %.1f bamf calls/s, %d views cached"
+               % (_num_lookups / elapsed, _num_calls / elapsed, len(_views)))
+
+    _num_lookups = 0
+    _num_calls = 0
+    _last_report = now
+    return True
+
+
+def _get_entry(view):
+    """ Get the cached properties of a view, connecting to its signals the
+        first time it is seen
+
+    Args:
+        view : the Bamf.View
+
+    Returns:
+        a dict of property name -> value. If the view has closed, the dict
+        is empty and is not kept, so that properties are always read from
+        bamf
+    """
+
+    global _report_timer_id, _last_report
+
+    entry = _views.get(view)
+    if entry is not None:
+        return entry
+
+    handler_ids = getattr(view, _HANDLERS_ATTR, None)
+    if handler_ids is not None:
+        # the view has closed, so nothing will keep the entry up to date
+        return {}
+
+    entry = {}
+    _views[view] = entry
+
+    handler_ids = [view.connect("name-changed", _name_changed),
+                   view.connect("user-visible-changed", _state_changed, "user_visible"),
+                   view.connect("running-changed", _state_changed, "running"),
+                   view.connect("starting-changed", _state_changed, "starting"),
+                   view.connect("closed", _view_closed)]
+    if isinstance(view, Bamf.Application):
+        handler_ids += [view.connect("window-added", window_added),
+                        view.connect("window-removed", window_removed),
+                        view.connect("desktop-file-updated", _desktop_file_updated)]
+
+    setattr(view, _HANDLERS_ATTR, handler_ids)
+
+    if _report_timer_id == 0:
+        _last_report = time.monotonic()
+        _report_timer_id = GObject.timeout_add(REPORT_INTERVAL * 1000, _do_report)
+
+    return entry
+
+
+def _lookup(view, prop, getter):
+    """ Get a property of a view from the cache, reading it from bamf if it
+        isn't cached
+
+    Args:
+        view : the Bamf.View
+        prop : the name of the property
+        getter : a function which reads the property from bamf
+
+    Returns:
+        the value of the property
+    """
+
+    global _num_lookups, _num_calls
+
+    _num_lookups += 1
+    entry = _get_entry(view)
+    if prop not in entry:
+        _num_calls += 1
+        entry[prop] = getter()
+
+    return entry[prop]
+
+
+def _name_changed(view, old_name, new_name):
+    """ Handler for the Bamf.View name-changed signal """
+
+    if view in _views:
+        _views[view]["name"] = new_name
+
+
+def _state_changed(view, state, prop):
+    """ Handler for the Bamf.View user-visible-changed, running-changed and
+        starting-changed signals
+    """
+
+    if view in _views:
+        _views[view][prop] = state
+
+
+def _desktop_file_updated(app, desktop_file):
+    """ Handler for the Bamf.Application desktop-file-updated signal """
+
+    if app in _views:
+        _views[app]["desktop_file"] = desktop_file
+
+
+def _view_closed(view):
+    """ Handler for the Bamf.View closed signal
+
+    Forget the view's properties and disconnect from its signals
+    """
+
+    _views.pop(view, None)
+
+    for handler_id in getattr(view, _HANDLERS_ATTR, []):
+        if view.handler_is_connected(handler_id):
+            view.disconnect(handler_id)
+
+    setattr(view, _HANDLERS_ATTR, [])
+
+
+def window_added(app, window):
+    """ Add a window to an app's cached list of windows
+
+    Connected to the Bamf.Application window-added signal. The dock also
+    calls this before handling a new window itself, as its handlers may run
+    first
+
+    Args:
+        app : the Bamf.Application
+        window : the Bamf.Window
+    """
+
+    entry = _views.get(app)
+    if (entry is not None) and ("windows" in entry) and (window not in entry["windows"]):
+        entry["windows"].append(window)
+
+
+def window_removed(app, window):
+    """ Remove a window from an app's cached list of windows
+
+    Connected to the Bamf.Application window-removed signal. The dock also
+    calls this before handling a closed window itself, as its handlers may
+    run first
+
+    Args:
+        app : the Bamf.Application
+        window : the Bamf.Window
+    """
+
+    entry = _views.get(app)
+    if (entry is not None) and ("windows" in entry) and (window in entry["windows"]):
+        entry["windows"].remove(window)
+
+
+def get_name(view):
+    """ Get the name of a view
+
+    Args:
+        view : the Bamf.View
+
+    Returns:
+        string
+    """
+
+    return _lookup(view, "name", view.get_name)
+
+
+def is_user_visible(view):
+    """ Get whether a view is visible to the user
+
+    Args:
+        view : the Bamf.View
+
+    Returns:
+        bool
+    """
+
+    return _lookup(view, "user_visible", view.is_user_visible)
+
+
+def is_running(view):
+    """ Get whether a view is running
+
+    Args:
+        view : the Bamf.View
+
+    Returns:
+        bool
+    """
+
+    return _lookup(view, "running", view.is_running)
+
+
+def is_starting(view):
+    """ Get whether a view is starting
+
+    Args:
+        view : the Bamf.View
+
+    Returns:
+        bool
+    """
+
+    return _lookup(view, "starting", view.is_starting)
+
+
+def get_window_type(window):
+    """ Get the type of a window
+
+    Args:
+        window : the Bamf.Window
+
+    Returns:
+        a Bamf.WindowType
+    """
+
+    return _lookup(window, "window_type", window.get_window_type)
+
+
+def get_desktop_file(app):
+    """ Get the .desktop file of an app
+
+    Args:
+        app : the Bamf.Application
+
+    Returns:
+        string : the full path of the .desktop file, or None
+    """
+
+    return _lookup(app, "desktop_file", app.get_desktop_file)
+
+
+def get_windows(app):
+    """ Get the windows of an app
+
+    Args:
+        app : the Bamf.Application
+
+    Returns:
+        a list of Bamf.Windows
+    """
+
+    return list(_lookup(app, "windows", lambda: list(app.get_windows())))
+
+
+def main():
+    """Main function.
+
+    Debugging code can go here
+    """
+
+    matcher = Bamf.Matcher.get_default()
+    for app in matcher.get_running_applications():
+        print("%s %s" % (get_name(app), get_desktop_file(app)))
+        for window in get_windows(app):
+            print("    %s %s %s" % (get_name(window), get_window_type(window),
+                                    is_user_visible(window)))
+
+
+if __name__ == "__main__":
+    main()
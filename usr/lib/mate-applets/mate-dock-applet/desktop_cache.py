@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+"""
+    Provide a process wide cache of parsed .desktop files
+
+    Each .desktop file is parsed once using Gio.DesktopAppInfo and the details
+    the dock needs (app name, icon, command line, actions and StartupWMClass)
+    are held in memory, keyed by the filename (or desktop id) that was used
+    to look the file up.
+
+    The directories containing cached files are monitored so that when a
+    .desktop file is changed or deleted its entry is dropped and the file will
+    be re-read the next time it is needed. If a directory can't be monitored,
+    the file's modification time is checked instead.
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+
+from gi.repository import Gio
+from gi.repository import GLib
+
+import os
+import os.path
+
+from collections import namedtuple
+
+DesktopEntry = namedtuple('DesktopEntry', ['filename', 'app_info', 'name',
+                                           'icon_name', 'exec_line',
+                                           'actions', 'wm_class', 'mtime'])
+
+# the cached entries, keyed by the filename or desktop id used to find them
+_entries = {}
+
+# Gio.FileMonitors for the directories containing cached files, keyed by
+# directory. A value of None indicates the directory could not be
+# monitored and that modification times must be checked instead
+_monitors = {}
+
+
+def _get_mtime(filename):
+    """ Get the modification time of a file
+
+    Args:
+        filename : the file
+
+    Returns:
+        a float, or None if the file does not exist
+    """
+
+    try:
+        return os.stat(filename).st_mtime
+    except OSError:
+        return None
+
+
+def _dir_changed(monitor, the_file, other_file, event_type):
+    """ Handler for the Gio.FileMonitor changed signal
+
+    Drop any cached entries relating to the file which changed
+
+    Args:
+        monitor : the Gio.FileMonitor
+        the_file : a Gio.File - the file which changed
+        other_file : a Gio.File, only used for move events
+        event_type : a Gio.FileMonitorEvent
+    """
+
+    if event_type in [Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                      Gio.FileMonitorEvent.DELETED,
+                      Gio.FileMonitorEvent.CREATED,
+                      Gio.FileMonitorEvent.MOVED_OUT,
+                      Gio.FileMonitorEvent.RENAMED,
+                      Gio.FileMonitorEvent.ATTRIBUTE_CHANGED]:
+        invalidate(the_file.get_path())
+        if other_file is not None:
+            invalidate(other_file.get_path())
+
+
+def _monitor_dir(dirname):
+    """ Start monitoring a directory containing cached .desktop files, if we
+        are not doing so already
+
+    Args:
+        dirname : the directory
+    """
+
+    if dirname in _monitors:
+        return
+
+    try:
+        monitor = Gio.File.new_for_path(dirname).monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES,
+                                                                   None)
+        monitor.connect("changed", _dir_changed)
+    except GLib.Error:
+        monitor = None
+
+    _monitors[dirname] = monitor
+
+
+def _read_entry(desktop_file):
+    """ Read and parse a .desktop file
+
+    Args:
+        desktop_file : the full path and filename of the .desktop file, or a
+                       desktop id e.g. pluma.desktop
+
+    Returns:
+        a DesktopEntry, or None if the file could not be read
+    """
+
+    try:
+        if os.path.isabs(desktop_file):
+            app_info = Gio.DesktopAppInfo.new_from_filename(desktop_file)
+        else:
+            app_info = Gio.DesktopAppInfo.new(desktop_file)
+    except TypeError:
+        app_info = None
+
+    if app_info is None:
+        return None
+
+    filename = app_info.get_filename()
+
+    return DesktopEntry(filename=filename,
+                        app_info=app_info,
+                        name=app_info.get_string("Name"),
+                        icon_name=app_info.get_string("Icon"),
+                        exec_line=app_info.get_string("Exec"),
+                        actions=app_info.list_actions(),
+                        wm_class=app_info.get_startup_wm_class(),
+                        mtime=_get_mtime(filename))
+
+
+def get_entry(desktop_file):
+    """ Get the parsed contents of a .desktop file
+
+    The file is only read from disk if it is not already in the cache or if
+    it has changed since it was cached
+
+    Args:
+        desktop_file : the full path and filename of the .desktop file, or a
+                       desktop id e.g. pluma.desktop
+
+    Returns:
+        a DesktopEntry, or None if the file could not be read
+    """
+
+    if not desktop_file:
+        return None
+
+    entry = _entries.get(desktop_file)
+    if entry is not None:
+        dirname = os.path.dirname(entry.filename)
+        if _monitors.get(dirname) is not None:
+            # the directory is being monitored, so the entry is current
+            return entry
+
+        if _get_mtime(entry.filename) == entry.mtime:
+            return entry
+
+        invalidate(entry.filename)
+
+    entry = _read_entry(desktop_file)
+    if entry is None:
+        return None
+
+    _entries[desktop_file] = entry
+    if entry.filename is not None:
+        _monitor_dir(os.path.dirname(entry.filename))
+
+    return entry
+
+
+def invalidate(filename=None):
+    """ Remove a file from the cache so that it will be re-read the next time
+        it is needed
+
+    Args:
+        filename : the full path and filename of the .desktop file. If None,
+                   all cached entries are removed
+    """
+
+    global _entries
+
+    if filename is None:
+        _entries = {}
+        return
+
+    for key in [key for key, entry in _entries.items()
+                if key == filename or entry.filename == filename]:
+        del _entries[key]
+
+
+def main():
+    """Main function.
+
+    Debugging code can go here
+    """
+    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -71,9 +71,9 @@ import os
 import os.path
 import sys
 import subprocess
+import time
 from time import sleep
 import dbus
-from dbus.mainloop.glib import DBusGMainLoop
 
 import docked_app
 import dock_prefs
@@ -85,9 +85,30 @@ import dock_xml
 import dock_color_changer
 import docked_app_helpers
 import window_control
+import desktop_cache
+import icon_index
+import icon_loader
+import surface_store
+import settings_writer
+import dock_services
+import unity_state
+import win_thumbnails
+import bamf_cache
+import signal_registry
 
 from log_it import log_it as log_it
 
+# the maximum rate (per second) at which Unity LauncherEntry updates are
+# applied to the dock. If 0, the refresh rate of the display is used
+UNITY_UPDATE_HZ = 0
+
+# the Unity LauncherEntry properties the dock displays
+UNITY_PROPS = ["count", "count-visible", "progress", "progress-visible", "urgent"]
+
+# whether to log the time taken by the Bamf view-opened and view-closed
+# handlers during bursts of events (e.g. many windows opening at once)
+LOG_VIEW_HANDLER_TIMES = False
+
 
 class DragMotionTimer(object):
     """Timer to allow us to track mouse motion during a drag and drop
@@ -375,6 +396,12 @@ class Dock(object):
             app_spacing : the amount of space (in pixels) between icons on the dock
             icontheme : used to load application icons and detect changes in
                         the icon theme
+            icon_serial : incremented each time an app icon is loaded in the background
+            icon_serials : a dict of DockedApp -> the icon_serial of the app's
+                           outstanding background icon load
+            icon_theme_serial : incremented each time the icon theme changes, so
+                                that stock icons from the previous theme are not
+                                reused from the surface store
             about_win : the about window
             prefs_win : the preferences window
             ccl_win   : the create custom launcher window
@@ -383,6 +410,8 @@ class Dock(object):
             right_clicked_app: the app that was most recently right clicked
             settings_path : the GIO.Settings path for the applet
             settings : GIO.Settings - the settings for the applet
+            settings_writer : used to write the applet settings to dconf and
+                              the xml config file
             indicator : the indicator type (e.g. light, dark, bar or None)
             attention_type : the attention_type e.g. blink
             fallback_bar_col : a list of the r,g,b elements of the colour to be
@@ -399,6 +428,10 @@ class Dock(object):
                                      are displayed in the dock
             win_from_cur_ws_only : whether indicators and window list items are
                                    to be shown for the current workspace only
+            win_list_thumbnails : whether or not window thumbnails are shown in
+                                  the window list
+            win_list_mru_order : whether or not the window list shows windows
+                                 in most recently used order
             change_panel_color : whether or not the color of MATE panels are to
                                  be changed to the dominant colour of the
                                  desktop wallpaper
@@ -474,6 +507,22 @@ class Dock(object):
             hidden_views    : a list of Bamf.View objects which have been opened
                               but have not yet been made visible
 
+            signals         : a SignalRegistry of the signal handlers the dock
+                              has connected, other than those for its apps
+
+            unity_pending   : a dict of .desktop file name -> dict of the latest
+                              Unity LauncherEntry properties received for the app
+                              but not yet applied to it
+            unity_timer_id  : the id of the timer used to apply pending Unity
+                              updates, or 0 if no timer is running
+            unity_received  : the number of Unity updates received
+            unity_applied   : the number of Unity updates which caused an app's
+                              icon to be redrawn
+            shortcut_app    : the app most recently activated by a keyboard shortcut,
+                              until its window becomes active
+            shortcut_time   : the time (from time.monotonic) the shortcut for
+                              shortcut_app was pressed
+
     """
 
     def __init__(self, applet):
@@ -496,8 +545,39 @@ class Dock(object):
             self.scrolled_win.set_policy(Gtk.PolicyType.EXTERNAL, Gtk.PolicyType.EXTERNAL)
             self.scrolled_win.connect("scroll-event", self.window_scroll)
 
+        # the signal handlers the dock connects to objects other than its apps
+        self.signals = signal_registry.SignalRegistry()
+
         self.icontheme = Gtk.IconTheme.get_default()
-        self.icontheme.connect("changed", self.icon_theme_changed)
+        self.signals.connect(self.icontheme, "changed", self.icon_theme_changed)
+        self.icon_serial = 0
+        self.icon_serials = {}
+        self.icon_theme_serial = 0
+
+        self.unity_pending = {}
+        self.unity_timer_id = 0
+        self.unity_received = 0
+        self.unity_applied = 0
+
+        self.shortcut_app = None
+        self.shortcut_time = 0
+
+        # the root coords of the dock, or None if they need to be read again
+        self.dock_root_coords = None
+
+        # calls to be made once Gtk has laid out the dock, and the frame
+        # clock (Gtk3) or idle handler (Gtk2) they are waiting on
+        self.after_layout_calls = []
+        self.after_layout_clock = None
+        self.after_layout_id = 0
+
+        # timings of the Bamf view handlers during a burst of events - only
+        # recorded if LOG_VIEW_HANDLER_TIMES is True
+        self.view_handler_count = 0
+        self.view_handler_total = 0
+        self.view_handler_max = 0
+        self.view_handler_last = 0
+        self.view_handler_log_id = 0
 
         self.window = None
 
@@ -522,6 +602,9 @@ class Dock(object):
         # specify the xml file to be used as an alternative storage location
         # for the applet settings
         self.xml_conf = os.path.expanduser("~/.config/mate_dock_applet.conf")
+        self.settings_writer = settings_writer.SettingsWriter("org.mate.panel.applet.dock",
+                                                              self.settings_path,
+                                                              self.xml_conf)
 
         self.prefs_win = None
         self.about_win = None
@@ -532,11 +615,16 @@ class Dock(object):
         self.click_restore_last_active = True
         self.show_all_apps = True
         self.win_from_cur_ws_only = False
+        self.win_list_thumbnails = False
+        self.win_list_mru_order = False
         self.use_win_list = True
         self.click_action = dock_prefs.ClickActionType.MINMAX
         self.panel_act_list = False
         self.change_panel_color = False
         self.change_dock_color_only = False
+        # the main colours of the desktop wallpaper, with the most prominent
+        # first - only set when the panel colour is changed to match it
+        self.wallpaper_palette = []
         self.active_bg = 0
         self.theme = 0
         self.app_spacing = 0
@@ -599,37 +687,16 @@ class Dock(object):
 
         self.setup_menu()
 
-        self.panel_cc = dock_color_changer.PanelColorChanger()
+        self.panel_cc = dock_color_changer.PanelColorChanger(self.panel_colors_changed)
 
-        # we need to monitor the Unity dbus interface
-        DBusGMainLoop(set_as_default=True)
-        self.session_bus = dbus.SessionBus()
-
-        # claim the Unity bus (Unity won't be using it...) so that clients know
-        # to start using it
-        self.session_bus.request_name("com.canonical.Unity",
-                                      dbus.bus.NAME_FLAG_ALLOW_REPLACEMENT)
-
-        # add a handler to listen in Unity dbus messages
-        self.session_bus.add_signal_receiver(self.unity_cb_handler,
-                                             dbus_interface="com.canonical.Unity.LauncherEntry",
-                                             signal_name="Update")
+        # we need to monitor the Unity dbus interface - the subscription is
+        # shared by all docks in this process and messages are forwarded to
+        # unity_cb_handler
+        self.session_bus = dock_services.get_session_bus()
+        dock_services.register_dock(self)
 
         # we need a Bamf.Matcher for matching windows to running apps
-        self.matcher = None
-        # wait for max 10s to ensure bamf is available
-        # (bamf is not always immediately available after login on Linux Mint
-        # 19 - e.g. https://forums.linuxmint.com/viewtopic.php?t=272747 and
-        # issue #158)
-        i = 0
-        while i < 10:
-            if (not self.session_bus.name_has_owner("org.ayatana.bamf")):
-                i += 1
-                sleep(1)
-            else:
-                break
-
-        self.matcher = Bamf.Matcher()
+        self.matcher = dock_services.get_matcher()
 
         # can we resize nicely on the panel?
         try:
@@ -649,13 +716,6 @@ class Dock(object):
         # fully created
         GObject.timeout_add(1000, self.do_delayed_setup)
 
-    def __del__(self):
-        """ Clean up ...
-        """
-
-        # release the unity bus
-        self.session_bus.release_name("com.canonical.Unity")
-
     def do_delayed_setup(self):
         """ Perform setup operations that we couldn't do until the dock was
             fully instantiated
@@ -929,6 +989,10 @@ class Dock(object):
 
         """
 
+        # not held in the xml config, so always read from dconf
+        self.win_list_thumbnails = self.settings.get_boolean("win-list-thumbnails")
+        self.win_list_mru_order = self.settings.get_boolean("win-list-mru-order")
+
         # is this dock being run for the first time?
         if self.settings.get_boolean("first-run") is True:
             # this dock is being run for the first time, so if we have any
@@ -1091,73 +1155,69 @@ class Dock(object):
         pa_configs = self.configs_to_settings()
 
         if self.settings:
+            values = []
+
             # only save the current set of self.pinned apps if we're not inking pinned apps
             # to workspaces
             if self.pa_on_all_ws:
-                self.settings.set_value("pinned-apps", GLib.Variant('as', pinned_apps))
-
-            self.settings.set_int("indicator-type", self.indicator)
-            self.settings.set_boolean("multi-ind", self.multi_ind)
-            self.settings.set_boolean("apps-from-all-workspaces",
-                                      self.show_all_apps)
-            self.settings.set_boolean("win-from-cur-workspace-only",
-                                      self.win_from_cur_ws_only)
-            self.settings.set_boolean("use-win-list",
-                                      self.use_win_list)
-            self.settings.set_boolean("change-panel-color",
-                                      self.change_panel_color)
-            self.settings.set_boolean("change-panel-color-dock-only",
-                                      self.change_dock_color_only)
-            self.settings.set_boolean("panel-act-list", self.panel_act_list)
-            self.settings.set_int("bg-type", self.active_bg)
-            self.settings.set_boolean("first-run", False)
-            self.settings.set_value("fallback-bar-col", GLib.Variant('as', self.fallback_bar_col))
-            self.settings.set_int("app-spacing", self.app_spacing)
-            self.settings.set_int("attention-type", self.attention_type)
-            self.settings.set_int("popup-delay", self.popup_delay)
-            self.settings.set_boolean("pinned-apps-on-all-workspaces", self.pa_on_all_ws)
-            self.settings.set_value("saved-configs", GLib.Variant('as', pa_configs))
-            self.settings.set_int("dock-fixed-size", self.dock_fixed_size)
-            self.settings.set_int("click-action", self.click_action)
-            self.settings.set_int("theme", self.theme)
-
-        dock_xml.write_xml(self.xml_conf, pinned_apps, self.indicator,
-                           self.show_all_apps, self.multi_ind,
-                           self.use_win_list,
-                           self.win_from_cur_ws_only,
-                           self.change_panel_color,
-                           self.change_dock_color_only,
-                           self.panel_act_list,
-                           self.active_bg,
-                           self.fallback_bar_col,
-                           self.app_spacing,
-                           self.attention_type,
-                           self.popup_delay,
-                           self.pa_configs,
-                           self.pa_on_all_ws,
-                           self.dock_fixed_size,
-                           self.click_action,
-                           self.theme)
+                values.append(("pinned-apps", GLib.Variant('as', pinned_apps)))
+
+            values += [("indicator-type", GLib.Variant('i', self.indicator)),
+                       ("multi-ind", GLib.Variant('b', self.multi_ind)),
+                       ("apps-from-all-workspaces", GLib.Variant('b', self.show_all_apps)),
+                       ("win-from-cur-workspace-only", GLib.Variant('b', self.win_from_cur_ws_only)),
+                       ("use-win-list", GLib.Variant('b', self.use_win_list)),
+                       ("change-panel-color", GLib.Variant('b', self.change_panel_color)),
+                       ("change-panel-color-dock-only", GLib.Variant('b', self.change_dock_color_only)),
+                       ("panel-act-list", GLib.Variant('b', self.panel_act_list)),
+                       ("bg-type", GLib.Variant('i', self.active_bg)),
+                       ("first-run", GLib.Variant('b', False)),
+                       ("fallback-bar-col", GLib.Variant('as', self.fallback_bar_col)),
+                       ("app-spacing", GLib.Variant('i', self.app_spacing)),
+                       ("attention-type", GLib.Variant('i', self.attention_type)),
+                       ("popup-delay", GLib.Variant('i', self.popup_delay)),
+                       ("pinned-apps-on-all-workspaces", GLib.Variant('b', self.pa_on_all_ws)),
+                       ("saved-configs", GLib.Variant('as', pa_configs)),
+                       ("dock-fixed-size", GLib.Variant('i', self.dock_fixed_size)),
+                       ("click-action", GLib.Variant('i', self.click_action)),
+                       ("theme", GLib.Variant('i', self.theme))]
+
+            # only the settings which have changed are written
+            self.settings_writer.set_values(values)
+
+        # the xml file is written after a short delay, so that several calls
+        # to this method in quick succession result in only one write
+        self.settings_writer.write_xml(pinned_apps, self.indicator,
+                                       self.show_all_apps, self.multi_ind,
+                                       self.use_win_list,
+                                       self.win_from_cur_ws_only,
+                                       self.change_panel_color,
+                                       self.change_dock_color_only,
+                                       self.panel_act_list,
+                                       self.active_bg,
+                                       self.fallback_bar_col,
+                                       self.app_spacing,
+                                       self.attention_type,
+                                       self.popup_delay,
+                                       self.pa_configs,
+                                       self.pa_on_all_ws,
+                                       self.dock_fixed_size,
+                                       self.click_action,
+                                       self.theme)
 
     def read_app_match(self):
-        """ Read an xml file which contains a list of apps which are difficult
-            to match with their respective .desktop file.
+        """ Get the list of apps which are difficult to match with their
+            respective .desktop file.
+
+        The list is shared by all docks in this process
 
         Returns:
-            A list of tuples which containing the following:
-                the app name (as reported by wnck)
-                the app's wm_class (as reported by wnck)
-                the .desktop file to be used by apps whose name or wm_class
-                match the above
-        """
-
-        d, f = os.path.split(os.path.abspath(__file__))
-        results = dock_xml.read_app_xml("%s/app_match.xml" % d)
-        if results[0]:
-            # the file was read successfully
-            return results[1]
-        else:
-            return []
+            An app_match.AppMatchIndex of the apps, which can be used to look
+            up an app's .desktop file by its name (as reported by wnck) or
+            its wm_class
+        """
+
+        return dock_services.get_app_match()
 
     def set_fallback_bar_colour(self):
         """ Set the colour to be used for drawing bar and other types of indicators when
@@ -1170,6 +1230,21 @@ class Dock(object):
 
         docked_app_helpers.fallback_ind_col = [r, g, b]
 
+    def panel_colors_changed(self):
+        """ Callback for when the panel colour changer has changed the panel
+            colour(s) to match the wallpaper
+
+        Make the wallpaper's palette available for drawing indicators etc.
+        and redraw the dock
+        """
+
+        if self.change_panel_color:
+            self.wallpaper_palette = [[r / 255, g / 255, b / 255]
+                                      for r, g, b in self.panel_cc.palette()]
+            for app in self.app_list:
+                app.wallpaper_palette = self.wallpaper_palette
+                app.queue_draw()
+
     def get_docked_app_by_desktop_file(self, dfname):
         """ Returns the docked app which has the same destop file name as dfname
 
@@ -1728,13 +1803,10 @@ class Dock(object):
                 self.app_list[index - 1] = self.app_list[index]
                 self.app_list[index] = app
 
-                # allow Gtk to perform the move
-                while Gtk.events_pending():
-                    Gtk.main_iteration()
-
-                # recalculate the minimize targets for each app
-                self.set_minimise_target(self.app_list[index - 1])
-                self.set_minimise_target(self.app_list[index])
+                # recalculate the minimize targets for each app once Gtk has
+                # performed the move
+                self.do_after_layout(self.set_minimise_target, self.app_list[index - 1])
+                self.do_after_layout(self.set_minimise_target, self.app_list[index])
 
                 if not self.pa_on_all_ws:
                     self.update_pinned_app_config()
@@ -1787,23 +1859,96 @@ class Dock(object):
         self.app_list.remove(the_app)
         self.app_list.insert(new_pos, the_app)
 
-        # allow Gtk toperform the move
-        while Gtk.events_pending():
-            Gtk.main_iteration()
+        # once Gtk has performed the move, we need to redraw the icons and
+        # recalculate the minimise positions of all apps
+        self.do_after_layout(self.move_app_done)
+
+        # save the new settings
+        if not self.pa_on_all_ws:
+            self.update_pinned_app_config()
+        self.write_settings()
+
+    def move_app_done(self):
+        """ Finish moving an app, once Gtk has laid out the dock
+
+        Set the scroll indicators, redraw the app icons and recalculate the
+        minimise positions of all apps
+        """
 
         if self.scrolling:
             self.set_app_scroll_dirs(True)
 
-        # we need to redraw the icons and recalculate the minimise positions
-        # of all apps
         for app in self.app_list:
             app.queue_draw()
         self.set_all_apps_minimise_targets()
 
-        # save the new settings
-        if not self.pa_on_all_ws:
-            self.update_pinned_app_config()
-        self.write_settings()
+    def do_after_layout(self, func, *args):
+        """ Call a function once Gtk has laid out and redrawn the dock
+
+        With Gtk3 the function is called from a one-shot handler for the
+        after-paint signal of the applet's frame clock, by which time the
+        frame's layout has been done and e.g. the new positions of app icons
+        are known. With Gtk2, or if the applet isn't mapped, an idle handler
+        with a lower priority than Gtk's own resize and redraw handlers is
+        used instead. This is used instead of running a nested main loop,
+        which could re-enter the dock's own handlers part way through an
+        update
+
+        A function which is queued more than once with the same arguments
+        before the calls are made is only called once
+
+        Args:
+            func : the function to call
+            args : the arguments to call it with
+        """
+
+        if (func, args) not in self.after_layout_calls:
+            self.after_layout_calls.append((func, args))
+
+        if (self.after_layout_clock is not None) or (self.after_layout_id != 0):
+            return
+
+        frame_clock = None
+        if not build_gtk2 and self.applet.get_mapped():
+            frame_clock = self.applet.get_frame_clock()
+
+        if frame_clock is not None:
+            self.after_layout_clock = frame_clock
+            self.signals.connect(frame_clock, "after-paint", self.after_layout_paint)
+            frame_clock.request_phase(Gdk.FrameClockPhase.AFTER_PAINT)
+        else:
+            self.after_layout_id = GLib.idle_add(self.do_after_layout_calls,
+                                                 priority=GLib.PRIORITY_DEFAULT_IDLE)
+
+    def after_layout_paint(self, frame_clock):
+        """ Handler for the after-paint signal of the applet's frame clock
+
+        Disconnect the handler, so that it is only called once, and make the
+        calls queued by do_after_layout
+
+        Args:
+            frame_clock : the Gdk.FrameClock
+        """
+
+        self.signals.disconnect(frame_clock, "after-paint", self.after_layout_paint)
+        self.after_layout_clock = None
+        self.do_after_layout_calls()
+
+    def do_after_layout_calls(self):
+        """ Make the calls queued by do_after_layout - also used as an idle
+            handler
+
+        Returns:
+            False, so that the handler is not called again
+        """
+
+        self.after_layout_id = 0
+        calls = self.after_layout_calls
+        self.after_layout_calls = []
+        for func, args in calls:
+            func(*args)
+
+        return False
 
     def get_app_root_coords(self, app):
         """ Calculate and return the root x and y co-ordinates of the top left
@@ -1826,10 +1971,16 @@ class Dock(object):
     def get_dock_root_coords(self):
         """ Get the root coords of the top left pixel of the dock
 
+        Reading the coords means a round trip to the X server, so they are
+        cached until invalidate_dock_root_coords is called
+
         Returns:
             two integers, the x and y coordinates
         """
 
+        if self.dock_root_coords is not None:
+            return self.dock_root_coords
+
         # get root coord from the applet window rather from panel settings...
         win = self.applet.props.window
         # check validity of win - can be None during applet creation...
@@ -1842,8 +1993,16 @@ class Dock(object):
         else:
             thing, dock_x, dock_y = win.get_origin()
 
+        self.dock_root_coords = (dock_x, dock_y)
         return dock_x, dock_y
 
+    def invalidate_dock_root_coords(self):
+        """ Forget the cached root coords of the dock e.g. because the
+            applet has been moved or resized
+        """
+
+        self.dock_root_coords = None
+
     def set_minimise_target(self, app, win=None):
         """ Calculate and set the minimise locations for an app's windows,
             or just for a single window
@@ -1909,13 +2068,10 @@ class Dock(object):
                 self.app_list[index + 1] = self.app_list[index]
                 self.app_list[index] = app
 
-                # allow Gtk to move perform the move
-                while Gtk.events_pending():
-                    Gtk.main_iteration()
-
-                # recalculate the minimize targets for each app
-                self.set_minimise_target(self.app_list[index + 1])
-                self.set_minimise_target(self.app_list[index])
+                # recalculate the minimize targets for each app once Gtk has
+                # performed the move
+                self.do_after_layout(self.set_minimise_target, self.app_list[index + 1])
+                self.do_after_layout(self.set_minimise_target, self.app_list[index])
 
                 if not self.pa_on_all_ws:
                     self.update_pinned_app_config()
@@ -2111,6 +2267,10 @@ class Dock(object):
                     self.panel_cc.do_change_panel_color()
                 else:
                     self.panel_cc.disable_color_change()
+                    self.wallpaper_palette = []
+                    for app in self.app_list:
+                        app.wallpaper_palette = self.wallpaper_palette
+                        app.queue_draw()
 
         self.prefs_win.hide()
 
@@ -2218,6 +2378,7 @@ class Dock(object):
                 dock_app.applet_win = self.applet.window.get_window()
 
             dock_app.applet = self.applet
+            dock_app.wallpaper_palette = self.wallpaper_palette
 
             dock_app.applet_orient = self.applet.get_orient()
             dock_app.set_indicator(self.indicator)
@@ -2256,6 +2417,7 @@ class Dock(object):
                 dock_app.applet_win = self.applet.get_window()
 
             dock_app.applet = self.applet
+            dock_app.wallpaper_palette = self.wallpaper_palette
             dock_app.applet_orient = self.applet.get_orient()
             size = self.applet.get_size()
             self.set_app_icon(dock_app, size)
@@ -2286,6 +2448,7 @@ class Dock(object):
             dock_app.applet_win = self.applet.get_window()
 
         dock_app.applet = self.applet
+        dock_app.wallpaper_palette = self.wallpaper_palette
 
         dock_app.applet_orient = self.applet.get_orient()
         dock_app.set_indicator(self.indicator)
@@ -2331,6 +2494,8 @@ class Dock(object):
     """
 
         self.icontheme.rescan_if_needed()
+        icon_index.invalidate()
+        self.icon_theme_serial += 1
 
         size = self.applet.get_size()
         for app in self.app_list:
@@ -2355,24 +2520,9 @@ class Dock(object):
             exists or "" otherwise
         """
 
-        srch_dirs = ["/usr/share/applications/",
-                     "/usr/local/share/applications/",
-                     "/var/lib/snapd/desktop/applications/",
-                     os.path.expanduser("~/.local/share/applications/")]
-
-        for srch_dir in srch_dirs:
-            for the_dir, dir_list, file_list in os.walk(srch_dir):
-                try:
-                    unused_var = file_list.index(df_name)
-
-                    # if we get here the file is found
-                    the_name = os.path.join(the_dir, df_name)
-                    return the_name
-
-                except ValueError:
-                    pass
-
-        return ""
+        # the directories are indexed once and the index is shared by all
+        # docks in this process
+        return dock_services.find_desktop_file(df_name)
 
     def setup_app_list(self):
         """Setup the list of docked apps.
@@ -2389,7 +2539,7 @@ class Dock(object):
         removed events, pluse change of active workspace
         """
 
-        self.wnck_screen.force_update()  # recommended per Wnck documentation
+        window_control.update_screen()  # recommended per Wnck documentation
 
         self.app_list = []
         if self.pa_on_all_ws:
@@ -2421,13 +2571,14 @@ class Dock(object):
         # unpinned apps - get a list of all running apps and if an app is not already in the dock
         # and if it is an app (and not e.g. a panel...) then add it to the dock
         for b_app in self.matcher.get_running_applications():
-            if (self.get_docked_app_by_bamf_app(b_app) is None) and b_app.is_user_visible():
+            if (self.get_docked_app_by_bamf_app(b_app) is None) and bamf_cache.is_user_visible(b_app):
                 # we need to examine all the app's windows - if any of them are Normal/Dialogs the app needs to be
                 # added to the dock
                 add_to_dock = False
-                for b_win in b_app.get_windows():
-                    if (b_win.get_window_type() == Bamf.WindowType.NORMAL) or \
-                       (b_win.get_window_type() == Bamf.WindowType.DIALOG) and b_win.is_user_visible():
+                for b_win in bamf_cache.get_windows(b_app):
+                    if (bamf_cache.get_window_type(b_win) == Bamf.WindowType.NORMAL) or \
+                       (bamf_cache.get_window_type(b_win) == Bamf.WindowType.DIALOG) and \
+                       bamf_cache.is_user_visible(b_win):
 
                         add_to_dock = True
                         break
@@ -2436,7 +2587,7 @@ class Dock(object):
                     dock_app = docked_app.DockedApp()
                     dock_app.set_bamf_app(b_app)
 
-                    dock_app.desktop_file = b_app.get_desktop_file()
+                    dock_app.desktop_file = bamf_cache.get_desktop_file(b_app)
                     if dock_app.desktop_file is not None:
                         if dock_app.read_info_from_desktop_file():
                             self.app_list.append(dock_app)
@@ -2449,16 +2600,11 @@ class Dock(object):
         # for all the apps we have, setup signal handlers
         for app in self.app_list:
             # connect signal handlers so that we detect windows being added and removed from the Bamf.App
-            b_app = app.bamf_app
-            self.set_bamf_app_handlers(b_app)
+            self.set_bamf_app_handlers(app)
 
             # for each window the app has open, connect workspace changed events
             for win in app.get_windows():
-                win_type = win.get_window_type()
-                if (win_type == Bamf.WindowType.NORMAL) or (win_type == Bamf.WindowType.DIALOG):
-                    wnck_win = Wnck.Window.get(win.get_xid())
-                    if wnck_win is not None:
-                        wnck_win.connect("workspace-changed", self.window_ws_changed)
+                self.set_window_handlers(app, win)
 
     def clear_dock_apps(self):
         """ Clear out the current list of apps, pinned and unpinned, restoring the
@@ -2535,32 +2681,98 @@ class Dock(object):
                 new_app.is_active = True
                 new_app.queue_draw()
 
-    def set_bamf_app_handlers(self, b_app):
-        """ Set up signal handlers for a Bamf.Application
+    def set_bamf_app_handlers(self, app):
+        """ Set up signal handlers for a docked app's Bamf.Application
+
+        The handlers are recorded in the app's signal registry, so they are
+        only connected once and are disconnected when the app is removed from
+        the dock
 
         Params:
-            b_app - the Bamf.Application
+            app - the docked app
         """
 
+        b_app = app.bamf_app
         if b_app is not None:
-            b_app.connect("running-changed", self.do_running_changed)
-            b_app.connect("starting-changed", self.do_starting_changed)
-            b_app.connect("urgent-changed", self.do_urgent_changed)
+            app.signals.connect(b_app, "running-changed", self.do_running_changed)
+            app.signals.connect(b_app, "starting-changed", self.do_starting_changed)
+            app.signals.connect(b_app, "urgent-changed", self.do_urgent_changed)
 
-    def remove_bamf_app_handlers(self, b_app):
+    def remove_bamf_app_handlers(self, app, b_app):
         """ Remove signal handlers we set up
 
         Params:
+            app - the docked app
             b_app - the Bamf.Application
         """
 
         if b_app is not None:
-            try:
-                b_app.disconnect_by_func(self.do_running_changed)
-                b_app.disconnect_by_func(self.do_starting_changed)
-                b_app.disconnect_by_func(self.do_urgent_changed)
-            except TypeError:
-                pass
+            app.signals.disconnect(b_app)
+
+    def set_window_handlers(self, app, win):
+        """ Set up signal handlers for a window, so that we can detect when
+            it changes workspace
+
+        Only normal and dialog windows need them
+
+        Params:
+            app - the docked app the window belongs to, or None if it's not
+                  known
+            win - the Bamf.Window
+        """
+
+        win_type = bamf_cache.get_window_type(win)
+        if (win_type == Bamf.WindowType.NORMAL) or (win_type == Bamf.WindowType.DIALOG):
+            wnck_win = window_control.get_wnck_window(win)
+            if wnck_win is not None:
+                if app is None:
+                    signals = self.signals
+                else:
+                    signals = app.signals
+
+                signals.connect(wnck_win, "workspace-changed", self.window_ws_changed)
+
+    def wnck_window_closed(self, screen, wnck_win):
+        """ Handler for the Wnck.Screen window-closed signal
+
+        Forget any signal handlers connected to the window
+
+        Params:
+            screen - the Wnck.Screen
+            wnck_win - the Wnck.Window which closed
+        """
+
+        self.signals.disconnect(wnck_win)
+        for app in self.app_list:
+            app.signals.disconnect(wnck_win)
+
+    def disconnect_signals(self):
+        """ Disconnect all of the signal handlers connected by the dock and its
+            apps e.g. when the dock is removed from the panel
+
+        Some of the objects e.g. the Bamf.Matcher and Wnck.Screen are shared
+        by all docks in the process, so they would otherwise keep calling this
+        dock's handlers
+        """
+
+        for app in self.app_list:
+            app.signals.disconnect_all()
+
+        self.signals.disconnect_all()
+
+    def get_num_signal_handlers(self):
+        """ Get the number of signal handlers connected by the dock and its
+            apps, e.g. to check for leaks
+
+        Returns:
+            int
+        """
+
+        num_handlers = self.signals.count()
+        for app in self.app_list:
+            num_handlers += app.signals.count()
+
+        return num_handlers
 
     def active_win_changed(self, matcher, object, p0):
         """Event handler for the active window change event
@@ -2579,7 +2791,8 @@ class Dock(object):
 
         """
 
-        self.wnck_screen.force_update()
+        if p0 is not None:
+            window_control.update_screen([p0])
 
         for app in self.app_list:
             if app.is_active is True:
@@ -2589,16 +2802,37 @@ class Dock(object):
         if p0 is not None:
             for app in self.app_list:
                 if app.has_bamf_window(p0):
-                    win_type = p0.get_window_type()
+                    win_type = bamf_cache.get_window_type(p0)
 
                     # we only want to allow normal and dialog windows to be the last active window
                     if win_type in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG]:
                         app.last_active_win = p0
+                        app.win_activated(p0)
+                        if app.win_list_model is not None:
+                            app.win_list_model.set_active(p0)
 
                     app.is_active = True
                     app.queue_draw()
+
+                    if app == self.shortcut_app:
+                        log_it("shortcut: window activated %.1fms after key press"
+                               % ((time.monotonic() - self.shortcut_time) * 1000))
+                        self.shortcut_app = None
                     break
 
+    def set_shortcut_press(self, app, press_time):
+        """ Record that a keyboard shortcut was pressed to activate an app
+
+        When one of the app's windows becomes active the time taken is logged
+
+        Args:
+            app : the DockedApp
+            press_time : the time (from time.monotonic) the shortcut was pressed
+        """
+
+        self.shortcut_app = app
+        self.shortcut_time = press_time
+
     def match_bamf_app_to_dock_app(self, b_app):
         """
             Attempts to match a Bamf.Application to a docked_app
@@ -2617,11 +2851,11 @@ class Dock(object):
         # first of all, try to match the application with those in the dock
         # by their .desktop file
 
-        if b_app.get_desktop_file() is not None:
-            dock_app = self.get_docked_app_by_desktop_file(b_app.get_desktop_file())
+        if bamf_cache.get_desktop_file(b_app) is not None:
+            dock_app = self.get_docked_app_by_desktop_file(bamf_cache.get_desktop_file(b_app))
             if (dock_app is not None) and (dock_app.bamf_app is None):
                 dock_app.set_bamf_app(b_app)
-                self.set_bamf_app_handlers(b_app)
+                self.set_bamf_app_handlers(dock_app)
         else:
             # see if there's a match by Bamf.Application
             dock_app = self.get_docked_app_by_bamf_app(b_app)
@@ -2630,7 +2864,7 @@ class Dock(object):
             # No match, so add the app to the dock
             dock_app = docked_app.DockedApp()
             dock_app.set_bamf_app(b_app)
-            dock_app.desktop_file = b_app.get_desktop_file()
+            dock_app.desktop_file = bamf_cache.get_desktop_file(b_app)
 
             add_to_dock = True
 
@@ -2645,9 +2879,10 @@ class Dock(object):
                 else:
                     dock_app.applet_win = self.applet.get_window()
 
-                self.set_bamf_app_handlers(b_app)
+                self.set_bamf_app_handlers(dock_app)
 
                 dock_app.applet = self.applet
+                dock_app.wallpaper_palette = self.wallpaper_palette
                 dock_app.applet_orient = self.applet.get_orient()
                 size = self.applet.get_size()
                 self.set_app_icon(dock_app, size)
@@ -2659,18 +2894,15 @@ class Dock(object):
                     self.show_or_hide_app_icons()
                     self.show_or_hide_indicators()
 
-                # make sure the dock_app has been fully realised
-                while Gtk.events_pending():
-                    Gtk.main_iteration()
-
-                self.set_all_apps_minimise_targets()
-
                 dock_app.applet_orient = self.applet.get_orient()
                 dock_app.set_indicator(self.indicator)
                 dock_app.set_multi_ind(self.multi_ind)
                 dock_app.set_active_bg(self.active_bg)
                 dock_app.set_attention_type(self.attention_type)
-                self.set_all_apps_minimise_targets()
+
+                # the minimise targets can only be calculated once the new
+                # app's icon has been given its place in the dock
+                self.do_after_layout(self.set_all_apps_minimise_targets)
 
             else:
                 if dock_app.startup_id is not None:
@@ -2694,24 +2926,83 @@ class Dock(object):
                 object -  the Bamf.Application or Bamf.Window that was opened
         """
 
-        self.wnck_screen.force_update()
+        start = time.monotonic()
+
+        # Wnck will normally already know about the new windows, in which case
+        # there's no need to read the window stack from the X server again
+        if type(object) is Bamf.Application:
+            window_control.update_screen(bamf_cache.get_windows(object))
+        elif type(object) is Bamf.Window:
+            window_control.update_screen([object])
 
         if (type(object) is Bamf.Application):
-            if object.is_user_visible():
+            if bamf_cache.is_user_visible(object):
                 dock_app = self.match_bamf_app_to_dock_app(object)
                 if dock_app is not None:
                     if dock_app.startup_id is None:
                         dock_app.pulse_once()
             else:
-                self.hidden_views.append(object)
-                object.connect_after("user-visible-changed", self.view_vis_changed)
+                if object not in self.hidden_views:
+                    self.hidden_views.append(object)
+                self.signals.connect(object, "user-visible-changed", self.view_vis_changed,
+                                     after=True)
 
-        elif (type(object) is Bamf.Window) and (object.is_user_visible()):
+        elif (type(object) is Bamf.Window) and (bamf_cache.is_user_visible(object)):
             the_app = matcher.get_application_for_window(object)
             # fix for #174
             if the_app is not None:
                 self.window_added(the_app, object)
 
+        self.record_view_handler_time(start)
+
+    def record_view_handler_time(self, start):
+        """ Record how long a Bamf view-opened or view-closed handler took,
+            if LOG_VIEW_HANDLER_TIMES is True
+
+        The longest and average times are logged once a burst of events
+        (e.g. many windows opening at once) is over
+
+        Args:
+            start : the time (from time.monotonic) the handler started
+        """
+
+        if not LOG_VIEW_HANDLER_TIMES:
+            return
+
+        self.view_handler_last = time.monotonic()
+        elapsed = self.view_handler_last - start
+        self.view_handler_count += 1
+        self.view_handler_total += elapsed
+        self.view_handler_max = max(self.view_handler_max, elapsed)
+
+        if self.view_handler_log_id == 0:
+            self.view_handler_log_id = GObject.timeout_add(1000, self.log_view_handler_times)
+
+    def log_view_handler_times(self):
+        """ Timer callback to log the times taken by Bamf view handlers once
+            there have been no events for a second
+
+        Returns:
+            True if the burst of events is still going on so that the timer
+            continues, False otherwise
+        """
+
+        if time.monotonic() - self.view_handler_last < 1:
+            return True
+
+        num_requests, num_updates = window_control.get_screen_update_counts()
+        log_it("view handlers: %d events, longest %.1fms, average %.1fms, "
+               "%d of %d Wnck screen updates done"
+               % (self.view_handler_count, self.view_handler_max * 1000,
+                  self.view_handler_total * 1000 / self.view_handler_count,
+                  num_updates, num_requests))
+
+        self.view_handler_count = 0
+        self.view_handler_total = 0
+        self.view_handler_max = 0
+        self.view_handler_log_id = 0
+        return False
+
     def view_vis_changed(self, view, object):
         """ Handler for the Bamf.View user visibilty changed signal
 
@@ -2721,10 +3012,10 @@ class Dock(object):
 
         """
 
-        if view.is_user_visible():
+        if bamf_cache.is_user_visible(view):
             self.view_opened(self.matcher, view)
             self.hidden_views.remove(view)
-            view.disconnect_by_func(self.view_vis_changed)
+            self.signals.disconnect(view, "user-visible-changed", self.view_vis_changed)
 
     def window_added(self, application, object):
         """
@@ -2742,7 +3033,10 @@ class Dock(object):
 
         """
 
-        if (object.get_window_type() not in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG]) or not object.is_user_visible():
+        bamf_cache.window_added(application, object)
+
+        if (bamf_cache.get_window_type(object) not in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG]) or \
+           not bamf_cache.is_user_visible(object):
             return
 
         # get the application for the new window
@@ -2752,8 +3046,8 @@ class Dock(object):
             dock_app = self.get_docked_app_by_bamf_window(object)
 
             if dock_app is None:
-                if application.get_desktop_file() is not None:
-                    dock_app = self.get_docked_app_by_desktop_file(application.get_desktop_file())
+                if bamf_cache.get_desktop_file(application) is not None:
+                    dock_app = self.get_docked_app_by_desktop_file(bamf_cache.get_desktop_file(application))
 
                 if dock_app is None:
                     # try again to to match the docked_app, but this time create a new one if it
@@ -2761,11 +3055,7 @@ class Dock(object):
                     dock_app = self.match_bamf_app_to_dock_app(application)
 
             # connect a signal handler so that we can detect when a window changes workspaces
-            win_type = object.get_window_type()
-            if (win_type == Bamf.WindowType.NORMAL) or (win_type == Bamf.WindowType.DIALOG):
-                wnck_win = Wnck.Window.get(object.get_xid())
-                if wnck_win is not None:
-                    wnck_win.connect("workspace-changed", self.window_ws_changed)
+            self.set_window_handlers(dock_app, object)
 
         # redraw the app's icon to update the number of indicators etc.
         if dock_app is not None:
@@ -2775,6 +3065,9 @@ class Dock(object):
                 self.show_or_hide_app_icons()
                 self.show_or_hide_indicators()
 
+            if dock_app.win_list_model is not None:
+                dock_app.win_list_model.add_window(object)
+
             # update minimize locations ...
             # at this point, the window will not be returned by application.get_windows() so
             # self.set_minimise_target(dock_app) will not work. Therefore we need to
@@ -2796,6 +3089,8 @@ class Dock(object):
 
         """
 
+        bamf_cache.window_removed(application, object)
+
         dock_app = self.get_docked_app_by_bamf_app(application)
         if dock_app is None:
             dock_app = self.get_docked_app_by_bamf_window(object)
@@ -2808,13 +3103,16 @@ class Dock(object):
 
         if dock_app is not None:
 
+            if dock_app.win_list_model is not None:
+                dock_app.win_list_model.remove_window(window_control.get_xid(object))
+
+            dock_app.mru_win_removed(object)
+
             # disconnect the signal we connected to the related wnck_window earlier
-            wnck_win = Wnck.Window.get(object.get_xid())
+            wnck_win = window_control.get_wnck_window(object)
             if wnck_win is not None:
-                try:
-                    wnck_win.disconnect_by_func(self.window_ws_changed)
-                except TypeError:
-                    pass
+                dock_app.signals.disconnect(wnck_win)
+                self.signals.disconnect(wnck_win)
 
             if dock_app.is_pinned:
                 dock_app.queue_draw()
@@ -2851,6 +3149,13 @@ class Dock(object):
         object -  the Bamf.Application or Bamf.Window that was closed
         """
 
+        start = time.monotonic()
+
+        if object in self.hidden_views:
+            # the view closed without ever being made visible
+            self.hidden_views.remove(object)
+            self.signals.disconnect(object)
+
         if type(object) is Bamf.Application:
 
             dock_app = self.get_docked_app_by_bamf_app(object)
@@ -2874,15 +3179,19 @@ class Dock(object):
                     self.remove_app_from_dock(dock_app)
 
                     # to prevent Bamf dbus errors remove signal handlers we added
-                    self.remove_bamf_app_handlers(object)
+                    self.remove_bamf_app_handlers(dock_app, object)
 
-                    self.set_all_apps_minimise_targets()
+                    self.do_after_layout(self.set_all_apps_minimise_targets)
         elif type(object is Bamf.Window):
+            win_thumbnails.forget(window_control.get_xid(object))
+
             the_app = matcher.get_application_for_window(object)
             # fix for #174
             if the_app is not None:
                 self.window_removed(the_app, object)
 
+        self.record_view_handler_time(start)
+
     def do_urgent_changed(self, view, object):
         """ Handler for the Bamf.Application urgent changed signal
 
@@ -3058,6 +3367,14 @@ class Dock(object):
                 app_pos = self.get_visible_app_index(app)
 
         self.app_list.remove(app)
+        self.icon_serials.pop(app, None)
+        app.signals.disconnect_all()
+        if app.win_list_model is not None:
+            app.win_list_model.destroy()
+            app.win_list_model = None
+        if app.icon_key is not None:
+            surface_store.release(app.icon_key)
+            app.icon_key = None
 
         if not build_gtk2:
             if self.dock_fixed_size == -1:
@@ -3171,25 +3488,32 @@ class Dock(object):
 
         dock_app.icon_filename = None
         scale_factor = self.box.get_scale_factor()
+        pixel_size = icon_size * scale_factor
         pixbuf = None
-        pixbuf_s = None
+
+        # work out where the icon is going to come from - the actual loading
+        # and scaling is done by icon_loader on a worker thread
+        src_type = None
+        source = None
 
         # try to get the icon from wnck
         if dock_app.icon_name == "wnck":
             win = dock_app.get_first_normal_win()
             if win is not None:
-                pixbuf = window_control.get_icon_pb(win)
-                if pixbuf is not None:
-                    # scale at best quality
-                    pixbuf = pixbuf.scale_simple(icon_size * scale_factor, icon_size * scale_factor,
-                                                 GdkPixbuf.InterpType.HYPER)
-                    # scale to the correct size
+                source = window_control.get_icon_pb(win)
+                if source is not None:
+                    # it'll be scaled at best quality by the loader
+                    src_type = icon_loader.SRC_PIXBUF
                     dock_app.icon_filename = "wnck"  # we got it from wnck
 
         # look up the icon filename using Gtk
-        if pixbuf is None and dock_app.has_desktop_file():
-            dai = Gio.DesktopAppInfo.new_from_filename(dock_app.desktop_file)
-            the_icon = dai.get_icon()
+        if src_type is None and dock_app.has_desktop_file():
+            entry = desktop_cache.get_entry(dock_app.desktop_file)
+            if entry is not None:
+                the_icon = entry.app_info.get_icon()
+            else:
+                the_icon = None
+
             if the_icon is Gio.ThemedIcon:
                 icon_info = self.icontheme.choose_icon_for_scale(the_icon.get_names(),
                                                                  icon_size, scale_factor,
@@ -3202,12 +3526,17 @@ class Dock(object):
             if icon_info is not None:
                 dock_app.icon_filename = icon_info.get_filename()
 
-                try:
-                    pixbuf = icon_info.load_icon()
-                except GLib.GError:
-                    pixbuf = None
+                if dock_app.icon_filename is not None:
+                    src_type = icon_loader.SRC_FILE
+                    source = dock_app.icon_filename
+                else:
+                    # not a file (e.g. a builtin icon) so it can only be loaded here
+                    try:
+                        pixbuf = icon_info.load_icon()
+                    except GLib.GError:
+                        pixbuf = None
 
-        if pixbuf is None:
+        if src_type is None and pixbuf is None:
             # we couldn't get the icon from the .desktop or wnck but there a still a few
             # things we can do...
             #
@@ -3226,63 +3555,147 @@ class Dock(object):
             # 2 .. sloooow         - iterate through each installed icon theme and try to
             #                        find the app - not implement for now
 
-            # the png method. look for lower and uppercased variations of the filename
-            # and note that all files in /usr/share/pixmaps are .png
+            # the fallback locations are indexed by icon_index, so there's no
+            # need to probe each of them for the icon file
 
-            icon_file = ""
             if os.path.isfile(dock_app.icon_name):
                 icon_file = dock_app.icon_name
-                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(dock_app.icon_name,
-                                                                icon_size * scale_factor,
-                                                                icon_size * scale_factor)
             else:
-                icon_name = dock_app.icon_name
+                icon_file = icon_index.find_icon(dock_app.icon_name, pixel_size)
 
-                # look in the 'hicolor' icon directories for the icon file
-                icon_path = "/usr/share/icons/hicolor/%dx%d/apps/" % (icon_size * scale_factor, icon_size * scale_factor)
-                if os.path.isfile("%s%s" % (icon_path, icon_name)):
-                    icon_file = "%s%s" % (icon_path, icon_name)
-                else:
-                    icon_path = os.path.expanduser("~/.local/share/icons/hicolor/%dx%d/apps/"
-                                                   % (icon_size * scale_factor, icon_size * scale_factor))
-                    if os.path.isfile("%s%s" % (icon_path, icon_name)):
-                        icon_file = "%s%s" % (icon_path, icon_name)
-
-                # if we still haven't found the icon, look in
-                # /usr/share/pixmaps for a .png file
-                if icon_file == "":
-                    icon_name = os.path.splitext(dock_app.icon_name)[0]  # remove any extension
-                    if os.path.isfile("/usr/share/pixmaps/%s.png" % icon_name):
-                        icon_file = "/usr/share/pixmaps/%s.png" % icon_name
-                    elif os.path.isfile("/usr/share/pixmaps/%s.png" % icon_name.upper()):
-                        icon_file = "/usr/share/pixmaps/%s.png" % icon_name.upper()
-                    elif os.path.isfile("/usr/share/pixmaps/%s.png" % icon_name.lower()):
-                        icon_file = "/usr/share/pixmaps/%s.png" % icon_name.lower()
-
-                # final attempt - look in ~/.local/share/icons for the icon
-            if icon_file == "":
-                if os.path.isfile(os.path.expanduser("~/.local/share/icons/%s" % dock_app.icon_name)):
-                    icon_file = os.path.expanduser("~/.local/share/icons/%s" % dock_app.icon_name)
-
-                # if we've found an icon, load it
-                if icon_file != "":
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(icon_file,
-                                                                    icon_size * scale_factor,
-                                                                    icon_size * scale_factor)
-                else:
-                    # if not, use a stock icon to represent the app
-                    pixbuf = self.applet.render_icon(Gtk.STOCK_EXECUTE,
-                                                     stock_size, None)
-                    dock_app.icon_filename = "STOCK_EXECUTE"
-
-        # we should now have an icon - either the app's own icon or the
-        # stock_execute ..
+            if icon_file != "":
+                src_type = icon_loader.SRC_FILE
+                source = icon_file
 
         dock_app.set_drawing_area_size(size)
-        dock_app.set_pixbuf(pixbuf)
-        surface = Gdk.cairo_surface_create_from_pixbuf(pixbuf, scale_factor, None)
+
+        # icons are shared between apps via the surface store, so if another
+        # app is already using the same icon there's no need to load it
+        stock_key = self.get_stock_key(stock_size, scale_factor)
+        if src_type == icon_loader.SRC_FILE:
+            key = (surface_store.file_source(source), pixel_size, scale_factor)
+        elif src_type == icon_loader.SRC_PIXBUF:
+            key = (surface_store.pixbuf_source(source), pixel_size, scale_factor)
+        elif pixbuf is not None:
+            key = (surface_store.pixbuf_source(pixbuf), pixel_size, scale_factor)
+        else:
+            # use a stock icon to represent the app
+            key = stock_key
+            dock_app.icon_filename = "STOCK_EXECUTE"
+
+        if surface_store.contains(key) or src_type is None:
+            self.icon_serials.pop(dock_app, None)
+            if key == stock_key:
+                pixbuf = self.get_stock_icon(stock_size)
+
+            self.set_app_icon_from_store(dock_app, key, pixbuf)
+            return
+
+        # show a placeholder until the icon has been loaded. The serial number
+        # lets us ignore the results of any earlier load for this app which
+        # finishes after this one
+        self.icon_serial += 1
+        self.icon_serials[dock_app] = self.icon_serial
+        self.set_app_icon_from_store(dock_app, stock_key, self.get_stock_icon(stock_size))
+
+        icon_loader.load_icon(src_type, source, pixel_size, docked_app.get_backlight_color,
+                              self.app_icon_loaded, dock_app, key, stock_key, self.icon_serial)
+
+    def app_icon_loaded(self, pixbuf, color, dock_app, key, stock_key, serial):
+        """ Callback for when an app's icon has been loaded in the background
+
+        Args:
+            pixbuf : the loaded GdkPixbuf.Pixbuf, or None if it couldn't be loaded
+            color : the icon's backlight colour
+            dock_app : the DockedApp the icon belongs to
+            key : the surface_store key of the icon
+            stock_key : the surface_store key of the stock icon to use if the
+                        icon couldn't be loaded
+            serial : the serial number of the load
+        """
+
+        if self.icon_serials.get(dock_app) != serial:
+            # a later load for this app has been requested, or the app
+            # has been removed from the dock
+            return
+
+        del self.icon_serials[dock_app]
+
+        if pixbuf is None:
+            key = stock_key
+            color = None
+            if not surface_store.contains(key):
+                pixbuf = self.get_stock_icon(key[0][1])
+            dock_app.icon_filename = "STOCK_EXECUTE"
+
+        self.set_app_icon_from_store(dock_app, key, pixbuf, color)
+        dock_app.queue_draw()
+
+    def set_app_icon_from_store(self, dock_app, key, pixbuf=None, color=None):
+        """ Set an app's icon pixbuf and surface to an icon from the surface
+            store, adding the icon to the store if it's not already there
+
+        The app's previous icon is released
+
+        Args:
+            dock_app : the DockedApp
+            key : the surface_store key of the icon
+            pixbuf : the icon's GdkPixbuf.Pixbuf - only needed if the icon is
+                     not already in the store
+            color : the icon's backlight colour, or None if it needs to be
+                    calculated
+        """
+
+        if not surface_store.contains(key) and color is None:
+            color = docked_app.get_backlight_color(pixbuf)
+
+        pixbuf, color, surface = surface_store.acquire(key, pixbuf, color)
+
+        if dock_app.icon_key is not None:
+            surface_store.release(dock_app.icon_key)
+        dock_app.icon_key = key
+
+        dock_app.set_pixbuf(pixbuf, color)
         dock_app.set_surface(surface)
 
+    def get_stock_icon(self, stock_size):
+        """ Get the stock execute icon, which is used for apps with no icon
+            and while an app's own icon is being loaded
+
+        Args:
+            stock_size : the Gtk.IconSize required
+
+        Returns:
+            a GdkPixbuf.Pixbuf, or None if the icon is already in the surface
+            store
+        """
+
+        key = self.get_stock_key(stock_size, self.box.get_scale_factor())
+        if surface_store.contains(key):
+            return None
+
+        return self.applet.render_icon(Gtk.STOCK_EXECUTE, stock_size, None)
+
+    def get_stock_key(self, stock_size, scale_factor):
+        """ Get the surface store key of the stock execute icon
+
+        Like every other key, the second item is the size of the icon in
+        pixels
+
+        Args:
+            stock_size : the Gtk.IconSize of the icon
+            scale_factor : the scale factor of the icon
+
+        Returns:
+            a tuple
+        """
+
+        valid, width, height = Gtk.icon_size_lookup(stock_size)
+        if not valid:
+            width = 0
+
+        return (("stock", stock_size, self.icon_theme_serial), width, scale_factor)
+
     def set_size_hints(self):
         """ Set the size hints for the applet
         """
@@ -3445,6 +3858,26 @@ class Dock(object):
                 ScrollAnimator(self.scrolled_win, startpos, endpos,
                                self.panel_orient, 16, 5, self.scroll_anim_finished_cb)
 
+        self.restore_unity_state(dock_app)
+
+    def restore_unity_state(self, dock_app):
+        """ Set an app's counter, progress and urgency to their last known
+            values
+
+        Unity LauncherEntry updates are only sent when an app's state changes,
+        so an app added to the dock after an update was sent (or after the
+        panel restarts) would otherwise not show it
+
+        Args:
+            dock_app : the DockedApp
+        """
+
+        props = unity_state.get(os.path.basename(dock_app.desktop_file))
+        if props is not None:
+            dock_app.set_unity_state(props.get("count-visible"), props.get("count"),
+                                     props.get("progress-visible"), props.get("progress"),
+                                     props.get("urgent"))
+
     def get_app_by_pos(self, position):
         """
             Get the app at a specified position in the dock
@@ -3527,17 +3960,21 @@ class Dock(object):
         self.show_or_hide_app_icons()
         self.show_or_hide_indicators()
 
-        # set up signal handlers
-        self.matcher.connect("active-window-changed",
+        # set up signal handlers - the matcher and wnck screen are shared with
+        # any other docks, so the handlers are recorded so they can be
+        # disconnected if this dock is removed
+        self.signals.connect(self.matcher, "active-window-changed",
                              self.active_win_changed)
-        self.matcher.connect("active_application_changed",
+        self.signals.connect(self.matcher, "active_application_changed",
                              self.active_app_changed)
-        self.matcher.connect_after("view-opened", self.view_opened)
-        self.matcher.connect_after("view-closed", self.view_closed)
+        self.signals.connect(self.matcher, "view-opened", self.view_opened, after=True)
+        self.signals.connect(self.matcher, "view-closed", self.view_closed, after=True)
         self.box.connect("style-updated", self.update_colours)
 
-        self.wnck_screen.connect("active-workspace-changed",
-                                 self.active_workspace_changed)
+        self.signals.connect(self.wnck_screen, "active-workspace-changed",
+                             self.active_workspace_changed)
+        self.signals.connect(self.wnck_screen, "window-closed",
+                             self.wnck_window_closed)
 
     def set_size_request(self):
         """ Set the dock's size request
@@ -4033,9 +4470,20 @@ class Dock(object):
 
         self.app_win_list.the_app = highlighted_app
 
-        # add any open windows
+        # add any open windows - the app's list of windows is kept up to date
+        # as windows are opened and closed, so it is created only once
         if highlighted_app.is_running():
-            self.app_win_list.setup_list(self.win_from_cur_ws_only)
+            if highlighted_app.win_list_model is None:
+                highlighted_app.win_list_model = dock_win_list.WinListModel(highlighted_app.signals)
+
+            mru_wins = None
+            if self.win_list_mru_order:
+                mru_wins = highlighted_app.get_mru_windows()
+
+            self.app_win_list.setup_list(self.win_from_cur_ws_only,
+                                         self.win_list_thumbnails,
+                                         highlighted_app.win_list_model,
+                                         mru_wins)
 
         self.app_win_list.clear_mouse_areas()
 
@@ -4111,17 +4559,11 @@ class Dock(object):
 
             # if we're restoring all windows, do this now before we finally
             # activate the last active window
-            for win in app.get_windows():
-                win_type = win.get_window_type()
-                if (win_type in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG] or
-                    win.is_user_visible()) and (win != last_active_win):
-                    window_control.activate_win(win)
-                    sleep(0.01)
-
-                app.last_active_win = last_active_win
+            window_control.restore_windows(self.get_windows_to_restore(app, last_active_win))
+            app.last_active_win = last_active_win
 
             if last_active_win is not None:
-                wnck_win = Wnck.Window.get(last_active_win.get_xid())
+                wnck_win = window_control.get_wnck_window(last_active_win)
 
                 if wnck_win is not None:
                     wnck_aws = self.wnck_screen.get_active_workspace()
@@ -4135,33 +4577,50 @@ class Dock(object):
                     if wnck_aws is not None and wnck_ws is not None and \
                        (wnck_aws != wnck_ws):
                         wnck_ws.activate(0)
-                        sleep(0.01)
 
             # rarely, the last active win does not end up as the active window
             # if we activate here, so instead a workaround which seems to do
-            # the trick is use a timer as below
-            
+            # the trick is use a timer as below. The timer also gives the
+            # window manager time to deal with the workspace change and the
+            # other windows, so there's no need to sleep before it
+
             # fix for #176, don't send the current event time to the activation
             # timer
             GObject.timeout_add(20, win_activation_timer,
-                                [last_active_win, 0]) 
+                                [last_active_win, 0])
 
         else:
             # minimize all windows and do the last active window last of all
 
             last_active_win = app.last_active_win
-            for win in app.get_windows():
-                win_type = win.get_window_type()
-                if (win_type in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG] or
-                    win.is_user_visible()) and (win != last_active_win):
-                    window_control.minimise_win(win)
-                    sleep(0.01)
+            wins = self.get_windows_to_restore(app, last_active_win)
+            if last_active_win is not None:
+                wins.append(last_active_win)
 
+            window_control.minimise_windows(wins)
             app.last_active_win = last_active_win
 
-            if last_active_win is not None:
-                window_control.minimise_win(last_active_win)
-                sleep(0.01)
+    def get_windows_to_restore(self, app, last_active_win):
+        """ Get the windows of an app which are restored or minimised along with
+            its last active window
+
+        Args:
+            app : the docked app
+            last_active_win : the app's last active Bamf.Window, which is not
+                              included
+
+        Returns:
+            a list of Bamf.Windows
+        """
+
+        wins = []
+        for win in app.get_windows():
+            win_type = bamf_cache.get_window_type(win)
+            if (win_type in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG] or
+                bamf_cache.is_user_visible(win)) and (win != last_active_win):
+                wins.append(win)
+
+        return wins
 
     def activate_window(self, win):
         """ Activate a Bamf window, switching workspace as necessary
@@ -4172,7 +4631,7 @@ class Dock(object):
         if win is not None:
             # if the window to be activated is not on the current workspace,
             # switchto that workspace
-            wnck_win = Wnck.Window.get(win.get_xid())
+            wnck_win = window_control.get_wnck_window(win)
             wnck_aws = self.wnck_screen.get_active_workspace()
             wnck_ws = wnck_win.get_workspace()
 
@@ -4208,11 +4667,11 @@ class Dock(object):
         is used
 
         Depending on the scroll direction, make the next or previous window of
-        the current app active. Scrolling will wrap around in both directions
+        the current app active. Windows are cycled through in most recently
+        used order, and scrolling will wrap around in both directions
 
-        If the app only has one window or we don't know which window was last
-        active (e.g. because the applet has only just started) then make the
-        first window active
+        If the app isn't the active app, make its most recently active window
+        active
 
         If the new window is not on the current workspace, change to the
         relevant workspace
@@ -4244,28 +4703,15 @@ class Dock(object):
         if app.is_running() is False:
             return
 
-        windows = app.get_windows()
-        if (app.last_active_win is None) or (len(windows) == 1):
-            new_index = 0
-        else:
-            # work out which window we want to activate
-            if app.last_active_win in windows:
-                index = windows.index(app.last_active_win)
-            else:
-                index = 0  # in case of error activate the first window
+        # work out which window we want to activate
+        new_win = app.get_next_mru_win(scroll_dir == Gdk.ScrollDirection.DOWN)
+        if new_win is None:
+            return
 
-            if scroll_dir == Gdk.ScrollDirection.UP:
-                if index == 0:
-                    new_index = len(windows) - 1
-                else:
-                    new_index = index - 1
-            else:
-                if index == len(windows) - 1:
-                    new_index = 0
-                else:
-                    new_index = index + 1
+        wnck_win = window_control.get_wnck_window(new_win)
+        if wnck_win is None:
+            return
 
-        wnck_win = Wnck.Window.get(windows[new_index].get_xid())
         # hide the window list and stop any timer
         self.hide_win_list()
         self.stop_act_list_timer()
@@ -4281,7 +4727,7 @@ class Dock(object):
             sleep(0.01)
 
         # activate the new window
-        window_control.activate_win(windows[new_index])
+        window_control.activate_win(new_win)
 
     def get_dragee(self):
         """"
@@ -4685,8 +5131,11 @@ class Dock(object):
     def unity_cb_handler(self, app_uri, args):
         """ Handler for Unity API dbus messages
 
-        If the specified app is in the dock, forward the set the progress
-        and/or count, and redraw the app's icon
+        Apps such as download managers can send many updates a second, so
+        rather than being applied straight away the update is merged with any
+        others for the same app which have not yet been applied. All pending
+        updates are applied together by a timer, at no more than
+        UNITY_UPDATE_HZ (or the display refresh rate)
 
         Args:
             app_uri : the basename of the .desktop file of the app
@@ -4694,26 +5143,68 @@ class Dock(object):
 
         """
 
+        self.unity_received += 1
+
         # remove the leading part of the app uri
         df = app_uri.split("://")[1]
 
-        # search for the an app which has the same desktop file name
+        props = {key: args[key] for key in UNITY_PROPS if key in args}
+        if props == {}:
+            return
+
+        self.unity_pending.setdefault(df, {}).update(props)
+
+        if self.unity_timer_id == 0:
+            self.unity_timer_id = GObject.timeout_add(self.get_unity_update_interval(),
+                                                      self.do_unity_update)
+
+    def get_unity_update_interval(self):
+        """ Get the interval between applying batches of Unity updates
+
+        Returns:
+            the interval in ms
+        """
+
+        rate = UNITY_UPDATE_HZ
+        if rate <= 0:
+            rate = 60
+            window = self.applet.get_window()
+            if not build_gtk2 and window is not None:
+                monitor = Gdk.Display.get_default().get_monitor_at_window(window)
+                if monitor is not None and monitor.get_refresh_rate() > 0:
+                    # get_refresh_rate returns milli-Hz
+                    rate = monitor.get_refresh_rate() / 1000
+
+        return max(int(1000 / rate), 1)
+
+    def do_unity_update(self):
+        """ Timer callback to apply pending Unity updates to the apps in the
+            dock
+
+        Returns:
+            False, so that the timer is not repeated
+        """
+
+        self.unity_timer_id = 0
+
+        pending = self.unity_pending
+        self.unity_pending = {}
+
         for app in self.app_list:
-            app_df_path, app_df = os.path.split(app.desktop_file)
-            if app_df == df:
-                # we've found the app - update it...
-
-                if "count-visible" in args:
-                    app.set_counter_visible(args["count-visible"])
-                if "count" in args:
-                    app.set_counter_value(args["count"])
-
-                if "progress-visible" in args:
-                    app.set_progress_visible(args["progress-visible"])
-                if "progress" in args:
-                    app.set_progress_value(args["progress"])
+            props = pending.pop(os.path.basename(app.desktop_file), None)
+            if props is None:
+                continue
+
+            if app.set_unity_state(props.get("count-visible"), props.get("count"),
+                                   props.get("progress-visible"), props.get("progress"),
+                                   props.get("urgent")):
+                self.unity_applied += 1
+
+            if pending == {}:
                 break
 
+        return False
+
     # TODO: could do with being a property
     def get_drag_coords(self):
         return self.drag_x, self.drag_y
@@ -4739,6 +5230,41 @@ def win_activation_timer(args):
         False - to cancel the timer
     """
 
-    window_control.activate_win(args[0], args[1])
-    sleep(0.01)
+    if args[0] is not None:
+        window_control.activate_win(args[0], args[1])
+
     return False
+
+
+def main():
+    """Main function.
+
+    Stress test - open 50 windows at once, and close them all again a few
+    seconds later. Run this while the dock is on a panel with
+    LOG_VIEW_HANDLER_TIMES set to True: once each burst of events is over the
+    dock logs (see log_it) the number of Bamf view-opened and view-closed
+    events and the longest time any one of its handlers took
+    """
+
+    num_windows = 50
+    windows = []
+
+    def close_windows():
+        for win in windows:
+            win.destroy()
+
+        Gtk.main_quit()
+        return False
+
+    for win_no in range(num_windows):
+        win = Gtk.Window(title="Dock stress test %d" % (win_no + 1))
+        win.set_default_size(200, 100)
+        win.show_all()
+        windows.append(win)
+
+    GObject.timeout_add(5000, close_windows)
+    Gtk.main()
+
+
+if __name__ == "__main__":
+    main()
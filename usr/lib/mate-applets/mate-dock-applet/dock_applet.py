@@ -49,6 +49,7 @@ gi.require_version("MatePanelApplet", "4.0")
 import os
 import sys
 import threading
+import time
 sys.path.insert(1, '/usr/lib/python3.7/site-packages')
 
 from Xlib.display import Display
@@ -66,6 +67,7 @@ from urllib.parse import urlparse
 
 import docked_app
 import dock
+import dock_services
 
 from log_it import log_it as log_it
 
@@ -79,6 +81,17 @@ keyb_shortcuts = ["<Super>1", "<Super>2", "<Super>3", "<Super>4", "<Super>5",
                   "<Super><Alt>1", "<Super><Alt>2", "<Super><Alt>3", "<Super><Alt>4", "<Super><Alt>5",
                   "<Super><Alt>6", "<Super><Alt>7", "<Super><Alt>8", "<Super><Alt>9", "<Super><Alt>0"]
 
+# '<Super><Shift>1' to '<Super><Shift>0' will start a new instance of apps
+# 1 to 10, in the same way as shift clicking an app
+keyb_new_instance_shortcuts = ["<Super><Shift>1", "<Super><Shift>2", "<Super><Shift>3",
+                               "<Super><Shift>4", "<Super><Shift>5", "<Super><Shift>6",
+                               "<Super><Shift>7", "<Super><Shift>8", "<Super><Shift>9",
+                               "<Super><Shift>0"]
+
+# the actions a keyboard shortcut can perform
+SHORTCUT_ACTIVATE = "activate"
+SHORTCUT_NEW_INSTANCE = "new-instance"
+
 
 def applet_button_press(widget, event, the_dock):
     """Button press event for the applet
@@ -196,6 +209,10 @@ def applet_enter_notify(widget, event, the_dock):
         the_dock : the Dock object
     """
 
+    # an auto-hiding panel moves without the applet being told, so the dock's
+    # position needs to be read again now that the panel is visible
+    the_dock.invalidate_dock_root_coords()
+
     # get the app underneath the mouse cursor
     app = the_dock.get_app_at_mouse(event.x, event.y)
 
@@ -316,6 +333,7 @@ def applet_change_orient(applet, orient, the_dock):
         the_dock : the Dock object
     """
 
+    the_dock.invalidate_dock_root_coords()
     the_dock.set_new_orientation(orient)
     the_dock.applet.show_all()
     the_dock.show_or_hide_app_icons()
@@ -333,11 +351,66 @@ def applet_size_allocate(applet, allocation, the_dock):
         the_dock : the Dock object
     """
 
+    the_dock.invalidate_dock_root_coords()
+
     if the_dock.nice_sizing:
         the_dock.fit_to_alloc()
     return
 
 
+def applet_configure(widget, event, the_dock):
+    """ Handler for the configure event of the applet's toplevel window
+
+    The applet may have moved, so the dock's position needs to be read again
+
+    Args :
+        widget : the toplevel window
+        event : the Gdk.EventConfigure
+        the_dock : the Dock object
+    """
+
+    the_dock.invalidate_dock_root_coords()
+    return False
+
+
+def applet_monitors_changed(screen, the_dock):
+    """ Handler for the monitors-changed signal of the applet's screen
+
+    The panel may have moved along with the monitor it is on, so the dock's
+    position needs to be read again
+
+    Args :
+        screen : the Gdk.Screen
+        the_dock : the Dock object
+    """
+
+    the_dock.invalidate_dock_root_coords()
+    the_dock.set_all_apps_minimise_targets()
+
+
+def applet_screen_changed(applet, previous_screen, the_dock):
+    """ Handler for the applet's screen-changed signal
+
+    Monitor the new screen rather than the old one, and read the dock's
+    position again
+
+    Args :
+        applet : the applet
+        previous_screen : the Gdk.Screen the applet was on, or None
+        the_dock : the Dock object
+    """
+
+    if previous_screen is not None:
+        the_dock.signals.disconnect(previous_screen, "monitors-changed")
+
+    screen = applet.get_screen()
+    if screen is not None:
+        the_dock.signals.connect(screen, "monitors-changed", applet_monitors_changed, the_dock)
+
+    the_dock.invalidate_dock_root_coords()
+    the_dock.set_all_apps_minimise_targets()
+
+
 def applet_change_size(applet, size, the_dock):
     """Handler for the applet change size event
 
@@ -350,10 +423,29 @@ def applet_change_size(applet, size, the_dock):
         the_dock : the Dock object
     """
 
+    the_dock.invalidate_dock_root_coords()
+
     for app in the_dock.app_list:
         the_dock.set_app_icon(app, size)
 
 
+def applet_destroy(applet, the_dock):
+    """ Handler for the applet destroy event
+
+    Make sure any pending changes to the dock's settings are saved, stop
+    the dock receiving Unity messages, and disconnect the dock's signal
+    handlers
+
+    Args:
+        applet : the applet being destroyed
+        the_dock : the Dock object
+    """
+
+    the_dock.settings_writer.flush()
+    dock_services.unregister_dock(the_dock)
+    the_dock.disconnect_signals()
+
+
 def applet_scroll_event(applet, event, the_dock):
     """ Handler for the scroll event
 
@@ -555,26 +647,30 @@ def applet_drag_motion(widget, context, x, y, time, the_dock):
     return True
 
 
-def applet_shortcut_handler(keybinder, the_dock):
+def applet_shortcut_handler(keybinder, action, app_no, press_time, the_dock):
     """ Handler for global keyboard shortcut presses
 
-    Start the app if it isn't already running
+    Start the app if it isn't already running, or if a new instance of it was
+    requested
 
     If it is already runnning cycle through its windows ...
 
-    :param keybinder: the keybinder object with the keystring which was pressed e.g. "<Super>4"
+    :param keybinder: the GlobalKeyBinding which received the key press
+    :param action: the action to perform, SHORTCUT_ACTIVATE or SHORTCUT_NEW_INSTANCE
+    :param app_no: the position in the dock of the app to perform the action on
+    :param press_time: the time (from time.monotonic) the key was pressed
     :param the_dock: the dock...
     """
-    # get the position in the dock of the app we need to activate
-    if keybinder.current_shortcut in keybinder.shortcuts:
-        app_no = keybinder.shortcuts.index(keybinder.current_shortcut)
 
     app = the_dock.get_app_by_pos(app_no)
     if app is not None:
-        start_app = app.is_running() is False
+        start_app = (app.is_running() is False) or (action == SHORTCUT_NEW_INSTANCE)
         if start_app:
             app.start_app()
         else:
+            # record when the key was pressed, so the time taken for the app's
+            # window to become active can be logged
+            the_dock.set_shortcut_press(app, press_time)
 
             # if the app only has a single window minimize or restore it
             # otherwise scroll through all available windows
@@ -583,6 +679,9 @@ def applet_shortcut_handler(keybinder, the_dock):
             else:
                 the_dock.do_window_scroll(Gdk.ScrollDirection.DOWN, 0, app)
 
+        log_it("shortcut: %s app %d handled in %.1fms" % (action, app_no + 1,
+                                                          (time.monotonic() - press_time) * 1000))
+
 
 def applet_fill(applet):
     """
@@ -639,6 +738,17 @@ def applet_fill(applet):
     applet.connect("change-size", applet_change_size, the_dock)
     applet.connect("scroll-event", applet_scroll_event, the_dock)
     applet.connect("size-allocate", applet_size_allocate, the_dock)
+    applet.connect("destroy", applet_destroy, the_dock)
+    applet.connect("screen-changed", applet_screen_changed, the_dock)
+
+    toplevel = applet.get_toplevel()
+    if toplevel.is_toplevel():
+        toplevel.connect("configure-event", applet_configure, the_dock)
+
+    # the screen outlives the applet, so its handler is connected through the
+    # dock's signal registry and is disconnected when the applet is destroyed
+    the_dock.signals.connect(applet.get_screen(), "monitors-changed",
+                             applet_monitors_changed, the_dock)
 
     if not build_gtk2:
         # set up drag and drop - gtk3 only
@@ -668,8 +778,10 @@ def applet_fill(applet):
 
     # set up keyboard shortcuts used to activate apps in the dock
     keybinder = GlobalKeyBinding()
-    for shortcut in keyb_shortcuts:
-        keybinder.grab(shortcut)
+    for app_no, shortcut in enumerate(keyb_shortcuts):
+        keybinder.grab(shortcut, SHORTCUT_ACTIVATE, app_no)
+    for app_no, shortcut in enumerate(keyb_new_instance_shortcuts):
+        keybinder.grab(shortcut, SHORTCUT_NEW_INSTANCE, app_no)
     keybinder.connect("activate", applet_shortcut_handler, the_dock)
     keybinder.start()
 
@@ -698,8 +810,19 @@ def applet_factory(applet, iid, data):
 
 
 class GlobalKeyBinding(GObject.GObject, threading.Thread):
+    """ Class to grab global keyboard shortcuts and listen for them being
+        pressed
+
+        Attributes:
+            shortcuts : a dict of (keycode, modifiers) -> tuple of the action
+                        and the position in the dock of the app the shortcut
+                        applies to
+            grabs : a set of the (keycode, modifiers) key grabs which have
+                    been made
+    """
+
     __gsignals__ = {
-        'activate': (GObject.SignalFlags.RUN_LAST, None, ()),
+        'activate': (GObject.SignalFlags.RUN_LAST, None, (str, int, float)),
     }
 
     def __init__(self):
@@ -711,13 +834,34 @@ class GlobalKeyBinding(GObject.GObject, threading.Thread):
         self.screen = self.display.screen()
         self.window = self.screen.root
         self.keymap = Gdk.Keymap().get_default()
-        self.ignored_masks = self.get_mask_combinations(X.LockMask | X.Mod2Mask | X.Mod5Mask)
+        self.ignored_masks = self.get_mask_combinations(self.get_lock_mask())
         self.map_modifiers()
-        self.shortcuts = []
+        self.shortcuts = {}
+        self.grabs = set()
+        self.event_mask_set = False
 
     def get_mask_combinations(self, mask):
         return [x for x in range(mask + 1) if not (x & ~mask)]
 
+    def get_lock_mask(self):
+        """ Get the lock modifiers (e.g. caps lock and num lock) which are
+            actually mapped to keys
+
+        Key grabs have to be made for every combination of these, so
+        modifiers which no key sets are left out
+
+        Returns:
+            int : a mask of the modifiers
+        """
+
+        mask = 0
+        for index, keycodes in enumerate(self.display.get_modifier_mapping()):
+            modifier = 1 << index
+            if (modifier & (X.LockMask | X.Mod2Mask | X.Mod5Mask)) and any(keycodes):
+                mask |= modifier
+
+        return mask
+
     def map_modifiers(self):
         gdk_modifiers = (Gdk.ModifierType.CONTROL_MASK, Gdk.ModifierType.SHIFT_MASK, Gdk.ModifierType.MOD1_MASK,
                          Gdk.ModifierType.MOD2_MASK, Gdk.ModifierType.MOD3_MASK, Gdk.ModifierType.MOD4_MASK, Gdk.ModifierType.MOD5_MASK,
@@ -727,14 +871,26 @@ class GlobalKeyBinding(GObject.GObject, threading.Thread):
             if "Mod" not in Gtk.accelerator_name(0, modifier) or "Mod4" in Gtk.accelerator_name(0, modifier):
                 self.known_modifiers_mask |= modifier
 
-    def idle(self):
-        self.emit("activate")
+    def idle(self, action, app_no, press_time):
+        self.emit("activate", action, app_no, press_time)
         return False
 
     def activate(self):
         GLib.idle_add(self.run)
 
-    def grab(self, shortcut):
+    def grab(self, shortcut, action, app_no):
+        """ Grab a keyboard shortcut
+
+        Args:
+            shortcut : the shortcut e.g. "<Super>1"
+            action : the action the shortcut performs
+            app_no : the position in the dock of the app the shortcut
+                     applies to
+
+        Returns:
+            bool : True if the shortcut was grabbed, False otherwise
+        """
+
         keycode = None
         accelerator = shortcut.replace("<Super>", "<Mod4>")
         keyval, modifiers = Gtk.accelerator_parse(accelerator)
@@ -745,18 +901,22 @@ class GlobalKeyBinding(GObject.GObject, threading.Thread):
             # In older Gtk3 the get_entries_for_keyval() returns an unnamed tuple...
             keycode = self.keymap.get_entries_for_keyval(keyval)[1][0].keycode
         modifiers = int(modifiers)
-        self.shortcuts.append([keycode, modifiers])
+        self.shortcuts[(keycode, modifiers)] = (action, app_no)
 
         # Request to receive key press/release reports from other windows that may not be using modifiers
-        catch = error.CatchError(error.BadWindow)
-        self.window.change_attributes(onerror=catch, event_mask=X.KeyPressMask)
-        if catch.get_error():
-            return False
+        if not self.event_mask_set:
+            catch = error.CatchError(error.BadWindow)
+            self.window.change_attributes(onerror=catch, event_mask=X.KeyPressMask)
+            if catch.get_error():
+                return False
+            self.event_mask_set = True
 
         catch = error.CatchError(error.BadAccess)
         for ignored_mask in self.ignored_masks:
             mod = modifiers | ignored_mask
-            result = self.window.grab_key(keycode, mod, True, X.GrabModeAsync, X.GrabModeAsync, onerror=catch)
+            if (keycode, mod) not in self.grabs:
+                self.window.grab_key(keycode, mod, True, X.GrabModeAsync, X.GrabModeAsync, onerror=catch)
+                self.grabs.add((keycode, mod))
         self.display.flush()
         if catch.get_error():
             return False
@@ -767,12 +927,13 @@ class GlobalKeyBinding(GObject.GObject, threading.Thread):
         while self.running:
             event = self.display.next_event()
             if (hasattr(event, 'state')):
-                modifiers = event.state & self.known_modifiers_mask
-                self.current_shortcut = None
-                if event.type == X.KeyPress and [event.detail, modifiers] in self.shortcuts:
-                    # Track this shortcut to know which app to activate
-                    self.current_shortcut = [event.detail, modifiers]
-                    GLib.idle_add(self.idle)
+                binding = None
+                if event.type == X.KeyPress:
+                    modifiers = event.state & self.known_modifiers_mask
+                    binding = self.shortcuts.get((event.detail, modifiers))
+
+                if binding is not None:
+                    GLib.idle_add(self.idle, binding[0], binding[1], time.monotonic())
                     self.display.allow_events(X.AsyncKeyboard, event.time)
                 else:
                     self.display.allow_events(X.ReplayKeyboard, event.time)
@@ -783,8 +944,8 @@ class GlobalKeyBinding(GObject.GObject, threading.Thread):
         self.display.close()
 
     def ungrab(self):
-        for shortcut in self.shortcuts:
-            self.window.ungrab_key(shortcut[0], X.AnyModifier, self.window)
+        for keycode in set(keycode for keycode, modifiers in self.grabs):
+            self.window.ungrab_key(keycode, X.AnyModifier, self.window)
 
 
 MatePanelApplet.Applet.factory_main("DockAppletFactory", True,
@@ -39,29 +39,111 @@ else:
 
 from gi.repository import Gtk
 from gi.repository import Gio
+from gi.repository import GLib
+from gi.repository import GObject
 
 import cairo
 
 import os
 import threading
+import time
+import xml.etree.ElementTree as ET
 
 import dom_color
 from collections import namedtuple
-from time import sleep
 
 from log_it import log_it as log_it
 
 ChangeTup = namedtuple('ChangeTup', ['settings', 'ored', 'ogreen', 'oblue',
-                                     'step_red', 'step_green', 'step_blue'])
+                                     'opacity', 'col_fmt'])
+
+# the formats a panel's colour can be stored in
+FMT_HEX = 0
+FMT_RGB = 1
+FMT_RGBA = 2
+
+# the duration of a panel colour transition in ms, and the maximum number
+# of steps it is made in
+TRANSITION_TIME = 500
+MAX_STEPS = 6
+
+
+def read_slideshow_xml(filename):
+    """ Read a GNOME/MATE slideshow wallpaper .xml file
+
+    The panel colour is changed at the start of each static slide, and also
+    at the start of each transition so that the panel changes along with the
+    wallpaper
+
+    Args:
+        filename : the .xml filename
+
+    Returns:
+        None if the file could not be read, otherwise a tuple of:
+            the start time of the slideshow (seconds since the epoch)
+            the total duration of the slideshow in seconds
+            a list of tuples of (offset from the start of the slideshow in
+            seconds, image filename) of the points where the panel colour
+            needs to change, in order of offset
+    """
+
+    def slide_file(element):
+        # a file can be specified once or at several different sizes, in
+        # which case use the largest
+        sizes = element.findall("size")
+        if sizes == []:
+            return (element.text or "").strip()
+
+        largest = max(sizes, key=lambda size: int(size.get("width", "0")))
+        return (largest.text or "").strip()
+
+    try:
+        root = ET.parse(filename).getroot()
+    except (OSError, ET.ParseError):
+        return None
+
+    start_time = 0
+    start = root.find("starttime")
+    if start is not None:
+        try:
+            fields = [int(start.findtext(name, "0")) for name in ["year", "month", "day",
+                                                                 "hour", "minute", "second"]]
+            start_time = time.mktime((fields[0], fields[1], fields[2], fields[3],
+                                      fields[4], fields[5], 0, 0, -1))
+        except (ValueError, OverflowError):
+            start_time = 0
+
+    changes = []
+    offset = 0.0
+    try:
+        for element in root:
+            if element.tag == "static":
+                image = slide_file(element.find("file"))
+            elif element.tag == "transition":
+                image = slide_file(element.find("to"))
+            else:
+                continue
+
+            if image != "":
+                changes.append((offset, image))
+            offset += float(element.findtext("duration", "0"))
+    except (AttributeError, ValueError):
+        return None
+
+    if changes == [] or offset <= 0:
+        return None
+
+    return start_time, offset, changes
 
 
 class PanelColorChanger(object):
     """ Class to change the color of the MATE panel(s) to the dominant color of
         the wallpaper image
 
-    Provide support for wallpaper images only - gradients, solid colours and
-    slideshows will be ignored
-    Change the panel color whenever the wallpaper image is changed
+    Provide support for wallpaper images and slideshows only - gradients and
+    solid colours will be ignored
+    Change the panel color whenever the wallpaper image is changed, or when
+    a slideshow moves on to the next image
     Allow only a specific panel's color to be changed, rather than all panels
 
     """
@@ -83,6 +165,9 @@ class PanelColorChanger(object):
         self.__red = self.__green = self.__blue = 0
         # will hold rgb of the dom color of the wallpaper
 
+        self.__palette = []
+        # will hold the rgb of the main colours of the wallpaper
+
         self.__bg_settings = Gio.Settings.new("org.mate.background")
 
         self.__pf = self.__bg_settings.get_string("picture-filename")
@@ -93,6 +178,19 @@ class PanelColorChanger(object):
 
         self.__toplevel_id = ""
 
+        # the state of the current panel colour transition
+        self.__transition_id = 0
+        self.__change_list = []
+        self.__step = self.__num_steps = 0
+
+        # the current slideshow, if the wallpaper is one. __slides is a tuple
+        # of start time, duration and colour changes as returned by
+        # read_slideshow_xml, __slide_palettes a dict of image filename ->
+        # palette
+        self.__slides = None
+        self.__slide_palettes = {}
+        self.__slide_timer_id = 0
+
     def enable_color_change(self):
         """ Enable panel color changing
 
@@ -108,6 +206,7 @@ class PanelColorChanger(object):
         Disconnect the event handler linked to wallpaper changes """
 
         self.__bg_settings.disconnect(self.__event_handler_id)
+        self.stop_slideshow()
 
     def do_change_panel_color(self):
         """ Change the panel colour
@@ -136,34 +235,192 @@ class PanelColorChanger(object):
             new_pf = self.__bg_settings.get_string("picture-filename")
             self.__pf = new_pf
 
-            # we're only interested if the wallpaper is an image file
+            self.stop_slideshow()
+
+            # we're only interested if the wallpaper is an image file or
+            # a slideshow
             if (new_pf is not None) and (new_pf != ""):
                 pic_ext = os.path.splitext(new_pf)[1]
                 if pic_ext.upper() != ".XML":
+                    target = self.get_dom_color
+                else:
+                    target = self.read_slideshow
+
+                # the image(s) are analysed on a worker thread, the panel
+                # colours are then changed from the main loop
+                worker_thread = threading.Thread(target=target, args=(new_pf,))
+                worker_thread.start()
+
+    def get_dom_color(self, filename):
+        """ Get  the dominant color of a desktop image - called on a worker
+            thread
+
+        The dominant colour is the first colour of the image's palette. Once
+        it has been found the panel colours are changed from the main loop
+
+        Args:
+            filename : the image filename
+        """
+
+        GLib.idle_add(self.dom_color_found, filename, self.get_palette(filename))
+
+    def get_palette(self, filename):
+        """ Get the palette of an image as a list of rgb tuples
+
+        Args:
+            filename : the image filename
+
+        Returns:
+            a list of tuples of red, green, blue integers
+        """
+
+        palette = []
+        for colstr in dom_color.get_palette(filename):
+            palette.append((int(colstr[0:2], 16),
+                            int(colstr[2:4], 16),
+                            int(colstr[4:6], 16)))
+
+        return palette
+
+    def read_slideshow(self, filename):
+        """ Read a slideshow and get the palettes of all of its images - called
+            on a worker thread
+
+        Once the palettes are known, the slideshow is started from the main
+        loop. Images are only analysed once, no matter how many times they
+        appear in the slideshow, and the results are cached by dom_color
+        so they're not re-analysed when the applet restarts
+
+        Args:
+            filename : the slideshow .xml filename
+        """
+
+        slides = read_slideshow_xml(filename)
+        if slides is None:
+            return
+
+        palettes = {}
+        for offset, image in slides[2]:
+            if image not in palettes:
+                try:
+                    palettes[image] = self.get_palette(image)
+                except OSError:
+                    # the image is missing or unreadable, so leave the panel
+                    # colour unchanged when it is shown
+                    palettes[image] = None
+
+        GLib.idle_add(self.slideshow_read, filename, slides, palettes)
 
-                    worker_thread = threading.Thread(target=self.change_panel_colors)
-                    worker_thread.start()
+    def slideshow_read(self, filename, slides, palettes):
+        """ Start changing the panel colours to match a slideshow
 
-    def get_dom_color(self):
-        """ Get  the dominant color of the current desktop image
+        Args:
+            filename : the slideshow .xml filename
+            slides : the slideshow details, as returned by read_slideshow_xml
+            palettes : a dict of image filename -> palette
+
+        Returns:
+            False, so that the idle callback is not repeated
+        """
+
+        # ignore the result if the wallpaper has changed again since
+        if filename == self.__pf:
+            self.stop_slideshow()
+            self.__slides = slides
+            self.__slide_palettes = palettes
+            self.show_current_slide()
+
+        return False
+
+    def show_current_slide(self):
+        """ Change the panel colours to match the slideshow's current image, and
+            set a timer to do so again when the slideshow moves on
+
+        Returns:
+            False, so that when called by the slideshow timer the timer is
+            not repeated
+        """
+
+        self.__slide_timer_id = 0
+        if self.__slides is None:
+            return False
+
+        start_time, duration, changes = self.__slides
+        elapsed = max(0, time.time() - start_time) % duration
+
+        # find the most recent colour change
+        index = 0
+        while index + 1 < len(changes) and changes[index + 1][0] <= elapsed:
+            index += 1
+
+        palette = self.__slide_palettes.get(changes[index][1])
+        if palette and (palette != self.__palette):
+            self.__palette = palette
+            if palette[0] != (self.__red, self.__green, self.__blue):
+                self.__red, self.__green, self.__blue = palette[0]
+                self.change_panel_colors()
+            elif self.update_cb is not None:
+                # the panel colour stays the same but the rest of the palette
+                # doesn't, so let the dock know
+                self.update_cb()
+
+        if index + 1 < len(changes):
+            next_change = changes[index + 1][0]
+        else:
+            next_change = duration
+
+        self.__slide_timer_id = GObject.timeout_add(int((next_change - elapsed) * 1000) + 1,
+                                                    self.show_current_slide)
+        return False
+
+    def stop_slideshow(self):
+        """ Stop changing the panel colours to match a slideshow """
+
+        if self.__slide_timer_id != 0:
+            GObject.source_remove(self.__slide_timer_id)
+            self.__slide_timer_id = 0
+
+        self.__slides = None
+        self.__slide_palettes = {}
+
+    def dom_color_found(self, filename, palette):
+        """ Change the panel colours once the dominant colour of a desktop
+            image has been found
+
+        Args:
+            filename : the image filename
+            palette : the image's palette - a list of rgb tuples
+
+        Returns:
+            False, so that the idle callback is not repeated
         """
 
-        colstr = dom_color.get_dom_color(self.__pf)
+        # ignore the result if the wallpaper has changed again since
+        if filename == self.__pf:
+            self.__palette = palette
+            self.__red, self.__green, self.__blue = palette[0]
+            self.change_panel_colors()
 
-        self.__red = int(colstr[0:2], 16)
-        self.__green = int(colstr[2:4], 16)
-        self.__blue = int(colstr[4:6], 16)
+        return False
 
     def change_panel_colors(self):
         """ Change panel colors to the rgb of the current dominant color
 
-            Change the colour smoothly over an interval of 0.5 seconds
+            Change the colour smoothly over an interval of 0.5 seconds, driven
+            by a main loop timer. The number of steps depends on how much the
+            colour is changing, and at each step the changes to each panel's
+            settings are applied in a single write
 
         """
 
-        self.get_dom_color()
+        # if a previous change is still in progress, stop it - the new
+        # change will start from whatever colour the panels have reached
+        if self.__transition_id != 0:
+            GObject.source_remove(self.__transition_id)
+            self.__transition_id = 0
 
         change_list = []  # initialise list of panels & settings we need to change
+        max_diff = 0
 
         # get the list of panels
         panel_list = self.__panel_settings.get_value("toplevel-id-list").unpack()
@@ -186,10 +443,9 @@ class PanelColorChanger(object):
 
                 # the color can be stored as either a set of rgba values or as
                 # an rgb hex ...
-                store_rgba = False
-                store_rgb = False
+                po = 1.0
                 if colstr.startswith("rgba"):
-                    store_rgba = True
+                    col_fmt = FMT_RGBA
                     colstrip = colstr[4:255]
                     colstrip = colstrip.strip("()")
                     cols = colstrip.split(",")
@@ -198,94 +454,86 @@ class PanelColorChanger(object):
                     pb = int(cols[2])
                     po = float(cols[3])
                 elif colstr.startswith("rgb"):
-                    store_rgb = True
+                    col_fmt = FMT_RGB
                     colstrip = colstr.strip("rgb()")
                     cols = colstrip.split(",")
                     pr = int(cols[0])
                     pg = int(cols[1])
                     pb = int(cols[2])
                 else:
+                    col_fmt = FMT_HEX
                     pr = int(colstr[1:3], 16)
                     pg = int(colstr[3:5], 16)
                     pb = int(colstr[5:7], 16)
 
-                # we're going to change the panel's color in 25 discrete steps,
-                # so get the difference we need to apply to each color
-                # component each step
-                if pr > self.__red:
-                    rs = -(pr - self.__red)
-                else:
-                    rs = self.__red - pr
+                max_diff = max(max_diff, abs(pr - self.__red), abs(pg - self.__green),
+                               abs(pb - self.__blue))
 
-                if pg > self.__green:
-                    gs = -(pg - self.__green)
-                else:
-                    gs = self.__green - pg
+                # make sure the panel in question is set to be a colour. The
+                # settings are delayed so that this and the first colour change
+                # are written together
+                psettings.delay()
+                if psettings.get_string("type") != "color":
+                    psettings.set_string("type", "color")
 
-                if pb > self.__blue:
-                    bs = -(pb - self.__blue)
-                else:
-                    bs = self.__blue - pb
+                change_list.append(ChangeTup(settings=psettings, ored=pr,
+                                             ogreen=pg, oblue=pb, opacity=po,
+                                             col_fmt=col_fmt))
+
+        if change_list == []:
+            return
+
+        # one step for every 32 levels of change in the colour component which
+        # changes most, so small changes are done in a single write
+        self.__num_steps = min(MAX_STEPS, max(1, max_diff // 32))
+        self.__step = 0
+        self.__change_list = change_list
+        if self.__num_steps == 1:
+            self.do_transition_step()
+        else:
+            self.__transition_id = GObject.timeout_add(TRANSITION_TIME // self.__num_steps,
+                                                       self.do_transition_step)
+
+    def do_transition_step(self):
+        """ Change the panel colours by one step of the transition
 
-                rs /= 25
-                gs /= 25
-                bs /= 25
+            Returns:
+                True if there are more steps to come, False otherwise
+        """
 
-                change_list.append(ChangeTup(settings=psettings, ored=pr,
-                                             ogreen=pg, oblue=pb, step_red=rs,
-                                             step_blue=bs, step_green=gs))
-
-        # now do the colour change
-        for loop in range(1, 25):
-            for change_item in change_list:
-                if loop == 1:
-                    # make sure the panel in question is set to be a colour
-                    change_item.settings.set_string("type", "color")
-
-                # work out new rgb values for this interval
-                new_red = int(change_item.ored +
-                              (loop * change_item.step_red)) & 0xff
-                new_blue = int(change_item.oblue +
-                               (loop * change_item.step_blue)) & 0xff
-                new_green = int(change_item.ogreen +
-                                (loop * change_item.step_green)) & 0xff
-                if store_rgba:
-                    change_item.settings.set_string("color",
-                                                    "rgba(%d,%d,%d,%0.6f)"
-                                                    % (new_red, new_green,
-                                                       new_blue, po))
-                elif store_rgb:
-                    change_item.settings.set_string("color",
-                                                    "rgb(%d,%d,%d)"
-                                                    % (new_red, new_green,
-                                                       new_blue))
-                else:
-                    change_item.settings.set_string("color",
-                                                    "#%.2x%.2x%.2x"
-                                                    % (new_red, new_green,
-                                                       new_blue))
-
-            # all panels have been changed for this step, so pause for a bit
-            sleep(0.02)
-
-        # now that we've had a smooth transition, set panel colours to the
-        # final value
-        for change_item in change_list:
-            if store_rgba:
-                change_item.settings.set_string("color",
-                                                "rgba(%d,%d,%d,%0.6f)"
-                                                % (self.__red, self.__green,
-                                                   self.__blue, po))
+        self.__step += 1
+        fraction = self.__step / self.__num_steps
+
+        for change_item in self.__change_list:
+            # work out new rgb values for this step
+            new_red = int(change_item.ored + fraction * (self.__red - change_item.ored)) & 0xff
+            new_green = int(change_item.ogreen + fraction * (self.__green - change_item.ogreen)) & 0xff
+            new_blue = int(change_item.oblue + fraction * (self.__blue - change_item.oblue)) & 0xff
+
+            if change_item.col_fmt == FMT_RGBA:
+                colstr = "rgba(%d,%d,%d,%0.6f)" % (new_red, new_green, new_blue,
+                                                   change_item.opacity)
+            elif change_item.col_fmt == FMT_RGB:
+                colstr = "rgb(%d,%d,%d)" % (new_red, new_green, new_blue)
             else:
-                change_item.settings.set_string("color",
-                                                "#%.2x%.2x%.2x"
-                                                % (self.__red, self.__green,
-                                                   self.__blue))
+                colstr = "#%.2x%.2x%.2x" % (new_red, new_green, new_blue)
+
+            change_item.settings.delay()
+            change_item.settings.set_string("color", colstr)
+            change_item.settings.apply()
+
+        if self.__step < self.__num_steps:
+            return True
+
+        self.__transition_id = 0
+        self.__change_list = []
 
         # finally, call the callback function
         if self.update_cb is not None:
             self.update_cb()
 
+        return False
+
     def wallpaper_filename(self):
         """ Get the desktop wallpaper image filename
         """
@@ -301,6 +549,17 @@ class PanelColorChanger(object):
 
         return self.__red, self.__green, self.__blue
 
+    def palette(self):
+        """ Get the main colours of the wallpaper image
+
+            Returns:
+                a list of tuples of red, green, blue integers, most prominent
+                colour first. The first colour is the one the panel(s) are
+                set to
+        """
+
+        return self.__palette
+
 
 class TestWindow(Gtk.Window):
     """Testing window for the color changer code"""
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+"""
+    Provide services which are shared by all of the docks in the applet
+    process
+
+    The panel can create several docks (one per panel) in the same process.
+    Rather than each dock doing the same work and holding its own copy of the
+    same data, the following are done once and shared:
+
+        the index of .desktop files used to find pinned apps
+        the table of hard to match apps read from app_match.xml
+        the Bamf.Matcher
+        the subscription to Unity LauncherEntry messages on D-Bus, which are
+        forwarded to every dock
+
+    Parsed .desktop files (desktop_cache), icon file locations (icon_index)
+    and icon surfaces (surface_store) are also shared between docks by their
+    own modules.
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+import gi
+
+gi.require_version("Bamf", "3")
+
+from gi.repository import Gio
+from gi.repository import GLib
+from gi.repository import Bamf
+
+import os
+import os.path
+from time import sleep
+
+import dbus
+from dbus.mainloop.glib import DBusGMainLoop
+
+import app_match
+import unity_state
+
+# the directories (and their subdirectories) searched for the .desktop files
+# of pinned apps, in order of priority
+DESKTOP_DIRS = ["/usr/share/applications/",
+                "/usr/local/share/applications/",
+                "/var/lib/snapd/desktop/applications/",
+                os.path.expanduser("~/.local/share/applications/")]
+
+# the docks in this process
+_docks = []
+
+_session_bus = None
+_unity_receiver = None
+_matcher = None
+_app_match = None
+
+# the .desktop file index - a dict of filename -> full path, or None if it
+# needs to be (re)built - and the Gio.FileMonitors used to detect when it
+# needs rebuilding
+_desktop_index = None
+_desktop_monitors = {}
+
+# modification times of directories which could not be monitored, checked
+# each time the index is used
+_desktop_unmonitored_mtimes = {}
+
+
+def get_session_bus():
+    """ Get the D-Bus session bus, setting up the GLib main loop integration
+        the first time it's called
+
+    Returns:
+        a dbus.SessionBus
+    """
+
+    global _session_bus
+
+    if _session_bus is None:
+        DBusGMainLoop(set_as_default=True)
+        _session_bus = dbus.SessionBus()
+
+    return _session_bus
+
+
+def get_matcher():
+    """ Get the Bamf.Matcher used for matching windows to running apps
+
+    Returns:
+        a Bamf.Matcher
+    """
+
+    global _matcher
+
+    if _matcher is None:
+        # wait for max 10s to ensure bamf is available
+        # (bamf is not always immediately available after login on Linux Mint
+        # 19 - e.g. https://forums.linuxmint.com/viewtopic.php?t=272747 and
+        # issue #158)
+        session_bus = get_session_bus()
+        i = 0
+        while i < 10:
+            if (not session_bus.name_has_owner("org.ayatana.bamf")):
+                i += 1
+                sleep(1)
+            else:
+                break
+
+        _matcher = Bamf.Matcher.get_default()
+
+    return _matcher
+
+
+def get_app_match():
+    """ Get the index of apps which are hard to match with their .desktop files
+
+    Returns:
+        an app_match.AppMatchIndex
+    """
+
+    global _app_match
+
+    if _app_match is None:
+        d, f = os.path.split(os.path.abspath(__file__))
+        _app_match = app_match.load_index("%s/app_match.xml" % d)
+
+    return _app_match
+
+
+def _desktop_dir_changed(monitor, the_file, other_file, event_type):
+    """ Handler for the Gio.FileMonitor changed signal
+
+    Mark the .desktop file index as needing to be rebuilt
+
+    Args:
+        monitor : the Gio.FileMonitor
+        the_file : a Gio.File - the file which changed
+        other_file : a Gio.File, only used for move events
+        event_type : a Gio.FileMonitorEvent
+    """
+
+    global _desktop_index
+
+    if event_type != Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+        _desktop_index = None
+
+
+def _get_dir_mtime(dirname):
+    """ Get the modification time of a directory
+
+    Args:
+        dirname : the directory
+
+    Returns:
+        a float, or None if the directory does not exist
+    """
+
+    try:
+        return os.stat(dirname).st_mtime
+    except OSError:
+        return None
+
+
+def _monitor_desktop_dir(dirname):
+    """ Start monitoring a directory of .desktop files, if we are not doing
+        so already
+
+    A directory which couldn't be monitored before is tried again. If it
+    still can't be, its modification time is recorded instead
+
+    Args:
+        dirname : the directory
+    """
+
+    if _desktop_monitors.get(dirname) is not None:
+        return
+
+    try:
+        monitor = Gio.File.new_for_path(dirname).monitor_directory(Gio.FileMonitorFlags.NONE,
+                                                                   None)
+        monitor.connect("changed", _desktop_dir_changed)
+        _desktop_unmonitored_mtimes.pop(dirname, None)
+    except GLib.Error:
+        monitor = None
+        _desktop_unmonitored_mtimes[dirname] = _get_dir_mtime(dirname)
+
+    _desktop_monitors[dirname] = monitor
+
+
+def _build_desktop_index():
+    """ Scan DESKTOP_DIRS and build the .desktop file index """
+
+    global _desktop_index
+
+    _desktop_index = {}
+    for srch_dir in DESKTOP_DIRS:
+        # the top level directories are monitored even if they don't exist,
+        # so that we know when they're created
+        dirs = [(srch_dir, [], [])]
+        for the_dir, dir_list, file_list in dirs + list(os.walk(srch_dir)):
+            _monitor_desktop_dir(the_dir)
+
+            for the_file in file_list:
+                _desktop_index.setdefault(the_file, os.path.join(the_dir, the_file))
+
+    return _desktop_index
+
+
+def find_desktop_file(df_name):
+    """ Find the full filename of a specified .desktop file
+
+    Args :
+        df_name : the name of the .desktop file e.g. pluma.desktop. The
+                  .desktop extension must be included
+
+    Returns:
+        The full filename (path + filename) of the desktop file if it
+        exists or "" otherwise
+    """
+
+    global _desktop_index
+
+    # directories which can't be monitored are checked for changes instead
+    for dirname, mtime in _desktop_unmonitored_mtimes.items():
+        if _get_dir_mtime(dirname) != mtime:
+            _desktop_index = None
+            break
+
+    index = _desktop_index
+    if index is None:
+        index = _build_desktop_index()
+
+    return index.get(df_name, "")
+
+
+def _unity_update(app_uri, args, sender=None, path=None):
+    """ Handler for Unity LauncherEntry Update messages, and replies to
+        LauncherEntry Query calls
+
+    Record the app's new state and forward the message to every dock
+
+    Args:
+        app_uri : the uri of the app's .desktop file
+        args : the contents of the dbus message
+        sender : the unique D-Bus name of the app which sent the message
+        path : the D-Bus object path the message was sent from
+    """
+
+    unity_state.update(app_uri, args, sender, path)
+
+    for dock in _docks:
+        dock.unity_cb_handler(app_uri, args)
+
+
+def register_dock(dock):
+    """ Register a dock so that it receives Unity LauncherEntry messages
+
+    The Unity D-Bus name is claimed and messages are listened for when
+    the first dock is registered. At the same time the last known state of
+    running apps is read from disk and the apps are asked for their current
+    state
+
+    Args:
+        dock : the Dock
+    """
+
+    global _unity_receiver
+
+    if dock in _docks:
+        return
+
+    _docks.append(dock)
+
+    if _unity_receiver is None:
+        session_bus = get_session_bus()
+
+        # claim the Unity bus (Unity won't be using it...) so that clients know
+        # to start using it
+        session_bus.request_name("com.canonical.Unity",
+                                 dbus.bus.NAME_FLAG_ALLOW_REPLACEMENT)
+
+        unity_state.load(session_bus)
+
+        # add a handler to listen in Unity dbus messages
+        _unity_receiver = session_bus.add_signal_receiver(_unity_update,
+                                                          dbus_interface="com.canonical.Unity.LauncherEntry",
+                                                          signal_name="Update",
+                                                          sender_keyword="sender",
+                                                          path_keyword="path")
+
+        unity_state.query_apps(session_bus, _unity_update)
+
+
+def unregister_dock(dock):
+    """ Unregister a dock, e.g. when it is removed from its panel
+
+    When the last dock is unregistered, the Unity D-Bus name is released
+    and any pending changes to the apps' state are written to disk
+
+    Args:
+        dock : the Dock
+    """
+
+    global _unity_receiver
+
+    if dock not in _docks:
+        return
+
+    _docks.remove(dock)
+
+    if _docks == [] and _unity_receiver is not None:
+        _unity_receiver.remove()
+        _unity_receiver = None
+        get_session_bus().release_name("com.canonical.Unity")
+        unity_state.flush()
+
+
+def get_docks():
+    """ Get the docks in this process
+
+    Returns:
+        a list of Dock objects
+    """
+
+    return _docks
+
+
+def main():
+    """Main function.
+
+    Debugging code can go here
+    """
+    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,8 @@
 
     Each item in the list will an indicator to show if the window
     is currently active, the window's title, and a close icon allowing
-    the window to be closed.
+    the window to be closed. Optionally, a thumbnail image of each window
+    can also be shown.
 
     The window will function in a similar way to a tooltip i.e.
     it will appear when the mouse hovers over a dock icon and
@@ -57,6 +58,7 @@ from gi.repository import GdkPixbuf
 from gi.repository import Gdk
 from gi.repository import Pango
 from gi.repository import Bamf
+from gi.repository import GObject
 
 import os
 import cairo
@@ -65,6 +67,9 @@ from time import sleep
 
 from dock_popup import DockPopup
 import window_control
+import win_thumbnails
+import bamf_cache
+import signal_registry
 
 from log_it import log_it as log_it
 
@@ -73,6 +78,348 @@ CONST_SEP = "--------------------"  # text which denotes tree view item is a sep
 CONST_MAX_TITLE_WIDTH = 400         # max width of the title column in pixels
 CONST__ACTIVE_TEXT = "•"
 
+# pixbufs created from stock icons for use in the list, keyed by stock id.
+# They are recreated when the icon theme changes
+_stock_pixbufs = {}
+_stock_theme = None
+
+
+def get_stock_pixbuf(widget, stock_id):
+    """ Get a pixbuf of a stock icon, sized for use in the window list
+
+    Args:
+        widget : a widget, used to render the icon
+        stock_id : the stock id e.g. Gtk.STOCK_CLOSE
+
+    Returns:
+        a GdkPixbuf.Pixbuf
+    """
+
+    global _stock_theme
+
+    theme = Gtk.Settings.get_default().get_property("gtk-icon-theme-name")
+    if theme != _stock_theme:
+        _stock_pixbufs.clear()
+        _stock_theme = theme
+
+    pixbuf = _stock_pixbufs.get(stock_id)
+    if pixbuf is not None:
+        return pixbuf
+
+    # create a pixbuf for holding the icon
+    pb_stock = widget.render_icon(stock_id, Gtk.IconSize.MENU, None)
+
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                 CONST_CLOSE_ICON_SIZE,
+                                 CONST_CLOSE_ICON_SIZE)
+    ctx = cairo.Context(surface)
+    Gdk.cairo_set_source_pixbuf(ctx, pb_stock, 0, 0)
+    ctx.paint()
+
+    # we now need to copy the cairo surface to a pixbuf. The best way to do
+    # this would be by calling GdkPixbuf.Pixbuf.new_from_data as in these
+    #                                                 64)
+    # comments. Unfortunately this function does not seem to be
+    # introspectable (Gtk2) or not implemented yet (Gtk3) and therefore
+    # doesn't work.
+    #
+    # pixbuf = GdkPixbuf.Pixbuf.new_from_data(surface.get_data(),
+    #                                         GdkPixbuf.Colorspace.RGB,
+    #                                         True, 8, pb_stock.get_width(),
+    #                                         pb_stock.get_height(),
+
+    # Therefore we have to resort to writing the surface to a temporary
+    # .png file and then loading it into our pixbuf ...
+
+    handle, tempfn = tempfile.mkstemp()
+    os.close(handle)
+    surface.write_to_png(tempfn)
+    pixbuf = GdkPixbuf.Pixbuf.new_from_file(tempfn)
+    os.remove(tempfn)
+
+    _stock_pixbufs[stock_id] = pixbuf
+    return pixbuf
+
+
+class WinListModel(object):
+    """ The list of an app's open windows
+
+        The model is kept for as long as the app is in the dock, and is
+        updated as the app's windows are opened and closed, change their
+        titles or state, or move between workspaces. This means the window
+        list doesn't need to be rebuilt each time it is shown, and stays up
+        to date while it is visible
+
+        Attributes:
+            list_store : a Gtk.ListStore. Each row contains an active
+                         indicator, the window title, a close icon, the
+                         Bamf.Window, an active icon, the window's thumbnail
+                         and the Wnck.Window
+            rows : a dict of window xid -> Gtk.TreeIter of the window's row
+            wnck_wins : a dict of window xid -> the Wnck.Window whose signals
+                        the model is connected to
+            signals : the signal_registry.SignalRegistry the model's handlers
+                      are connected through
+            pb_close : the close icon
+            pb_active : the active icon
+    """
+
+    def __init__(self, signals=None):
+        """ Init for the WinListModel class
+
+        Args:
+            signals : the SignalRegistry of the app which owns the list, so
+                      that the model's handlers are counted and disconnected
+                      along with the app's own. If None, the model has its
+                      own registry
+        """
+
+        super().__init__()
+
+        self.list_store = Gtk.ListStore(str, str, GdkPixbuf.Pixbuf,
+                                        Bamf.Window,
+                                        GdkPixbuf.Pixbuf,
+                                        GdkPixbuf.Pixbuf,
+                                        Wnck.Window)
+        self.rows = {}
+        self.wnck_wins = {}
+        if signals is None:
+            signals = signal_registry.SignalRegistry()
+        self.signals = signals
+        self.pb_close = None
+        self.pb_active = None
+
+    def set_icons(self, pb_close, pb_active):
+        """ Set the close and active icons, e.g. after the icon theme has
+            changed
+
+        Args:
+            pb_close : the close icon
+            pb_active : the active icon
+        """
+
+        if (pb_close is self.pb_close) and (pb_active is self.pb_active):
+            return
+
+        self.pb_close = pb_close
+        self.pb_active = pb_active
+        for list_item in self.list_store:
+            if list_item[3] is not None:
+                list_item[2] = pb_close
+            if list_item[0] == CONST__ACTIVE_TEXT:
+                list_item[4] = pb_active
+
+    def add_row(self, is_active, title, window, thumbnail=None, wnck_win=None):
+        """ Add a row to the list
+
+        Args:
+            is_active - True if this is a window and it is active,
+                         False otherwise
+            title - the title of the window or the action
+            window - the Bamf window relating to the row (can be None)
+            thumbnail - a GdkPixbuf of the window's thumbnail (can be None)
+            wnck_win - the Wnck window relating to the row (can be None)
+
+        Returns:
+            the Gtk.TreeIter of the new row
+        """
+
+        # set the active indicator
+        if is_active:
+            active_text = CONST__ACTIVE_TEXT
+            app_icon = self.pb_active
+        else:
+            active_text = ""
+            app_icon = None
+
+        if window is None:
+            close_icon = None
+        else:
+            close_icon = self.pb_close
+
+        return self.list_store.append([active_text, title,
+                                       close_icon, window,
+                                       app_icon, thumbnail, wnck_win])
+
+    def add_window(self, window, is_active=False):
+        """ Add a window to the list, if it isn't already in it
+
+        Only normal and dialog windows are added
+
+        Args:
+            window : the Bamf.Window
+            is_active : whether the window is the app's active window
+        """
+
+        if bamf_cache.get_window_type(window) not in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG]:
+            return
+
+        xid = window_control.get_xid(window)
+        if xid in self.rows:
+            return
+
+        wnck_win = window_control.get_wnck_window_by_xid(xid)
+        self.rows[xid] = self.add_row(is_active, bamf_cache.get_name(window), window,
+                                      None, wnck_win)
+
+        if wnck_win is not None:
+            self.wnck_wins[xid] = wnck_win
+            self.signals.connect(wnck_win, "name-changed", self.win_name_changed)
+            self.signals.connect(wnck_win, "state-changed", self.win_state_changed)
+            self.signals.connect(wnck_win, "workspace-changed", self.win_workspace_changed)
+
+    def remove_window(self, xid):
+        """ Remove a window from the list
+
+        Args:
+            xid : the window's xid
+        """
+
+        tree_iter = self.rows.pop(xid, None)
+        if tree_iter is not None:
+            self.list_store.remove(tree_iter)
+
+        wnck_win = self.wnck_wins.pop(xid, None)
+        if wnck_win is not None:
+            self.signals.disconnect(wnck_win, "name-changed", self.win_name_changed)
+            self.signals.disconnect(wnck_win, "state-changed", self.win_state_changed)
+            self.signals.disconnect(wnck_win, "workspace-changed", self.win_workspace_changed)
+
+    def sync(self, windows, active_win):
+        """ Make sure the list contains an app's current windows
+
+        Windows which aren't in the list are added, and windows which have
+        been closed are removed
+
+        Args:
+            windows : a list of the app's Bamf.Windows
+            active_win : the Bamf.Window which was most recently active
+        """
+
+        xids = set()
+        for window in windows:
+            if bamf_cache.get_window_type(window) in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG]:
+                xids.add(window_control.get_xid(window))
+                self.add_window(window)
+
+        for xid in [xid for xid in self.rows if xid not in xids]:
+            self.remove_window(xid)
+
+        if len(windows) == 1:
+            active_win = windows[0]
+
+        self.set_active(active_win)
+
+    def set_active(self, window):
+        """ Show the active indicator on a window's row, and remove it from
+            all others
+
+        Args:
+            window : the Bamf.Window, or None
+        """
+
+        active_xid = None
+        if window is not None:
+            active_xid = window_control.get_xid(window)
+
+        for xid, tree_iter in self.rows.items():
+            if xid == active_xid:
+                active_text = CONST__ACTIVE_TEXT
+                app_icon = self.pb_active
+            else:
+                active_text = ""
+                app_icon = None
+
+            if self.list_store.get_value(tree_iter, 0) != active_text:
+                self.list_store.set(tree_iter, [0, 4], [active_text, app_icon])
+
+    def set_thumbnail(self, xid, pixbuf):
+        """ Set a window's thumbnail
+
+        Args:
+            xid : the window's xid
+            pixbuf : the thumbnail
+        """
+
+        tree_iter = self.rows.get(xid)
+        if tree_iter is not None:
+            self.list_store.set_value(tree_iter, 5, pixbuf)
+
+    def get_xids(self):
+        """ Get the xids of the windows in the list
+
+        Returns:
+            a list of xids
+        """
+
+        return list(self.rows)
+
+    def win_name_changed(self, wnck_win):
+        """ Handler for the Wnck.Window name-changed signal
+
+        Update the window's title
+
+        Args:
+            wnck_win : the Wnck.Window
+        """
+
+        tree_iter = self.rows.get(wnck_win.get_xid())
+        if tree_iter is not None:
+            self.list_store.set_value(tree_iter, 1, wnck_win.get_name())
+
+    def win_state_changed(self, wnck_win, changed_mask, new_state):
+        """ Handler for the Wnck.Window state-changed signal
+
+        Let the views of the list know that the window has changed
+
+        Args:
+            wnck_win : the Wnck.Window
+            changed_mask : the state flags which have changed
+            new_state : the window's new state
+        """
+
+        self.row_changed(wnck_win)
+
+    def win_workspace_changed(self, wnck_win):
+        """ Handler for the Wnck.Window workspace-changed signal
+
+        Let the views of the list know that the window has changed, so that
+        views which show only the windows on the current workspace are
+        updated
+
+        Args:
+            wnck_win : the Wnck.Window
+        """
+
+        self.row_changed(wnck_win)
+
+    def row_changed(self, wnck_win):
+        """ Emit the row-changed signal for a window's row
+
+        Args:
+            wnck_win : the Wnck.Window
+        """
+
+        tree_iter = self.rows.get(wnck_win.get_xid())
+        if tree_iter is not None:
+            self.list_store.row_changed(self.list_store.get_path(tree_iter), tree_iter)
+
+    def clear(self):
+        """ Remove everything from the list """
+
+        for xid in list(self.wnck_wins):
+            self.remove_window(xid)
+
+        self.rows = {}
+        self.list_store.clear()
+
+    def destroy(self):
+        """ Disconnect from the app's windows, e.g. when the app is removed
+            from the dock
+        """
+
+        self.clear()
+
 
 class DockWinList(DockPopup):
 
@@ -119,16 +466,18 @@ class DockWinList(DockPopup):
         self.__tree_view.set_hover_selection(True)
 
         # the list consists of open windows (click to select the window)
-        # the liststore therefore needs to contain an active indictor,
-        # window title/item text, a Bamf window, a GdxPixbuf
-        # (an icon for the user to click to close the window,
-
-        self.__list_store = Gtk.ListStore(str, str, GdkPixbuf.Pixbuf,
-                                          Bamf.Window,
-                                          GdkPixbuf.Pixbuf)
+        # and is held in a WinListModel, normally the app's own so that it
+        # doesn't need to be rebuilt. The tree view shows it through a filter
+        # so that windows on other workspaces can be hidden
+        self.__model = WinListModel()
+        self.__own_model = True
+        self.__list_store = self.__model.list_store
+        self.__win_on_cur_ws_only = False
 
         self.__active_renderer = Gtk.CellRendererText()
         self.__icon_renderer = Gtk.CellRendererPixbuf()
+        self.__thumb_renderer = Gtk.CellRendererPixbuf()
+        self.__thumb_renderer.set_padding(2, 2)
         self.__title_renderer = Gtk.CellRendererText()
         self.__close_renderer = Gtk.CellRendererPixbuf()
         self.__close_renderer.set_alignment(1, 0.0)   # align to to topright of the cell
@@ -142,6 +491,11 @@ class DockWinList(DockPopup):
                                              self.__icon_renderer,
                                              pixbuf=4)
 
+        self.__col_thumb = Gtk.TreeViewColumn("",
+                                              self.__thumb_renderer,
+                                              pixbuf=5)
+        self.__col_thumb.set_visible(False)
+
         self.__col_active = Gtk.TreeViewColumn("",
                                                self.__active_renderer,
                                                text=0)
@@ -172,6 +526,7 @@ class DockWinList(DockPopup):
         # add the columns
         self.__tree_view.set_model(self.__list_store)
         self.__tree_view.append_column(self.__col_icon)
+        self.__tree_view.append_column(self.__col_thumb)
         self.__tree_view.append_column(self.__col_title)
         self.__tree_view.append_column(self.__col_close)
 
@@ -188,62 +543,23 @@ class DockWinList(DockPopup):
         self.__pb_close = None
         self.__pb_active = None
 
+        # the timer used to refresh window thumbnails while the list is shown
+        self.__thumb_timer_id = 0
+        self.connect("destroy", self.win_list_destroyed)
+
     def create_close_pixbuf(self):
-        """ Create a 'close' icon (based on the stock close icon) for use
+        """ Get a 'close' icon (based on the stock close icon) for use
             in the treeview
         """
 
-        # create a pixbuf for holding the 'close' icon
-        pb_close = self.render_icon(Gtk.STOCK_CLOSE, Gtk.IconSize.MENU, None)
-
-        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
-                                     CONST_CLOSE_ICON_SIZE,
-                                     CONST_CLOSE_ICON_SIZE)
-        ctx = cairo.Context(surface)
-        Gdk.cairo_set_source_pixbuf(ctx, pb_close, 0, 0)
-        ctx.paint()
-
-        # we now need to copy the cairo surface to a pixbuf. The best way to do
-        # this would be by calling GdkPixbuf.Pixbuf.new_from_data as in these
-        #                                                 64)
-        # comments. Unfortunately this function does not seem to be
-        # introspectable (Gtk2) or not implemented yet (Gtk3) and therefore
-        # doesn't work.
-        #
-        # self.__pb_close = GdkPixbuf.Pixbuf.new_from_data(surface.get_data(),
-        #                                                 GdkPixbuf.Colorspace.RGB,
-        #                                                 True, 8, pb_close.get_width(),
-        #                                                 pb_close.get_height(),
-
-        # Therefore we have to resort to writing the surface to a temporary
-        # .png file and then loading it into our pixbuf ...
-
-        handle, tempfn = tempfile.mkstemp()
-        surface.write_to_png(tempfn)
-        self.__pb_close = GdkPixbuf.Pixbuf.new_from_file(tempfn)
-        os.remove(tempfn)
+        self.__pb_close = get_stock_pixbuf(self, Gtk.STOCK_CLOSE)
 
     def create_active_pixbuf(self):
-        """ Create an active window icon (based on the stock forward icon) for
+        """ Get an active window icon (based on the stock forward icon) for
             use in the treeview
-
-            See the comments in create-close-pixbuf
         """
 
-        # create a pixbuf for holding the icon
-        pb_active = self.render_icon(Gtk.STOCK_GO_FORWARD, Gtk.IconSize.MENU, None)
-
-        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
-                                     CONST_CLOSE_ICON_SIZE,
-                                     CONST_CLOSE_ICON_SIZE)
-        ctx = cairo.Context(surface)
-        Gdk.cairo_set_source_pixbuf(ctx, pb_active, 0, 0)
-        ctx.paint()
-
-        handle, tempfn = tempfile.mkstemp()
-        surface.write_to_png(tempfn)
-        self.__pb_active = GdkPixbuf.Pixbuf.new_from_file(tempfn)
-        os.remove(tempfn)
+        self.__pb_active = get_stock_pixbuf(self, Gtk.STOCK_GO_FORWARD)
 
     def treeview_allocate(self, widget, allocation):
         """ Event handler for the tree view size-allocate event
@@ -285,6 +601,7 @@ class DockWinList(DockPopup):
 
         self.__close_renderer.set_property("cell-background", self.__bg_str)
         self.__icon_renderer.set_property("cell-background", self.__bg_str)
+        self.__thumb_renderer.set_property("cell-background", self.__bg_str)
 
     def query_tooltip(self, widget, x, y, keyboard_mode, tooltip):
         """ Handler for the query-tooltip event to determine whether or not
@@ -370,7 +687,9 @@ class DockWinList(DockPopup):
         if win is not None:
             # if the window to be activated is not on the current workspace,
             # switchto that workspace
-            wnck_win = Wnck.Window.get(win.get_xid())
+            wnck_win = self.__list_store.get_value(sel_iter, 6)
+            if wnck_win is None:
+                wnck_win = window_control.get_wnck_window(win)
             wnck_aws = self.wnck_screen.get_active_workspace()
             wnck_ws = wnck_win.get_workspace()
 
@@ -385,14 +704,7 @@ class DockWinList(DockPopup):
             wnck_win.activate(0)
 
             # set the active indicator on the newly activated window
-            # first, reset the current active indicator in the list store
-            for list_item in self.__list_store:
-                list_item[0] = ""
-                list_item[4] = None
-
-            # now set active indicator on the current item
-            self.__list_store.set_value(sel_iter, 0, CONST__ACTIVE_TEXT)
-            self.__list_store.set_value(sel_iter, 4, self.__pb_active)
+            self.__model.set_active(win)
 
             return True
 
@@ -408,7 +720,7 @@ class DockWinList(DockPopup):
         if len(self.__list_store) > 0:
             self.add_to_list(False, CONST_SEP, None)
 
-    def add_to_list(self, is_active, title, window):
+    def add_to_list(self, is_active, title, window, thumbnail=None):
         """ Add an item to the window list
 
         Args:
@@ -416,52 +728,48 @@ class DockWinList(DockPopup):
                          False otherwise
             title - the title of the window or the action
             window - the wnck window relating to the app (can be None)
+            thumbnail - a GdkPixbuf of the window's thumbnail (can be None)
         """
 
-        # set the active indicator
-        if is_active:
-            active_text = CONST__ACTIVE_TEXT
-        else:
-            active_text = ""
-
-        if active_text != "":
-            app_icon = self.__pb_active
-        else:
-            app_icon = None
-
-        if window is None:
-            close_icon = None
-        else:
-            close_icon = self.__pb_close
-
-        self.__list_store.append([active_text, title,
-                                  close_icon, window,
-                                  app_icon])
+        self.__model.add_row(is_active, title, window, thumbnail)
 
     def clear_win_list(self):
         """ Clear the list of open windows """
 
-        self.__list_store.clear()
+        self.__model.clear()
 
     def win_button_press(self, widget, event):
         """ this is for debug puposes only"""
         Gtk.main_quit()
 
-    def setup_list(self, win_on_cur_ws_only):
+    def setup_list(self, win_on_cur_ws_only, show_thumbnails=False, model=None,
+                   mru_wins=None):
         """ Setup the app list
 
         Set the app name
 
-        Re-create the close icon in case the icon theme has changed
+        Get the close and active icons - these are only re-created if the icon
+        theme has changed
+
+        Make sure the list has an entry for every window the app has open,
+        containing the window title, an indicator if the window is the active
+        window, and a close icon. When the app's own model is used the entries
+        will normally already be there and up to date
 
-        For every window the app has open add an entry containing the app icon,
-        window title, an indicator if the window is the active window, and a
-        close icon
+        If thumbnails are to be shown, any that have already been captured are
+        shown straight away. Others are captured in the background and added
+        when they are ready
 
         Args:
             win_on_cur_ws_only : boolean - whether to show only windows which
                                  are on the current workspace, or show windows
                                  for all workspaces
+            show_thumbnails : boolean - whether to show window thumbnails
+            model : the app's WinListModel. If None, the list is built
+                    from scratch
+            mru_wins : a list of the app's Bamf.Windows, most recently active
+                       first. If specified, the windows are shown in this order
+                       rather than the order they were opened in
 
         """
 
@@ -475,26 +783,140 @@ class DockWinList(DockPopup):
             self.resize(100, 10)
             self.__col_title.set_sizing(Gtk.TreeViewColumnSizing.AUTOSIZE)
 
-        win_list = self.the_app.get_windows()
+        if model is not None:
+            self.__model.destroy()
+            self.__model = model
+            self.__own_model = False
+
+        # bring the model up to date with the app's windows - normally it
+        # will already be
+        self.__model.set_icons(self.__pb_close, self.__pb_active)
+        self.__model.sync(self.the_app.get_windows(), self.the_app.last_active_win)
+
+        self.__win_on_cur_ws_only = win_on_cur_ws_only
+        self.__list_store = self.__model.list_store.filter_new()
+        self.__list_store.set_visible_func(self.is_row_visible)
+
+        if mru_wins is not None:
+            ranks = {}
+            for rank, win in enumerate(mru_wins):
+                ranks[window_control.get_xid(win)] = rank
+
+            self.__list_store = Gtk.TreeModelSort(model=self.__list_store)
+            self.__list_store.set_default_sort_func(self.compare_mru_rows, ranks)
+            self.__list_store.set_sort_column_id(Gtk.TREE_SORTABLE_DEFAULT_SORT_COLUMN_ID,
+                                                 Gtk.SortType.ASCENDING)
+
+        self.__tree_view.set_model(self.__list_store)
 
-        wnck_aws = self.wnck_screen.get_active_workspace()
-        add_to_list = False
-        for win in win_list:
-            win_type = win.get_window_type()
+        if show_thumbnails:
+            for xid in self.__model.get_xids():
+                thumbnail = win_thumbnails.get_thumbnail(xid, self.thumbnail_ready)
+                if thumbnail is not None:
+                    self.__model.set_thumbnail(xid, thumbnail)
 
-            if (win_type == Bamf.WindowType.NORMAL) or (win_type == Bamf.WindowType.DIALOG):
-                if win_on_cur_ws_only:
-                    # only add if the window is on the current workspace
-                    wnck_win = Wnck.Window.get(win.get_xid())
-                    add_to_list = wnck_win.is_on_workspace(wnck_aws)
-                else:
-                    add_to_list = True
+        self.__col_thumb.set_visible(show_thumbnails)
+        if show_thumbnails and (self.__thumb_timer_id == 0):
+            self.__thumb_timer_id = GObject.timeout_add(win_thumbnails.REFRESH_INTERVAL,
+                                                        self.do_thumbnail_refresh)
+
+    def compare_mru_rows(self, model, iter1, iter2, ranks):
+        """ Compare two rows of the list by how recently their windows were
+            active
+
+        Args:
+            model : the sorted model
+            iter1 : the first row
+            iter2 : the second row
+            ranks : a dict of xid -> position in most recently used order
+
+        Returns:
+            a negative number if the first row comes first, a positive number
+            if the second does, or 0 if it doesn't matter
+        """
+
+        rank1 = rank2 = len(ranks)
+
+        win = model.get_value(iter1, 3)
+        if win is not None:
+            rank1 = ranks.get(window_control.get_xid(win), rank1)
+
+        win = model.get_value(iter2, 3)
+        if win is not None:
+            rank2 = ranks.get(window_control.get_xid(win), rank2)
+
+        return rank1 - rank2
+
+    def is_row_visible(self, model, tree_iter, data=None):
+        """ Determine whether a row in the model is to be shown
+
+        Args:
+            model : the WinListModel's list store
+            tree_iter : the row
+            data : user defined data
+
+        Returns:
+            bool
+        """
+
+        if not self.__win_on_cur_ws_only:
+            return True
+
+        wnck_win = model.get_value(tree_iter, 6)
+        if wnck_win is None:
+            return True
+
+        return wnck_win.is_on_workspace(self.wnck_screen.get_active_workspace())
+
+    def thumbnail_ready(self, xid, pixbuf):
+        """ Callback for when a new window thumbnail has been captured
+
+        Show the thumbnail if the window is in the list
+
+        Args:
+            xid : the xid of the window
+            pixbuf : the thumbnail
+
+        Returns:
+            False, so that the callback isn't repeated
+        """
+
+        self.__model.set_thumbnail(xid, pixbuf)
+        return False
+
+    def do_thumbnail_refresh(self):
+        """ Timer callback to refresh the thumbnails of the windows in the list
+
+        Thumbnails are only captured again if their windows have changed
+
+        Returns:
+            True, so that the timer continues
+        """
+
+        if self.is_visible():
+            for xid in self.__model.get_xids():
+                win_thumbnails.get_thumbnail(xid, self.thumbnail_ready)
+
+        return True
+
+    def win_list_destroyed(self, widget):
+        """ Handler for the window list's destroy signal
+
+        Stop refreshing thumbnails and release the list's model, if it
+        was created for this list
+
+        Args:
+            widget : the window list
+        """
 
-                if add_to_list:
-                    is_active = (len(win_list) == 1) or \
-                                (win == self.the_app.last_active_win)
+        if self.__thumb_timer_id != 0:
+            GObject.source_remove(self.__thumb_timer_id)
+            self.__thumb_timer_id = 0
 
-                    self.add_to_list(is_active, win.get_name(), win)
+        # the app's own model is kept, but one created just for this list
+        # needs to disconnect from the app's windows
+        if self.__own_model:
+            self.__model.destroy()
 
     def mbutton_press(self, widget, event):
         """ this is for debug purposes only and demonstrates that menu.popup does
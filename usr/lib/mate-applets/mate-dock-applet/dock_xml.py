@@ -75,7 +75,7 @@ def write_xml(filename, desktop_files, light_ind, show_all_apps, multi_ind,
 
     Args:
         filename : the filename to use. If the file already exists it will be
-                   overwritten.
+                   replaced.
         desktop_files: a list containing the names of the applet's pinned app's
                        .desktop files e.g. ['pluma.desktop']
         light_ind : int - the indicator type e.g. light, dark, bar to be used
@@ -203,10 +203,20 @@ def write_xml(filename, desktop_files, light_ind, show_all_apps, multi_ind,
     root.append(ct_el)
     root.append(theme_el)
 
+    # write to a temporary file and then replace the original with it, so
+    # that the config file is never left partially written
+    tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
     try:
-        ET.ElementTree(root).write(filename, xml_declaration=True)
+        ET.ElementTree(root).write(tmp_filename, xml_declaration=True)
+        os.replace(tmp_filename, filename)
     except FileNotFoundError:
         return False  # invalid file or path name
+    except OSError:
+        try:
+            os.remove(tmp_filename)
+        except OSError:
+            pass
+        return False
 
     return True
 
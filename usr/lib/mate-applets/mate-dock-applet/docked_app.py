@@ -71,19 +71,21 @@ from gi.repository import Bamf
 
 import cairo
 import math
-import xdg.DesktopEntry as DesktopEntry
-import xdg.BaseDirectory as BaseDirectory
 import os
 import os.path
-import subprocess
 import re
 import colorsys
+import time
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 import dock_prefs
 from docked_app_helpers import *
 import window_control
+import desktop_cache
+import proc_info
+import bamf_cache
+import signal_registry
 
 from log_it import log_it as log_it
 
@@ -315,6 +317,10 @@ class PulseTimer(object):
 
 CONST_BLINK_DELAY = 330
 
+# the time (in seconds) after the last scroll or shortcut press before a
+# cycle through an app's windows ends and the order of its windows is updated
+CONST_MRU_CYCLE_TIMEOUT = 1.5
+
 
 class AttentionTimer(object):
     """Class to help provide visual feedback when an app requries user attention.
@@ -396,6 +402,8 @@ class DockedApp(object):
         pulse_step  : a count of how far we are through the pulse animation
         app_pb      : a pixbuf of the app's icon
         app_surface : a surface of the app's icon
+        icon_key    : the key of the app's icon in the surface store. Apps using
+                      the same icon share app_pb and app_surface
         highlight_colour : ColorTup of the colours used to highlight the app
                            when it is foreground
         is_active   : boolean - True = the app is the foreground app
@@ -408,6 +416,15 @@ class DockedApp(object):
         ind_ws      : wnck_workspace or None - if set, indicators are to be
                       drawn for windows on the specified workspace
         last_active_win : the Bamf.Window of the app's last active window
+        mru_wins    : an OrderedDict of the app's Bamf.Windows, least recently
+                      active first
+        mru_cycle   : a list of the Bamf.Windows being cycled through by
+                      scrolling or a keyboard shortcut, most recently active
+                      first, or None
+        mru_cycle_index : the index in mru_cycle of the current window
+        mru_cycle_time : the time (from time.monotonic) the cycle last moved
+        signals     : a SignalRegistry of the signal handlers connected to the
+                      app's Bamf.Application and windows
 
         is_dragee  : boolean - indicates whether or not the app's icon is
                      being dragged to a new position on the dock
@@ -418,6 +435,10 @@ class DockedApp(object):
         show_count   : boolean - indicates whether or not to display a
                         count value on the app's icon
         count_val   : the value of the count
+        unity_urgent : whether the app has requested attention via the Unity
+                       API
+        win_list_model : the dock_win_list.WinListModel of the app's windows,
+                         or None if its window list has not yet been shown
         needs_attention: whether or not the app needs the user's attention
         attention_type : how the docked app indicates to the user that the app
                          needs attention
@@ -452,6 +473,7 @@ class DockedApp(object):
         self.ind_ws = None
         self.startup_id = None
         self.applet = None
+        self.wallpaper_palette = []
 
         # all drawing is done to a Gtk.Label rather than e.g. a drawing area
         # or event box this allows panel transparency/custom backgrounds to be
@@ -471,6 +493,7 @@ class DockedApp(object):
 
         self.app_pb = None
         self.app_surface = None
+        self.icon_key = None
         self.highlight_color = ColorTup(r=0.0, g=0.0, b=0.0)
 
         self.is_active = False
@@ -499,6 +522,15 @@ class DockedApp(object):
         self.progress_val = 0.0
         self.show_count = False
         self.count_val = 0
+        self.unity_urgent = False
+        self.win_list_model = None
+
+        self.mru_wins = OrderedDict()
+        self.mru_cycle = None
+        self.mru_cycle_index = 0
+        self.mru_cycle_time = 0
+
+        self.signals = signal_registry.SignalRegistry()
 
         self.scroll_dir = ScrollType.SCROLL_NONE
 
@@ -534,11 +566,131 @@ class DockedApp(object):
         """
 
         ret_val = []
-        if (self.bamf_app is not None) and (self.bamf_app.is_running() or self.bamf_app.is_starting()):
-            ret_val = self.bamf_app.get_windows()
+        if (self.bamf_app is not None) and \
+           (bamf_cache.is_running(self.bamf_app) or bamf_cache.is_starting(self.bamf_app)):
+            ret_val = bamf_cache.get_windows(self.bamf_app)
 
         return ret_val
 
+    def win_activated(self, win):
+        """ Make a window the app's most recently active window
+
+        If the window was activated by cycling through the app's windows, its
+        place in the order is left alone until the cycle ends
+
+        Args:
+            win : the Bamf.Window
+        """
+
+        if (self.mru_cycle is not None) and (self.mru_cycle != []) and \
+           (self.mru_cycle[self.mru_cycle_index] == win):
+            return
+
+        self.end_mru_cycle()
+        self.mru_wins[win] = None
+        self.mru_wins.move_to_end(win)
+
+    def mru_win_removed(self, win):
+        """ Forget about a window which has been closed
+
+        Args:
+            win : the Bamf.Window
+        """
+
+        self.mru_wins.pop(win, None)
+
+        if (self.mru_cycle is not None) and (win in self.mru_cycle):
+            index = self.mru_cycle.index(win)
+            del self.mru_cycle[index]
+            if index < self.mru_cycle_index:
+                self.mru_cycle_index -= 1
+            if self.mru_cycle_index >= len(self.mru_cycle):
+                self.mru_cycle_index = 0
+
+    def end_mru_cycle(self):
+        """ End any cycle through the app's windows, making the window which
+            the cycle ended on the most recently active window
+        """
+
+        if self.mru_cycle is None:
+            return
+
+        if self.mru_cycle != []:
+            win = self.mru_cycle[self.mru_cycle_index]
+            self.mru_wins[win] = None
+            self.mru_wins.move_to_end(win)
+
+        self.mru_cycle = None
+
+    def get_mru_windows(self):
+        """ Get the app's windows in most recently used order
+
+        Windows which have never been active follow the others, in the order
+        bamf returns them
+
+        Returns:
+            a list of Bamf.Windows, most recently active first
+        """
+
+        if (self.mru_cycle is not None) and \
+           (time.monotonic() - self.mru_cycle_time > CONST_MRU_CYCLE_TIMEOUT):
+            self.end_mru_cycle()
+
+        windows = self.get_windows()
+        open_wins = set(windows)
+
+        # forget about any windows which have closed without us being told
+        for win in [win for win in self.mru_wins if win not in open_wins]:
+            del self.mru_wins[win]
+
+        mru_list = list(reversed(self.mru_wins))
+        mru_list += [win for win in windows if win not in self.mru_wins]
+        return mru_list
+
+    def get_next_mru_win(self, forwards=True):
+        """ Get the next window when cycling through the app's windows
+
+        The first call of a cycle takes a snapshot of the windows in most
+        recently used order, and each call after that steps through the
+        snapshot. The snapshot is kept until CONST_MRU_CYCLE_TIMEOUT seconds
+        have passed without a call, so that activating the windows doesn't
+        change the order part way through a cycle
+
+        If the app isn't active, the first call of a cycle returns its most
+        recently active window
+
+        Args:
+            forwards : whether to move to less (True) or more (False)
+                       recently active windows. Either way, the cycle wraps
+                       around
+
+        Returns:
+            a Bamf.Window, or None if the app has no windows
+        """
+
+        now = time.monotonic()
+        new_cycle = (self.mru_cycle is None) or \
+                    (now - self.mru_cycle_time > CONST_MRU_CYCLE_TIMEOUT)
+        if new_cycle:
+            self.end_mru_cycle()
+            self.mru_cycle = self.get_mru_windows()
+            self.mru_cycle_index = 0
+
+        self.mru_cycle_time = now
+        if self.mru_cycle == []:
+            return None
+
+        # if the app is active, its most recently active window is the one
+        # being shown, so move on from it
+        if self.is_active or not new_cycle:
+            if forwards:
+                self.mru_cycle_index += 1
+            else:
+                self.mru_cycle_index -= 1
+            self.mru_cycle_index %= len(self.mru_cycle)
+
+        return self.mru_cycle[self.mru_cycle_index]
+
     def get_first_normal_win(self):
         """ Returns the app's first 'normal' window i.e. a window or dialog
 
@@ -546,10 +698,10 @@ class DockedApp(object):
                 a Bamf.Window, or None
         """
 
-        if (self.bamf_app is not None) and (self.bamf_app.is_running()):
+        if (self.bamf_app is not None) and (bamf_cache.is_running(self.bamf_app)):
             for win in self.get_windows():
-                win_type = win.get_window_type()
-                if win_type in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG] or win.is_user_visible():
+                win_type = bamf_cache.get_window_type(win)
+                if win_type in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG] or bamf_cache.is_user_visible(win):
                     return win
 
         return None
@@ -583,34 +735,58 @@ class DockedApp(object):
         windows = self.get_windows()
         return win in windows
 
-    def setup_from_bamf(self, app_match_list):
+    def setup_from_bamf(self, app_match):
         """ Setup an already running app using info from self.bamf_app
 
         This is only called when bamf cannot match an app with it's .desktop file,
         so we can also do some extra checking from the list of hard to match
         .desktop files
 
+        Args:
+            app_match : an app_match.AppMatchIndex of the hard to match apps
+
         """
 
-        # get a list of all the possible locations of .desktop files
-        data_dirs = BaseDirectory.xdg_data_dirs
-        app_dirs = []
-        for dir in data_dirs:
-            app_dirs.append(os.path.join(dir, "applications/"))
+        # look the app up by name, and by the wm_class of its window
+        wm_classes = []
+        win = self.get_first_normal_win()
+        if win is not None:
+            wm_classes = [window_control.get_wm_class_group_name(win),
+                          window_control.get_wm_class_instance_name(win)]
 
-        # search for a match in
-        for app in app_match_list:
-            if self.bamf_app.get_name() == app[0]:
+        desktop_file = app_match.lookup(bamf_cache.get_name(self.bamf_app), wm_classes)
 
-                for dir in app_dirs:
-                    desktop_file = os.path.join(dir, app[2])
-                    if os.path.exists(desktop_file):
-                        self.desktop_file = desktop_file
-                        if self.read_info_from_desktop_file():
-                            return
+        # the app's launcher may have recorded the .desktop file in its
+        # environment
+        pid = 0
+        if win is not None:
+            pid = win.get_pid()
+        if desktop_file is None:
+            desktop_file = proc_info.get_desktop_file_hint(pid)
+
+        if desktop_file is not None:
+            self.desktop_file = desktop_file
+            if self.read_info_from_desktop_file():
+                return
+
+            self.desktop_file = None
+
+        # see if the app was started from one of our custom launchers
+        self.get_cmdline_from_pid(pid)
+        if self.cmd_line:
+            if self.get_desktop_from_custom_launcher(os.path.expanduser("~/.local/share/applications/"),
+                                                     pid):
+                if self.read_info_from_desktop_file():
+                    return
+
+            self.desktop_file = None
+
+            # the command line of the process isn't necessarily one which
+            # can be used to start the app again
+            self.cmd_line = ""
 
         # no match, so just get basic info
-        self.app_name = self.bamf_app.get_name()
+        self.app_name = bamf_cache.get_name(self.bamf_app)
         self.icon_name = "wnck"  # indicate we want to get the app icon from wnck
 
     def set_app_name(self, app_name):
@@ -653,25 +829,19 @@ class DockedApp(object):
     def get_cmdline_from_pid(self, pid):
         """ Find the command line and arguments used to launch the app
 
-        Use the ps command to return the command line and arguments
-        for the specified pid
+        Read the command line and arguments for the specified pid from
+        /proc
 
-        Set self.path to the full command line
+        Set self.cmd_line to the full command line
 
         Args:
             pid - a process id
 
         """
 
-        cmdstr = "xargs -0 < /proc/%d/cmdline" % pid
-
-        cmd = subprocess.Popen(cmdstr, shell=True, stdout=subprocess.PIPE)
-
-        for line in cmd.stdout:
-            pass
-
-        if line is not None:
-            self.cmd_line = line.decode("utf-8")
+        cmd_line = proc_info.get_cmdline(pid)
+        if cmd_line is not None:
+            self.cmd_line = cmd_line
 
     def has_windows_on_workspace(self, wnck_workspace):
         """ test whether the app has at least one window open on a specified
@@ -685,7 +855,7 @@ class DockedApp(object):
         """
 
         for win in self.get_windows():
-            wnck_win = Wnck.Window.get(win.get_xid())
+            wnck_win = window_control.get_wnck_window(win)
             if wnck_win is not None:
                 win_ws = wnck_win.get_workspace()
                 if win_ws == wnck_workspace:
@@ -702,7 +872,7 @@ class DockedApp(object):
 
         win_list = self.get_windows()
         for win in win_list:
-            wnck_win = Wnck.Window.get(win.get_xid())
+            wnck_win = window_control.get_wnck_window(win)
             if (wnck_win is not None) and (not wnck_win.is_minimized()):
                 return True
 
@@ -726,9 +896,9 @@ class DockedApp(object):
         """
         return self.drawing_area.get_visible()
 
-    def get_desktop_from_custom_launcher(self, srch_dir):
+    def get_desktop_from_custom_launcher(self, srch_dir, pid):
         """ Search the custom launchers in a specified directory for
-            one where the Exec field is found within self.cmd_line
+            one whose Exec field started the app's process
 
         If a match is found found, self.desktop_file is set accordingly
 
@@ -737,13 +907,12 @@ class DockedApp(object):
 
         Args:
             srch_dir : the directory to search
+            pid : the process id of the app
 
         Returns:
             True if a match was found, False otherwise
         """
 
-        # TODO: replace DesktopEntry with Gio.DesktopAppInfo... and then
-
         # if the search dir doesn't exist, don't do anything
         if os.path.isdir(srch_dir) is False:
             return False
@@ -751,15 +920,16 @@ class DockedApp(object):
         for the_file in os.listdir(srch_dir):
             if (the_file.startswith("mda_")) and \
                (the_file.endswith(".desktop")):
-                the_de = DesktopEntry.DesktopEntry(srch_dir + the_file)
-
-                # remove command line args from the Exec field of the .desktop
-                de_exec = the_de.getExec().split(None, 1)[0]
+                entry = desktop_cache.get_entry(srch_dir + the_file)
+                if (entry is None) or not entry.exec_line:
+                    continue
 
-                if self.cmd_line.find(de_exec) != -1:
+                if proc_info.command_matches(pid, entry.exec_line):
                     self.desktop_file = srch_dir + the_file
                     return True
 
+        return False
+
     def set_all_windows_icon_geometry(self, x, y, width, height):
         """Set the location on screen where all of the app's windows will be
            minimised to.
@@ -854,7 +1024,7 @@ class DockedApp(object):
         if self.bamf_app is None:
             return False
 
-        return self.bamf_app.is_running()
+        return bamf_cache.is_running(self.bamf_app)
 
     def has_desktop_file(self):
         """ Does the app have a .desktop file?
@@ -877,13 +1047,13 @@ class DockedApp(object):
         """
 
         if self.desktop_file:
-            if os.path.isabs(self.desktop_file):
-                self.desktop_ai = Gio.DesktopAppInfo.new_from_filename(self.desktop_file)
-            else:
-                self.desktop_ai = Gio.DesktopAppInfo.new(self.desktop_file)
+            entry = desktop_cache.get_entry(self.desktop_file)
+            if entry is None:
+                return False
 
-            self.app_name = self.desktop_ai.get_string("Name")
-            self.icon_name = self.desktop_ai.get_string("Icon")
+            self.desktop_ai = entry.app_info
+            self.app_name = entry.name
+            self.icon_name = entry.icon_name
 
             # if the desktop file does not specify an icon name, use the app
             # name instead
@@ -896,11 +1066,11 @@ class DockedApp(object):
                     self.icon_name = "computer"
 
             # get the command specified in the .desktop file used to launch the app
-            self.cmd_line = self.desktop_ai.get_string("Exec")
+            self.cmd_line = entry.exec_line
 
             # get the list of addtional application actions (to be activated by right
             # clicking the app's dock icon)
-            self.rc_actions = self.desktop_ai.list_actions()
+            self.rc_actions = entry.actions
 
             return True
 
@@ -965,13 +1135,12 @@ class DockedApp(object):
 
         if self.bamf_app is not None:
             for win in self.get_windows():
-                win_type = win.get_window_type()
-                if win_type in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG] and win.is_user_visible():
+                win_type = bamf_cache.get_window_type(win)
+                if win_type in [Bamf.WindowType.NORMAL, Bamf.WindowType.DIALOG] and bamf_cache.is_user_visible(win):
                     if cur_ws is None:
                         num_win += 1
                     else:
-                        xid = win.get_xid()
-                        wnck_win = Wnck.Window.get(xid)
+                        wnck_win = window_control.get_wnck_window(win)
                         if (wnck_win is not None) and wnck_win.is_on_workspace(cur_ws):
                             num_win += 1
         return num_win
@@ -1122,18 +1291,24 @@ class DockedApp(object):
                 ind = DefaultDarkInd(ctx, self.drawing_area_size,
                                      self.applet_orient, num_ind)
             elif self.indicator == IndicatorType.TBAR:
-                ind = ThemeBarInd(ctx, self.drawing_area_size, self.applet_orient, self.applet)
+                ind = ThemeBarInd(ctx, self.drawing_area_size, self.applet_orient, self.applet,
+                                  self.wallpaper_palette)
             elif self.indicator == IndicatorType.TCIRC:
-                ind = ThemeCircleInd(ctx, self.drawing_area_size, self.applet_orient, self.applet, num_ind)
+                ind = ThemeCircleInd(ctx, self.drawing_area_size, self.applet_orient, self.applet, num_ind,
+                                     self.wallpaper_palette)
             elif self.indicator == IndicatorType.TSQUARE:
-                ind = ThemeSquareInd(ctx, self.drawing_area_size, self.applet_orient, self.applet, num_ind)
+                ind = ThemeSquareInd(ctx, self.drawing_area_size, self.applet_orient, self.applet, num_ind,
+                                     self.wallpaper_palette)
             elif self.indicator == IndicatorType.TTRI:
-                ind = ThemeTriInd(ctx, self.drawing_area_size, self.applet_orient, self.applet, num_ind)
+                ind = ThemeTriInd(ctx, self.drawing_area_size, self.applet_orient, self.applet, num_ind,
+                                  self.wallpaper_palette)
             elif self.indicator == IndicatorType.TDIA:
-                ind = ThemeDiaInd(ctx, self.drawing_area_size, self.applet_orient, self.applet, num_ind)
+                ind = ThemeDiaInd(ctx, self.drawing_area_size, self.applet_orient, self.applet, num_ind,
+                                  self.wallpaper_palette)
             elif self.indicator == IndicatorType.SUBWAY:
                 ind = SubwayInd(ctx, self.drawing_area_size, self.applet_orient,
-                                self.applet, num_ind, offscreen_surface, self.is_active)
+                                self.applet, num_ind, offscreen_surface, self.is_active,
+                                self.wallpaper_palette)
 
             if ind is not None:
                 ind.draw()
@@ -1499,13 +1674,20 @@ class DockedApp(object):
 
         ctx.paint()
 
-    def set_pixbuf(self, pixbuf):
+    def set_pixbuf(self, pixbuf, color=None):
         """Set the app pixbuf and calculate its average colour.
+
+        Args:
+            pixbuf : the app's icon
+            color : the icon's backlight colour, if it has already been calculated
         """
 
         self.app_pb = pixbuf
 
-        rht, ght, bht = self.highlight_color = get_backlight_color(pixbuf)
+        if color is None:
+            color = get_backlight_color(pixbuf)
+
+        rht, ght, bht = self.highlight_color = color
         self.highlight_color = ColorTup(r=rht, g=ght, b=bht)
 
     def set_surface(self, surface):
@@ -1519,8 +1701,15 @@ class DockedApp(object):
 
             Use Gio.DesktopAppinfo as it supports startup notfication
         """
-        # start the app
-        run_it = self.desktop_ai.get_string("Exec")
+        # start the app - the parsed .desktop file is normally already in the
+        # cache, so there's no need to read it again
+        entry = desktop_cache.get_entry(self.desktop_file)
+        if entry is not None:
+            gdai = entry.app_info
+        else:
+            gdai = self.desktop_ai
+
+        run_it = gdai.get_string("Exec")
 
         if run_it is not None:
 
@@ -1541,7 +1730,6 @@ class DockedApp(object):
                 self.run_cmd_line(run_it)
                 return
 
-        gdai = Gio.DesktopAppInfo.new_from_filename(self.desktop_file)
         disp = Gdk.Display.get_default()
         if build_gtk2:
             alc = Gdk.AppLaunchContext()
@@ -1778,6 +1966,70 @@ class DockedApp(object):
             self.count_val = val
             self.queue_draw()
 
+    def get_progress_width(self, val):
+        """ Get the width in pixels of the filled part of the progress bar
+
+        Args:
+            val : the progress value
+
+        Returns:
+            int : the width
+        """
+
+        # see draw_progress - the bar is drawn at a size of 64 pixels
+        # and then scaled to the drawing area
+        return int(round(45 * val * self.drawing_area_size / 64))
+
+    def set_unity_state(self, count_visible=None, count=None,
+                        progress_visible=None, progress=None, urgent=None):
+        """
+            Update the counter and progress values and visibility, and the
+            urgency the app has requested via the Unity API, and cause the
+            app's icon to be redrawn only if its appearance has changed
+
+        Args:
+            count_visible : whether the counter is to be displayed, or None if
+                            unchanged
+            count : the counter value, or None if unchanged
+            progress_visible : whether the progress is to be displayed, or
+                               None if unchanged
+            progress : the progress value, or None if unchanged
+            urgent : whether the app is requesting attention, or None if
+                     unchanged
+
+        Returns:
+            bool : True if the icon needs to be redrawn, False otherwise
+        """
+
+        # only change the urgency when the app changes its request, so that
+        # urgency set by the app's windows isn't cancelled
+        if urgent is not None and bool(urgent) != self.unity_urgent:
+            self.unity_urgent = bool(urgent)
+            self.set_urgency(self.unity_urgent)
+
+        old_state = (self.show_count, self.show_count and self.count_val,
+                     self.show_progress,
+                     self.show_progress and self.get_progress_width(self.progress_val))
+
+        if count_visible is not None:
+            self.show_count = bool(count_visible)
+        if count is not None:
+            self.count_val = count
+        if progress_visible is not None:
+            self.show_progress = bool(progress_visible)
+        if progress is not None:
+            self.progress_val = progress
+
+        new_state = (self.show_count, self.show_count and self.count_val,
+                     self.show_progress,
+                     self.show_progress and self.get_progress_width(self.progress_val))
+
+        if new_state == old_state:
+            return False
+
+        self.queue_draw()
+        return True
+
     def set_scroll_dir(self, scroll_dir):
         """
             Sets the app's scroll direction
@@ -82,13 +82,17 @@ class IconBgType:
 fallback_ind_col = [0.9, 0.9, 0.9]
 
 
-def get_theme_highlight_col(applet):
+def get_theme_highlight_col(applet, palette=None):
     """
         get the current theme's highlight colour (Gtk3) or the fallback colour
         (Gtk2)
 
     Args:
         applet : the dock applet
+        palette : the main colours of the desktop wallpaper, as lists of
+                  r,g,b colour elements with the most prominent first. Only
+                  set when the panel colour is being changed to match the
+                  wallpaper
     :return:
         a tuple containing the r,g,b values (0-1.0) of the colors
 
@@ -105,6 +109,11 @@ def get_theme_highlight_col(applet):
             hcol = sel_bg[1]
             return [hcol.red, hcol.green, hcol.blue]
         else:
+            # if the panel colour matches the wallpaper, use the next most
+            # prominent colour of the wallpaper
+            if (palette is not None) and (len(palette) > 1):
+                return palette[1]
+
             # assume what is hopefully a decent looking highlight
             # colour - something a bit brighter (or maybe a lot darker)
             # than the background
@@ -330,19 +339,20 @@ class ThemeBarInd(BarInd):
         highlight colour (Gtk3) or using a fallback colour (Gtk2)
     """
 
-    def __init__(self, context, size, orient, applet):
+    def __init__(self, context, size, orient, applet, palette=None):
         """
             Constructor - call the inherited constructor and do additional
             bits of setup
 
         Args (in addition to those specified in the base class)
             applet : the applet
+            palette : the wallpaper palette, if the panel colour matches it
 
         """
         super().__init__(context, size, orient)
 
         # set the bar color
-        self._barcol = get_theme_highlight_col(applet)
+        self._barcol = get_theme_highlight_col(applet, palette)
 
 
 class ThemeCircleInd(IndicatorDrawer):
@@ -350,19 +360,20 @@ class ThemeCircleInd(IndicatorDrawer):
         Draws round indicators (up to 4) with the current theme's highlight colour
     """
 
-    def __init__(self, context, size, orient, applet, num_ind=0):
+    def __init__(self, context, size, orient, applet, num_ind=0, palette=None):
         """
             Constructor - call the inherited constructor and do additional
             bits of setup
 
         Args (in addition to those specified in the base class)
             applet : the applet
+            palette : the wallpaper palette, if the panel colour matches it
 
         """
         super().__init__(context, size, orient, num_ind)
 
         # set the indicator color
-        self._indcol = get_theme_highlight_col(applet)
+        self._indcol = get_theme_highlight_col(applet, palette)
 
     def draw(self):
         """
@@ -409,19 +420,20 @@ class ThemeSquareInd(IndicatorDrawer):
         Draws square indicators (up to 4) with the current theme's highlight colour
     """
 
-    def __init__(self, context, size, orient, applet, num_ind=0):
+    def __init__(self, context, size, orient, applet, num_ind=0, palette=None):
         """
             Constructor - call the inherited constructor and do additional
             bits of setup
 
         Args (in addition to those specified in the base class)
             applet : the applet
+            palette : the wallpaper palette, if the panel colour matches it
 
         """
         super().__init__(context, size, orient, num_ind)
 
         # set the indicator color
-        self._indcol = get_theme_highlight_col(applet)
+        self._indcol = get_theme_highlight_col(applet, palette)
 
     def draw(self):
         """
@@ -476,19 +488,20 @@ class ThemeDiaInd(IndicatorDrawer):
         Draws diamond indicators (up to 4) with the current theme's highlight colour
     """
 
-    def __init__(self, context, size, orient, applet, num_ind=0):
+    def __init__(self, context, size, orient, applet, num_ind=0, palette=None):
         """
             Constructor - call the inherited constructor and do additional
             bits of setup
 
         Args (in addition to those specified in the base class)
             applet : the applet
+            palette : the wallpaper palette, if the panel colour matches it
 
         """
         super().__init__(context, size, orient, num_ind)
 
         # set the indicator color
-        self._indcol = get_theme_highlight_col(applet)
+        self._indcol = get_theme_highlight_col(applet, palette)
 
     def draw(self):
         """
@@ -545,19 +558,20 @@ class ThemeTriInd(IndicatorDrawer):
         Draws triangle indicators (up to 4) with the current theme's highlight colour
     """
 
-    def __init__(self, context, size, orient, applet, num_ind=0):
+    def __init__(self, context, size, orient, applet, num_ind=0, palette=None):
         """
             Constructor - call the inherited constructor and do additional
             bits of setup
 
         Args (in addition to those specified in the base class)
             applet : the applet
+            palette : the wallpaper palette, if the panel colour matches it
 
         """
         super().__init__(context, size, orient, num_ind)
 
         # set the bar color
-        self._indcol = get_theme_highlight_col(applet)
+        self._indcol = get_theme_highlight_col(applet, palette)
 
     def draw(self):
         """
@@ -636,17 +650,18 @@ class SubwayInd(IndicatorDrawer):
 
     extra_s = 4  # this type of indicator requires extra space
 
-    def __init__(self, context, size, orient, applet, num_ind, surface, active):
+    def __init__(self, context, size, orient, applet, num_ind, surface, active, palette=None):
         """
         Args (additional):
             surface : the cairo surface the indicators are being drawn on
             active  : bool - whether or not the app is active
+            palette : the wallpaper palette, if the panel colour matches it
 
         """
         super().__init__(context, size, orient, num_ind)
 
         # set the color of the bar indicator for the first indicator
-        self._barcol = get_theme_highlight_col(applet)
+        self._barcol = get_theme_highlight_col(applet, palette)
         self._surface = surface
         self._active = active
 
@@ -1,39 +1,481 @@
 #!/usr/bin/env python3
-""" Calculate the average color of an image
+""" Calculate the average color and colour palette of an image
 
     Code adapted from from: https://github.com/ZeevG/python-dominant-image-colour
+
+    If the file manager has already made a freedesktop.org thumbnail of the
+    image, the thumbnail is used instead of the image itself. Otherwise the
+    image is decoded at a reduced size (using PIL's draft mode for JPEGs and
+    reduce() for everything else). Results are cached on disk, keyed by the
+    image's filename, modification time and size, so that the colour of a
+    wallpaper only ever has to be calculated once
 """
 
 import binascii
 import struct
+import os
+import json
+import threading
+import hashlib
+import urllib.parse
 
 try:
     import Image
-    import ImageDraw
+    import ImageStat
 except ImportError:
-    from PIL import Image, ImageDraw
+    from PIL import Image, ImageStat
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def get_dom_color(filename):
-    image = Image.open(filename)
-    image = image.resize((150, 150))      # optional, to reduce time
+# the size of the image the colour is calculated from
+SAMPLE_SIZE = 150
+
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                         "mate-dock-applet")
+CACHE_FILE = os.path.join(CACHE_DIR, "dom_color.json")
+
+# the size of the image the palette is calculated from, the number of
+# colours in the palette and the maximum number of k-means iterations
+PALETTE_SAMPLE_SIZE = 64
+PALETTE_SIZE = 5
+MAX_ITERATIONS = 12
+
+# colours in the palette which are closer together than this (the distance
+# between them in rgb space) are merged into one
+MERGE_DISTANCE = 40
+
+# the freedesktop.org thumbnail directories, largest thumbnails first
+THUMBNAIL_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                             "thumbnails")
+THUMBNAIL_SIZES = ["xx-large", "x-large", "large", "normal"]
+
+# the maximum number of images whose results are cached
+MAX_CACHE_ENTRIES = 64
+
+# the cache - a dict of filename -> {"mtime": .., "size": .., "colour": ..}
+# loaded from CACHE_FILE on first use
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _file_id(filename):
+    """ Get the modification time and size of a file, used to detect when a
+        cached result is out of date
+
+    Args:
+        filename : the file
+
+    Returns:
+        a tuple of mtime and size, or None if the file doesn't exist
+    """
+
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+
+    return stat.st_mtime, stat.st_size
+
+
+def _load_cache():
+    """ Read the cache from disk, if we haven't already done so
+
+    Must be called with _cache_lock held
+    """
+
+    global _cache
+
+    if _cache is not None:
+        return
+
+    try:
+        with open(CACHE_FILE, "r") as cache_file:
+            _cache = json.load(cache_file)
+    except (OSError, ValueError):
+        _cache = {}
+
+    if not isinstance(_cache, dict):
+        _cache = {}
+
+
+def _save_cache():
+    """ Write the cache to disk
+
+    The cache is written to a temporary file which then replaces the old
+    one, so that a partially written cache is never read
+
+    Must be called with _cache_lock held
+    """
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_file = "%s.%d.tmp" % (CACHE_FILE, os.getpid())
+        with open(tmp_file, "w") as cache_file:
+            json.dump(_cache, cache_file)
+        os.replace(tmp_file, CACHE_FILE)
+    except OSError:
+        pass
 
-    colour_tuple = [None, None, None]
-    for channel in range(3):
-        # Get data for one channel at a time
 
-        # in case of errors stop processing and return black as the
-        # dominant colour
+def get_cached(filename, item):
+    """ Get a previously calculated result for an image
+
+    Args:
+        filename : the image filename
+        item : the name of the result e.g. "colour"
+
+    Returns:
+        the result, or None if it isn't cached or the image has changed since
+        it was calculated
+    """
+
+    file_id = _file_id(filename)
+    if file_id is None:
+        return None
+
+    with _cache_lock:
+        _load_cache()
+        entry = _cache.get(filename)
+        if entry is None or (entry.get("mtime"), entry.get("size")) != file_id:
+            return None
+
+        return entry.get(item)
+
+
+def set_cached(filename, item, value):
+    """ Store a result for an image in the cache
+
+    Args:
+        filename : the image filename
+        item : the name of the result e.g. "colour"
+        value : the result - must be serialisable as json
+    """
+
+    file_id = _file_id(filename)
+    if file_id is None:
+        return
+
+    with _cache_lock:
+        _load_cache()
+        entry = _cache.pop(filename, None)
+        if entry is None or (entry.get("mtime"), entry.get("size")) != file_id:
+            entry = {"mtime": file_id[0], "size": file_id[1]}
+
+        entry[item] = value
+
+        # the most recently used entries are kept at the end of the dict
+        _cache[filename] = entry
+        while len(_cache) > MAX_CACHE_ENTRIES:
+            del _cache[next(iter(_cache))]
+
+        _save_cache()
+
+
+def find_thumbnail(filename):
+    """ Find an up to date freedesktop.org thumbnail of an image
+
+    Args:
+        filename : the image filename
+
+    Returns:
+        the filename of the thumbnail, or None if there isn't one or it is
+        out of date
+    """
+
+    file_id = _file_id(filename)
+    if file_id is None:
+        return None
+
+    # the thumbnail is named after the md5 of the image's uri, escaped in the
+    # same way as g_filename_to_uri
+    uri = "file://" + urllib.parse.quote(os.path.abspath(filename), safe="/!$&'()*+,;=:@")
+    thumb_name = hashlib.md5(uri.encode("utf-8")).hexdigest() + ".png"
+
+    for thumb_size in THUMBNAIL_SIZES:
+        thumb_file = os.path.join(THUMBNAIL_DIR, thumb_size, thumb_name)
         try:
-            pixels = image.getdata(band=channel)
-        except ValueError:
-            return "000000"
+            with Image.open(thumb_file) as thumb:
+                mtime = thumb.info.get("Thumb::MTime")
+        except (OSError, ValueError):
+            continue
+
+        if mtime is not None and mtime.isdigit() and int(mtime) == int(file_id[0]):
+            return thumb_file
+
+    return None
 
-        values = []
-        for pixel in pixels:
-            values.append(pixel)
 
-        colour_tuple[channel] = int(sum(values) / len(values))
+def load_image(filename, size=SAMPLE_SIZE):
+    """ Open an image and decode it at a reduced size
+
+    An up to date thumbnail of the image is used if there is one, since
+    decoding even a reduced size image means decompressing the whole file
+    for types other than JPEG
+
+    Args:
+        filename : the image filename
+        size : the width and height of the returned image
+
+    Returns:
+        a PIL Image in RGB mode
+    """
+
+    thumb_file = find_thumbnail(filename)
+    if thumb_file is not None:
+        filename = thumb_file
+
+    image = Image.open(filename)
+
+    # for JPEGs get the decoder to scale the image down while decoding it,
+    # so the full size image is never decoded. Has no effect on other types
+    image.draft("RGB", (size, size))
+
+    if image.mode not in ["RGB", "RGBA", "L"]:
+        image = image.convert("RGB")
+
+    # scale other types down by an integer factor before resizing, which is
+    # much quicker than resizing the full image
+    factor = min(image.width, image.height) // size
+    if factor > 1 and hasattr(image, "reduce"):
+        image = image.reduce(factor)
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    return image.resize((size, size))
+
+
+def get_dom_color(filename):
+    """ Get the average colour of an image
+
+    Args:
+        filename : the image filename
+
+    Returns:
+        a string of the rgb values of the colour in hex e.g. "ff8000"
+    """
+
+    colour = get_cached(filename, "colour")
+    if colour is not None:
+        return colour
+
+    # in case of errors stop processing and return black as the
+    # dominant colour
+    try:
+        image = load_image(filename)
+    except (OSError, ValueError):
+        return "000000"
+
+    colour_tuple = [int(mean) for mean in ImageStat.Stat(image).mean[0:3]]
 
     colour = binascii.hexlify(struct.pack('BBB', *colour_tuple)).decode('utf-8')
+    set_cached(filename, "colour", colour)
     return colour
+
+
+def _merge_similar(ranked):
+    """ Merge colours which are so close together that they'd look the same
+
+    Args:
+        ranked : a list of tuples of colour (a list of r, g, b) and
+                 proportion
+
+    Returns:
+        a new list of tuples of colour and proportion. Each merged colour is
+        the average of the colours it replaces, weighted by their proportions
+    """
+
+    merged = []
+    for colour, proportion in sorted(ranked, key=lambda item: item[1], reverse=True):
+        for index, (m_colour, m_proportion) in enumerate(merged):
+            if sum((a - b) ** 2 for a, b in zip(colour, m_colour)) <= MERGE_DISTANCE ** 2:
+                total = m_proportion + proportion
+                merged[index] = ([(a * m_proportion + b * proportion) / total
+                                  for a, b in zip(m_colour, colour)], total)
+                break
+        else:
+            merged.append((list(colour), proportion))
+
+    return [([int(round(c)) for c in colour], proportion) for colour, proportion in merged]
+
+
+def _kmeans_palette(image, num_colours):
+    """ Find the main colours of an image using k-means clustering
+
+    The initial cluster centres are chosen using k-means++ with a fixed
+    random seed, so that the same image always gives the same palette
+
+    Args:
+        image : a PIL Image in RGB mode
+        num_colours : the number of colours to find
+
+    Returns:
+        a list of tuples of colour (a list of r, g, b) and the proportion of
+        the image's pixels which are closest to that colour
+    """
+
+    pixels = numpy.asarray(image, dtype=numpy.float32).reshape(-1, 3)
+    rng = numpy.random.default_rng(0)
+
+    # k-means++ - each centre after the first is picked with a probability
+    # proportional to the squared distance of a pixel from the nearest
+    # centre already picked. Stop early if every pixel is already a centre
+    centres = pixels[rng.integers(len(pixels))][None, :]
+    dists = ((pixels - centres[0]) ** 2).sum(axis=1)
+    while len(centres) < num_colours:
+        total = dists.sum()
+        if total == 0:
+            break
+
+        centre = pixels[rng.choice(len(pixels), p=dists / total)]
+        centres = numpy.vstack([centres, centre])
+        dists = numpy.minimum(dists, ((pixels - centre) ** 2).sum(axis=1))
+
+    num_centres = len(centres)
+    labels = None
+    for iteration in range(MAX_ITERATIONS):
+        # squared distance of each pixel from each centre
+        dists = ((pixels[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2)
+        new_labels = dists.argmin(axis=1)
+        if labels is not None and numpy.array_equal(labels, new_labels):
+            break
+
+        labels = new_labels
+        counts = numpy.bincount(labels, minlength=num_centres)
+        for channel in range(3):
+            sums = numpy.bincount(labels, weights=pixels[:, channel], minlength=num_centres)
+            # leave the centres of empty clusters where they are
+            centres[:, channel] = numpy.where(counts > 0, sums / numpy.maximum(counts, 1),
+                                              centres[:, channel])
+
+    counts = numpy.bincount(labels, minlength=num_centres)
+    return _merge_similar([(centres[i].tolist(), counts[i] / len(labels))
+                           for i in range(num_centres) if counts[i] > 0])
+
+
+def _median_cut_palette(image, num_colours):
+    """ Find the main colours of an image using PIL's median cut quantizer
+
+    Args:
+        image : a PIL Image in RGB mode
+        num_colours : the number of colours to find
+
+    Returns:
+        a list of tuples of colour (a list of r, g, b) and the proportion of
+        the image's pixels which are that colour
+    """
+
+    quantized = image.quantize(colors=num_colours, method=Image.MEDIANCUT)
+    pal = quantized.getpalette()
+    total = image.width * image.height
+    return _merge_similar([(pal[index * 3:index * 3 + 3], count / total)
+                           for count, index in quantized.getcolors(num_colours)])
+
+
+def get_palette(filename, num_colours=PALETTE_SIZE):
+    """ Get the main colours of an image
+
+    Args:
+        filename : the image filename
+        num_colours : the maximum number of colours to return
+
+    Returns:
+        a list of strings of the rgb values of the colours in hex, e.g.
+        "ff8000", with the colour covering most of the image first
+    """
+
+    palette = get_cached(filename, "palette")
+    if palette is not None and len(palette) <= num_colours:
+        return palette
+
+    try:
+        image = load_image(filename, PALETTE_SAMPLE_SIZE)
+    except (OSError, ValueError):
+        return ["000000"]
+
+    if numpy is not None:
+        ranked = _kmeans_palette(image, num_colours)
+    else:
+        ranked = _median_cut_palette(image, num_colours)
+
+    ranked.sort(key=lambda item: item[1], reverse=True)
+    palette = [binascii.hexlify(struct.pack('BBB', *[min(max(c, 0), 255) for c in colour])).decode('utf-8')
+               for colour, proportion in ranked]
+
+    set_cached(filename, "palette", palette)
+    return palette
+
+
+def main():
+    """ Benchmark the palette engine
+
+    Time how long it takes to get the palette of a synthetic image at a
+    range of sizes (with the cache disabled) using each of the available
+    methods. Pass image filenames on the command line to time those too
+    """
+
+    import shutil
+    import sys
+    import tempfile
+    import time
+    from PIL import PngImagePlugin
+
+    global get_cached, set_cached, THUMBNAIL_DIR
+
+    # make sure every run does the work rather than using the cache
+    get_cached = lambda filename, item: None
+    set_cached = lambda filename, item, value: None
+
+    files = sys.argv[1:]
+    tmp_dir = tempfile.mkdtemp()
+    for width, height in [(1280, 720), (1920, 1080), (3840, 2160), (7680, 4320)]:
+        image = Image.radial_gradient("L").resize((width, height))
+        image = Image.merge("RGB", [image, image.rotate(90).resize((width, height)),
+                                    Image.linear_gradient("L").resize((width, height))])
+        for ext in ["jpg", "png"]:
+            filename = os.path.join(tmp_dir, "%dx%d.%s" % (width, height, ext))
+            image.save(filename)
+            files.append(filename)
+
+    methods = [("median cut", _median_cut_palette)]
+    if numpy is not None:
+        methods.insert(0, ("k-means", _kmeans_palette))
+
+    def run(label):
+        for filename in files:
+            for name, method in methods:
+                start = time.monotonic()
+                image = load_image(filename, PALETTE_SAMPLE_SIZE)
+                loaded = time.monotonic()
+                palette = method(image, PALETTE_SIZE)
+                done = time.monotonic()
+                print("%-20s %-6s %-10s decode %6.1fms  palette %6.1fms  total %6.1fms  %d colours"
+                      % (os.path.basename(filename), label, name, (loaded - start) * 1000,
+                         (done - loaded) * 1000, (done - start) * 1000, len(palette)))
+
+    # time the images without thumbnails, then with the x-large thumbnails a
+    # file manager would have made
+    THUMBNAIL_DIR = os.path.join(tmp_dir, "thumbnails")
+    run("image")
+
+    os.makedirs(os.path.join(THUMBNAIL_DIR, "x-large"))
+    for filename in files:
+        uri = "file://" + urllib.parse.quote(os.path.abspath(filename), safe="/!$&'()*+,;=:@")
+        info = PngImagePlugin.PngInfo()
+        info.add_text("Thumb::URI", uri)
+        info.add_text("Thumb::MTime", str(int(os.stat(filename).st_mtime)))
+        with Image.open(filename) as image:
+            image.thumbnail((512, 512))
+            image.save(os.path.join(THUMBNAIL_DIR, "x-large",
+                                    hashlib.md5(uri.encode("utf-8")).hexdigest() + ".png"),
+                       pnginfo=info)
+    run("thumb")
+
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+"""
+    Provide an index of the icon files used when an app's icon can't be found
+    via the icon theme
+
+    The following locations are searched, in order:
+        /usr/share/icons/hicolor/<size>x<size>/apps
+        ~/.local/share/icons/hicolor/<size>x<size>/apps
+        /usr/share/pixmaps (.png files only)
+        ~/.local/share/icons
+
+    Rather than probing each location with os.path.isfile every time an icon
+    is needed, the directories are listed once and the results held in
+    dictionaries keyed by lower cased icon name. The directories are monitored
+    and the index is rebuilt the next time it is used after any of them
+    change.
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+from gi.repository import Gio
+from gi.repository import GLib
+
+import os
+import os.path
+
+HICOLOR_DIRS = ["/usr/share/icons/hicolor",
+                os.path.expanduser("~/.local/share/icons/hicolor")]
+PIXMAP_DIR = "/usr/share/pixmaps"
+LOCAL_ICON_DIR = os.path.expanduser("~/.local/share/icons")
+
+# size used in the index for the hicolor 'scalable' directory
+SCALABLE = 0
+
+# the index itself - None if it needs to be (re)built. Otherwise a list of
+#   [hicolor, pixmaps, local]
+# where hicolor is a list of dicts (one per HICOLOR_DIRS entry) mapping
+# size -> {lower cased name: filename}, and pixmaps and local map lower cased
+# names to filenames
+_index = None
+
+# Gio.FileMonitors for the indexed directories, keyed by directory. A value
+# of None means the directory could not be monitored
+_monitors = {}
+
+# modification times of directories which could not be monitored, checked
+# each time the index is used
+_unmonitored_mtimes = {}
+
+
+def _get_mtime(dirname):
+    """ Get the modification time of a directory
+
+    Args:
+        dirname : the directory
+
+    Returns:
+        a float, or None if the directory does not exist
+    """
+
+    try:
+        return os.stat(dirname).st_mtime
+    except OSError:
+        return None
+
+
+def _list_dir(dirname):
+    """ List the files in a directory
+
+    Args:
+        dirname : the directory
+
+    Returns:
+        a list of filenames, empty if the directory doesn't exist
+    """
+
+    try:
+        return [entry.name for entry in os.scandir(dirname) if entry.is_file()]
+    except OSError:
+        return []
+
+
+def _dir_changed(monitor, the_file, other_file, event_type):
+    """ Handler for the Gio.FileMonitor changed signal
+
+    Mark the index as needing to be rebuilt
+
+    Args:
+        monitor : the Gio.FileMonitor
+        the_file : a Gio.File - the file which changed
+        other_file : a Gio.File, only used for move events
+        event_type : a Gio.FileMonitorEvent
+    """
+
+    if event_type != Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+        invalidate()
+
+
+def _monitor_dir(dirname):
+    """ Start monitoring an indexed directory, if we are not doing so already
+
+    Args:
+        dirname : the directory
+    """
+
+    if dirname in _monitors:
+        if _monitors[dirname] is None:
+            _unmonitored_mtimes[dirname] = _get_mtime(dirname)
+        return
+
+    try:
+        monitor = Gio.File.new_for_path(dirname).monitor_directory(Gio.FileMonitorFlags.NONE,
+                                                                   None)
+        monitor.connect("changed", _dir_changed)
+    except GLib.Error:
+        monitor = None
+        _unmonitored_mtimes[dirname] = _get_mtime(dirname)
+
+    _monitors[dirname] = monitor
+
+
+def _add_names(the_dict, dirname, filenames, stems_only=False):
+    """ Add files to an index dictionary
+
+    Files are added using their lower cased names both with and without
+    their extension. Names already in the dictionary are not replaced
+
+    Args:
+        the_dict : the dictionary to add to
+        dirname : the directory containing the files
+        filenames : the names of the files
+        stems_only : if True, only add names without their extensions
+    """
+
+    for filename in sorted(filenames):
+        full_name = os.path.join(dirname, filename)
+        lower_name = filename.lower()
+        if not stems_only:
+            the_dict.setdefault(lower_name, full_name)
+        the_dict.setdefault(os.path.splitext(lower_name)[0], full_name)
+
+
+def _build_index():
+    """ Scan the icon directories and build the index """
+
+    global _index
+
+    hicolor = []
+    for hc_dir in HICOLOR_DIRS:
+        _monitor_dir(hc_dir)
+        sizes = {}
+        try:
+            size_dirs = [entry.name for entry in os.scandir(hc_dir) if entry.is_dir()]
+        except OSError:
+            size_dirs = []
+
+        for size_dir in size_dirs:
+            if size_dir == "scalable":
+                size = SCALABLE
+            else:
+                dims = size_dir.split("x")
+                if len(dims) != 2 or not dims[0].isdigit() or dims[0] != dims[1]:
+                    continue
+                size = int(dims[0])
+
+            apps_dir = os.path.join(hc_dir, size_dir, "apps")
+            _monitor_dir(apps_dir)
+            names = {}
+            _add_names(names, apps_dir, _list_dir(apps_dir))
+            if names != {}:
+                sizes[size] = names
+
+        hicolor.append(sizes)
+
+    _monitor_dir(PIXMAP_DIR)
+    pixmaps = {}
+    _add_names(pixmaps, PIXMAP_DIR,
+               [f for f in _list_dir(PIXMAP_DIR) if f.lower().endswith(".png")],
+               stems_only=True)
+
+    _monitor_dir(LOCAL_ICON_DIR)
+    local = {}
+    _add_names(local, LOCAL_ICON_DIR, _list_dir(LOCAL_ICON_DIR))
+
+    _index = [hicolor, pixmaps, local]
+
+
+def _get_index():
+    """ Get the index, building it first if necessary
+
+    Returns:
+        the index
+    """
+
+    for dirname, mtime in _unmonitored_mtimes.items():
+        if _get_mtime(dirname) != mtime:
+            invalidate()
+            break
+
+    if _index is None:
+        _build_index()
+
+    return _index
+
+
+def _best_for_size(sizes, name, size):
+    """ Find the best sized hicolor icon for a given name
+
+    An icon of the exact size is preferred, then a scalable icon, then the
+    smallest icon larger than the size required, then the largest icon
+    smaller than it
+
+    Args:
+        sizes : a dict of size -> {name: filename}
+        name : the lower cased icon name
+        size : the required size in pixels
+
+    Returns:
+        a filename, or None if the name is not in the dict
+    """
+
+    exact = sizes.get(size)
+    if exact is not None and name in exact:
+        return exact[name]
+
+    scalable = sizes.get(SCALABLE)
+    if scalable is not None and name in scalable:
+        return scalable[name]
+
+    available = [s for s in sizes if s != SCALABLE and name in sizes[s]]
+    if available == []:
+        return None
+
+    larger = [s for s in available if s > size]
+    if larger != []:
+        return sizes[min(larger)][name]
+
+    return sizes[max(available)][name]
+
+
+def find_icon(icon_name, size):
+    """ Find the file for an icon which the icon theme could not supply
+
+    Args:
+        icon_name : the icon name, with or without an extension
+        size : the required size in pixels
+
+    Returns:
+        the full path and filename of the icon, or "" if the icon could not
+        be found
+    """
+
+    if not icon_name:
+        return ""
+
+    hicolor, pixmaps, local = _get_index()
+    name = icon_name.lower()
+    size = int(size)
+
+    for sizes in hicolor:
+        filename = _best_for_size(sizes, name, size)
+        if filename is not None:
+            return filename
+
+    filename = pixmaps.get(os.path.splitext(name)[0])
+    if filename is not None:
+        return filename
+
+    return local.get(name, "")
+
+
+def invalidate():
+    """ Mark the index as needing to be rebuilt the next time it is used """
+
+    global _index
+
+    _index = None
+
+
+def main():
+    """Main function.
+
+    Debugging code can go here
+    """
+    pass
+
+
+if __name__ == "__main__":
+    main()
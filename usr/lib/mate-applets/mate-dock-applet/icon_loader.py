@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""
+    Load and scale app icons in background threads
+
+    Decoding icon files (particularly SVGs), high quality rescaling and
+    calculating an icon's backlight colour are all done on a small pool of
+    worker threads so that the panel doesn't freeze while a large number of
+    icons are (re)loaded e.g. at startup or when the icon theme changes.
+
+    Only GdkPixbuf is used from the worker threads - anything involving Gtk,
+    Wnck or the icon theme must be done on the main thread before a load is
+    requested. Finished icons are handed back to the main thread via
+    GLib.idle_add
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+from gi.repository import GdkPixbuf
+from gi.repository import GLib
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from log_it import log_it as log_it
+
+# the maximum number of worker threads
+MAX_WORKERS = 4
+
+# the types of icon source which can be loaded
+SRC_FILE = 0        # an icon file, loaded at the required size
+SRC_PIXBUF = 1      # an existing pixbuf (e.g. from wnck) which needs scaling
+
+_pool = None
+
+# the number of loads requested but not yet handed back to the main thread,
+# and the time the current batch of loads started. Only accessed from the
+# main thread
+_pending = 0
+_num_loaded = 0
+_batch_start = None
+
+
+def _get_pool():
+    """ Get the worker pool, creating it if necessary
+
+    Returns:
+        a concurrent.futures.ThreadPoolExecutor
+    """
+
+    global _pool
+
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=min(MAX_WORKERS, os.cpu_count() or 1))
+
+    return _pool
+
+
+def _load_pixbuf(src_type, source, pixel_size, color_func):
+    """ Load or scale an icon - called on a worker thread
+
+    Args:
+        src_type : SRC_FILE or SRC_PIXBUF
+        source : a filename or GdkPixbuf.Pixbuf, according to src_type
+        pixel_size : the required icon size in pixels
+        color_func : if not None, a function which calculates the backlight
+                     colour of the loaded pixbuf
+
+    Returns:
+        a tuple of GdkPixbuf.Pixbuf and colour (or None, None if the icon
+        could not be loaded)
+    """
+
+    try:
+        if src_type == SRC_FILE:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(source, pixel_size, pixel_size)
+        else:
+            pixbuf = source.scale_simple(pixel_size, pixel_size, GdkPixbuf.InterpType.HYPER)
+    except GLib.Error:
+        return None, None
+
+    if pixbuf is None:
+        return None, None
+
+    if color_func is not None:
+        return pixbuf, color_func(pixbuf)
+
+    return pixbuf, None
+
+
+def _loaded(future, callback, args):
+    """ Hand a finished load back to its caller - called on the main thread
+
+    Args:
+        future : the concurrent.futures.Future of the load
+        callback : the function to call
+        args : extra arguments for callback
+
+    Returns:
+        False, so that the idle callback is not repeated
+    """
+
+    global _pending, _num_loaded, _batch_start
+
+    try:
+        pixbuf, color = future.result()
+    except Exception:
+        pixbuf = color = None
+
+    _pending -= 1
+    _num_loaded += 1
+    if _pending == 0:
+        log_it("icon_loader: loaded %d icons in %.3fs" % (_num_loaded,
+                                                         time.monotonic() - _batch_start))
+        _batch_start = None
+        _num_loaded = 0
+
+    callback(pixbuf, color, *args)
+    return False
+
+
+def load_icon(src_type, source, pixel_size, color_func, callback, *args):
+    """ Load an icon on a worker thread - must be called from the main thread
+
+    Once the icon has been loaded, callback is called on the main thread
+    with the loaded pixbuf and its colour (both None if the load failed)
+    followed by args
+
+    Args:
+        src_type : SRC_FILE or SRC_PIXBUF
+        source : a filename or GdkPixbuf.Pixbuf, according to src_type
+        pixel_size : the required icon size in pixels
+        color_func : if not None, a function to calculate the backlight
+                     colour of the loaded pixbuf
+        callback : the function to call when the load is complete
+        args : extra arguments for callback
+    """
+
+    global _pending, _batch_start
+
+    if _pending == 0:
+        _batch_start = time.monotonic()
+    _pending += 1
+
+    future = _get_pool().submit(_load_pixbuf, src_type, source, int(pixel_size), color_func)
+    future.add_done_callback(lambda f: GLib.idle_add(_loaded, f, callback, args))
+
+
+def main():
+    """Main function.
+
+    Debugging code can go here
+    """
+    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+"""
+    Provide information about running processes, read directly from /proc
+
+    The command line, executable and selected environment variables of a
+    process are read once and cached. Cached details are keyed by both the
+    process id and the process start time, so that if a pid is reused by a
+    new process its details are not confused with those of the old one.
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+import os
+import os.path
+import shlex
+import shutil
+
+from collections import namedtuple
+
+# the environment variables which are kept - those which can identify the
+# .desktop file an app was launched from
+ENV_VARS = ["BAMF_DESKTOP_FILE_HINT", "GIO_LAUNCHED_DESKTOP_FILE",
+            "GIO_LAUNCHED_DESKTOP_FILE_PID"]
+
+# the maximum number of processes whose details are cached
+MAX_CACHE_ENTRIES = 256
+
+ProcInfo = namedtuple('ProcInfo', ['pid', 'start_time', 'cmdline', 'exe', 'environ'])
+
+# the cached details - a dict of (pid, start time) -> ProcInfo
+_cache = {}
+
+
+def _read_file(filename):
+    """ Read the contents of a file in /proc
+
+    Args:
+        filename : the file
+
+    Returns:
+        bytes, or None if the file could not be read (e.g. the process has
+        exited or belongs to another user)
+    """
+
+    try:
+        with open(filename, "rb") as the_file:
+            return the_file.read()
+    except OSError:
+        return None
+
+
+def get_start_time(pid):
+    """ Get the start time of a process
+
+    Args:
+        pid : the process id
+
+    Returns:
+        the start time (in clock ticks since boot), or None if the process
+        doesn't exist
+    """
+
+    stat = _read_file("/proc/%d/stat" % pid)
+    if stat is None:
+        return None
+
+    # the process name (field 2) is in brackets and may contain spaces, so
+    # count fields from the last closing bracket. The start time is field 22
+    fields = stat[stat.rfind(b")") + 2:].split()
+    try:
+        return int(fields[19])
+    except (IndexError, ValueError):
+        return None
+
+
+def get_proc_info(pid):
+    """ Get the details of a process
+
+    Args:
+        pid : the process id
+
+    Returns:
+        a ProcInfo, or None if the process doesn't exist. cmdline is a
+        list of strings, exe a string (or None if it can't be read) and
+        environ a dict containing any of ENV_VARS which the process has set
+    """
+
+    if not pid:
+        return None
+
+    start_time = get_start_time(pid)
+    if start_time is None:
+        return None
+
+    info = _cache.get((pid, start_time))
+    if info is not None:
+        return info
+
+    cmdline = _read_file("/proc/%d/cmdline" % pid)
+    if cmdline is None:
+        return None
+
+    args = [arg.decode("utf-8", "replace") for arg in cmdline.split(b"\0") if arg != b""]
+
+    try:
+        exe = os.readlink("/proc/%d/exe" % pid)
+    except OSError:
+        exe = None
+
+    environ = {}
+    env_data = _read_file("/proc/%d/environ" % pid)
+    if env_data is not None:
+        for var in env_data.split(b"\0"):
+            name, sep, value = var.decode("utf-8", "replace").partition("=")
+            if sep and name in ENV_VARS:
+                environ[name] = value
+
+    info = ProcInfo(pid=pid, start_time=start_time, cmdline=args, exe=exe,
+                    environ=environ)
+
+    if len(_cache) >= MAX_CACHE_ENTRIES:
+        # forget about processes which have exited
+        for key in [key for key in _cache if get_start_time(key[0]) != key[1]]:
+            del _cache[key]
+
+        if len(_cache) >= MAX_CACHE_ENTRIES:
+            _cache.clear()
+
+    _cache[(pid, start_time)] = info
+    return info
+
+
+def get_cmdline(pid):
+    """ Get the command line of a process as a single string
+
+    Args:
+        pid : the process id
+
+    Returns:
+        the command line and arguments separated by spaces, or None if the
+        process doesn't exist
+    """
+
+    info = get_proc_info(pid)
+    if info is None:
+        return None
+
+    return " ".join(info.cmdline)
+
+
+def get_desktop_file_hint(pid):
+    """ Get the .desktop file a process was launched from, if the launcher
+        recorded it in the process's environment
+
+    Args:
+        pid : the process id
+
+    Returns:
+        the full path of the .desktop file, or None
+    """
+
+    info = get_proc_info(pid)
+    if info is None:
+        return None
+
+    candidates = [info.environ.get("BAMF_DESKTOP_FILE_HINT")]
+
+    # GIO_LAUNCHED_DESKTOP_FILE is inherited by anything the app launches
+    # itself, so only use it if it was set for this process
+    if info.environ.get("GIO_LAUNCHED_DESKTOP_FILE_PID") == str(pid):
+        candidates.append(info.environ.get("GIO_LAUNCHED_DESKTOP_FILE"))
+
+    for desktop_file in candidates:
+        if desktop_file and os.path.isabs(desktop_file) and os.path.isfile(desktop_file):
+            return desktop_file
+
+    return None
+
+
+def _resolve_exe(name):
+    """ Get the full path of an executable, following any symlinks
+
+    Args:
+        name : the executable, either a path or a name to look up in $PATH
+
+    Returns:
+        the full path, or None if the executable can't be found
+    """
+
+    if os.sep not in name:
+        name = shutil.which(name)
+        if name is None:
+            return None
+
+    return os.path.realpath(os.path.expanduser(name))
+
+
+def command_matches(pid, command):
+    """ Determine whether a process was started by a command e.g. the Exec
+        field of a .desktop file
+
+    The command is split into arguments in the same way as a shell would,
+    and any leading 'env VAR=value' and any field codes (e.g. %U) are
+    ignored. The process matches if its executable is the same file as the
+    command's, and the rest of the command's arguments are the first of
+    the process's. A script started through its interpreter (i.e. the
+    command is the script, but the process is e.g. python3 running it) also
+    matches
+
+    Args:
+        pid : the process id
+        command : the command line
+
+    Returns:
+        bool
+    """
+
+    info = get_proc_info(pid)
+    if (info is None) or (info.cmdline == []):
+        return False
+
+    try:
+        args = shlex.split(command)
+    except ValueError:
+        return False
+
+    if args[:1] == ["env"]:
+        args = args[1:]
+        while args and ("=" in args[0]) and not args[0].startswith("-"):
+            args = args[1:]
+
+    args = [arg for arg in args if not (len(arg) == 2 and arg.startswith("%"))]
+    if args == []:
+        return False
+
+    exe = _resolve_exe(args[0])
+    if exe is None:
+        return False
+
+    proc_args = info.cmdline
+    if ((exe == info.exe) or (exe == _resolve_exe(proc_args[0]))) and \
+       (proc_args[1:len(args)] == args[1:]):
+        return True
+
+    # a script run by its interpreter has the script's path as its first
+    # argument
+    return (len(proc_args) > 1) and os.path.isabs(proc_args[1]) and \
+           (exe == os.path.realpath(proc_args[1])) and \
+           (proc_args[2:len(args) + 1] == args[1:])
+
+
+def main():
+    """Main function.
+
+    Debugging code can go here
+    """
+
+    info = get_proc_info(os.getpid())
+    print("cmdline = %s" % info.cmdline)
+    print("exe = %s" % info.exe)
+    print("environ = %s" % info.environ)
+    print("matches python3 = %s" % command_matches(os.getpid(), "python3"))
+    print("matches vi = %s" % command_matches(os.getpid(), "vi"))
+
+
+if __name__ == "__main__":
+    main()
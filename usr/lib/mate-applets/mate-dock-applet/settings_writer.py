@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+"""
+    Save the dock's settings to dconf and the xml config file
+
+    Only settings which have actually changed are written to dconf, and all
+    of them are written in one go. The xml config file is only rewritten a
+    short time after the last change, so that a burst of changes (e.g.
+    dragging an app icon about the dock, or pinning several apps) results in
+    a single write
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+from gi.repository import Gio
+from gi.repository import GObject
+
+import copy
+import os
+
+import dock_xml
+
+# the delay (in ms) between the last settings change and the xml config
+# file being written
+XML_WRITE_DELAY = 1000
+
+# the last write of each xml config file - a dict of the real path of the
+# file -> tuple of the file's modification time after the write and the
+# arguments it was written with. This is shared by all of the writers (i.e.
+# all of the docks) in the process, so that if the file has been written by
+# something else since, the next write is never skipped
+_last_writes = {}
+
+
+def _get_mtime(filename):
+    """ Get the modification time of a file
+
+    Args:
+        filename : the filename
+
+    Returns:
+        the modification time in nanoseconds, or None if the file can't be
+        read
+    """
+
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+
+class SettingsWriter(object):
+    """ Class to write the dock's settings
+
+        Attributes:
+            settings : a Gio.Settings in delay mode, used only for writing
+            xml_filename : the xml config file
+            xml_args : the arguments for the next write of the xml file, or
+                       None if no write is pending
+            xml_timer_id : the id of the timer used to delay xml writes
+    """
+
+    def __init__(self, schema, path, xml_filename):
+        """ Init for the SettingsWriter class
+
+        Args:
+            schema : the id of the settings schema
+            path : the path of the settings
+            xml_filename : the filename of the xml config file
+        """
+
+        super().__init__()
+
+        # changes made to these settings are not written until apply() is
+        # called
+        self.settings = Gio.Settings.new_with_path(schema, path)
+        self.settings.delay()
+
+        self.xml_filename = xml_filename
+        self.xml_args = None
+        self.xml_timer_id = 0
+
+    def set_values(self, values):
+        """ Write settings to dconf
+
+        Only settings whose values differ from those already stored are
+        written, and they are all written together
+
+        Args:
+            values : a list of tuples of key and GLib.Variant
+
+        Returns:
+            a list of the keys that were changed
+        """
+
+        changed = []
+        for key, value in values:
+            if not self.settings.get_value(key).equal(value):
+                self.settings.set_value(key, value)
+                changed.append(key)
+
+        if changed != []:
+            self.settings.apply()
+
+        return changed
+
+    def write_xml(self, *args):
+        """ Write the xml config file after a short delay
+
+        If the file is already due to be written, it will be written with these
+        arguments instead. Nothing is written if the arguments are the same
+        as those of the last write of the file, and the file hasn't been
+        modified since
+
+        Args:
+            args : the arguments for dock_xml.write_xml, apart from the
+                   filename
+        """
+
+        last_mtime, last_args = _last_writes.get(os.path.realpath(self.xml_filename),
+                                                 (None, None))
+        if (args == last_args) and (last_mtime is not None) and \
+           (last_mtime == _get_mtime(self.xml_filename)):
+            # nothing has changed, so cancel any pending write of older values
+            self.xml_args = None
+            if self.xml_timer_id != 0:
+                GObject.source_remove(self.xml_timer_id)
+                self.xml_timer_id = 0
+            return
+
+        # the arguments include lists which the dock may change before the
+        # file is written
+        self.xml_args = copy.deepcopy(args)
+
+        if self.xml_timer_id != 0:
+            GObject.source_remove(self.xml_timer_id)
+
+        self.xml_timer_id = GObject.timeout_add(XML_WRITE_DELAY, self.do_xml_timer)
+
+    def do_xml_timer(self):
+        """ Timer callback to write the xml config file
+
+        Returns:
+            False, so that the timer is not repeated
+        """
+
+        self.xml_timer_id = 0
+        self.flush()
+        return False
+
+    def flush(self):
+        """ Write the xml config file now, if a write is pending """
+
+        if self.xml_timer_id != 0:
+            GObject.source_remove(self.xml_timer_id)
+            self.xml_timer_id = 0
+
+        if self.xml_args is None:
+            return
+
+        real_path = os.path.realpath(self.xml_filename)
+        if dock_xml.write_xml(self.xml_filename, *self.xml_args):
+            _last_writes[real_path] = (_get_mtime(self.xml_filename), self.xml_args)
+        else:
+            _last_writes.pop(real_path, None)
+
+        self.xml_args = None
+
+
+def main():
+    """Main function.
+
+    Debugging code can go here
+    """
+    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+"""
+    Keep track of the signal handlers connected to GObjects
+
+    Each Dock and DockedApp owns a SignalRegistry and connects its handlers
+    through it, rather than connecting them directly. This means that:
+
+        a handler is never connected to the same signal of an object twice
+        all of the handlers connected to an object can be disconnected when
+        the object is finished with e.g. when a window closes
+        all of the handlers connected by an app can be disconnected when the
+        app is removed from the dock, and all of those connected by a dock
+        when the dock is removed from the panel
+        the number of handlers which are still connected can be checked, so
+        that leaks can be spotted
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+
+class SignalRegistry(object):
+    """ A record of the signal handlers connected to GObjects
+
+        Attributes:
+            handlers : a dict of object -> dict of (signal name, callback) ->
+                       handler id
+    """
+
+    def __init__(self):
+        """ Init for the SignalRegistry class """
+
+        super().__init__()
+
+        self.handlers = {}
+
+    def connect(self, obj, signal, callback, *args, after=False):
+        """ Connect a handler to a signal of an object, unless the same
+            callback is already connected to it
+
+        Args:
+            obj : the GObject
+            signal : the name of the signal
+            callback : the function to call when the signal is emitted
+            args : any extra arguments to pass to callback
+            after : whether to connect with connect_after rather than connect
+
+        Returns:
+            the handler id
+        """
+
+        obj_handlers = self.handlers.setdefault(obj, {})
+        handler_id = obj_handlers.get((signal, callback))
+        if handler_id is None:
+            if after:
+                handler_id = obj.connect_after(signal, callback, *args)
+            else:
+                handler_id = obj.connect(signal, callback, *args)
+
+            obj_handlers[(signal, callback)] = handler_id
+
+        return handler_id
+
+    def is_connected(self, obj, signal, callback):
+        """ Determine whether a callback is connected to a signal of an object
+
+        Args:
+            obj : the GObject
+            signal : the name of the signal
+            callback : the callback
+
+        Returns:
+            bool
+        """
+
+        return (signal, callback) in self.handlers.get(obj, {})
+
+    def disconnect(self, obj, signal=None, callback=None):
+        """ Disconnect handlers from an object
+
+        Args:
+            obj : the GObject
+            signal : the name of the signal to disconnect handlers from. If
+                     None, handlers are disconnected from all signals
+            callback : the callback to disconnect. If None, all callbacks
+                       are disconnected
+        """
+
+        obj_handlers = self.handlers.get(obj)
+        if obj_handlers is None:
+            return
+
+        for key in list(obj_handlers):
+            if ((signal is None) or (key[0] == signal)) and \
+               ((callback is None) or (key[1] == callback)):
+                handler_id = obj_handlers.pop(key)
+                # the handler may already have gone if e.g. the object has
+                # been finalized
+                if obj.handler_is_connected(handler_id):
+                    obj.disconnect(handler_id)
+
+        if obj_handlers == {}:
+            del self.handlers[obj]
+
+    def disconnect_all(self):
+        """ Disconnect every handler in the registry """
+
+        for obj in list(self.handlers):
+            self.disconnect(obj)
+
+    def count(self, obj=None):
+        """ Get the number of handlers which are connected
+
+        Args:
+            obj : if specified, only handlers connected to this object are
+                  counted
+
+        Returns:
+            int
+        """
+
+        if obj is not None:
+            return len(self.handlers.get(obj, {}))
+
+        return sum(len(obj_handlers) for obj_handlers in self.handlers.values())
+
+
+def main():
+    """Main function.
+
+    Debugging code can go here
+    """
+
+    from gi.repository import GObject
+
+    class Emitter(GObject.GObject):
+        __gsignals__ = {"changed": (GObject.SignalFlags.RUN_FIRST, None, ())}
+
+    def changed(obj):
+        print("changed")
+
+    registry = SignalRegistry()
+    emitter = Emitter()
+    registry.connect(emitter, "changed", changed)
+    registry.connect(emitter, "changed", changed)
+    emitter.emit("changed")
+    print("%d handler(s) connected" % registry.count())
+    registry.disconnect_all()
+    emitter.emit("changed")
+    print("%d handler(s) connected" % registry.count())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+"""
+    Provide a process wide store of app icon surfaces
+
+    Apps which use the same icon (e.g. several wine apps, browser web apps or
+    apps with no icon which are shown with the stock execute icon) share a
+    single pixbuf and cairo surface rather than each holding their own copies.
+
+    Icons are keyed by a tuple of (icon source, size in pixels, scale factor)
+    and are reference counted - when the last app using an icon releases it,
+    the icon is removed from the store.
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+# do not change the value of this variable - it will be set during build
+# according to the value of the --with-gtk3 option used with .configure
+build_gtk2 = False
+
+import gi
+
+if build_gtk2:
+    gi.require_version("Gtk", "2.0")
+else:
+    gi.require_version("Gtk", "3.0")
+
+from gi.repository import Gdk
+
+import hashlib
+import os
+
+# the stored icons - a dict of key -> [pixbuf, backlight colour, surface,
+# reference count]
+_icons = {}
+
+
+def file_source(filename):
+    """ Get the source part of a key for an icon loaded from a file
+
+    The file's modification time is included so that an icon file which is
+    replaced (e.g. by a package upgrade) is not confused with the old one
+
+    Args:
+        filename : the icon file
+
+    Returns:
+        a tuple
+    """
+
+    try:
+        mtime = os.stat(filename).st_mtime
+    except OSError:
+        mtime = None
+
+    return ("file", filename, mtime)
+
+
+def pixbuf_source(pixbuf):
+    """ Get the source part of a key for an icon supplied as a pixbuf
+        (e.g. from wnck) by hashing its contents
+
+    Args:
+        pixbuf : the GdkPixbuf.Pixbuf
+
+    Returns:
+        a tuple
+    """
+
+    digest = hashlib.sha1(pixbuf.get_pixels()).hexdigest()
+    return ("pixbuf", digest, pixbuf.get_width(), pixbuf.get_height())
+
+
+def contains(key):
+    """ Is an icon in the store?
+
+    Args:
+        key : the icon's key
+
+    Returns:
+        True if the icon is in the store, False otherwise
+    """
+
+    return key in _icons
+
+
+def acquire(key, pixbuf=None, color=None):
+    """ Get an icon from the store, adding it if necessary, and increment
+        its reference count
+
+    Args:
+        key : the icon's key - a tuple of (source, size, scale factor)
+        pixbuf : the icon's pixbuf. Only required if the icon is not already
+                 in the store
+        color : the icon's backlight colour. Only required if the icon is not
+                already in the store
+
+    Returns:
+        a tuple of the shared pixbuf, backlight colour and cairo surface
+    """
+
+    icon = _icons.get(key)
+    if icon is None:
+        surface = Gdk.cairo_surface_create_from_pixbuf(pixbuf, key[2], None)
+        icon = _icons[key] = [pixbuf, color, surface, 0]
+
+    icon[3] += 1
+    return icon[0], icon[1], icon[2]
+
+
+def release(key):
+    """ Decrement an icon's reference count, removing it from the store if
+        it is no longer being used
+
+    Args:
+        key : the icon's key
+    """
+
+    icon = _icons.get(key)
+    if icon is None:
+        return
+
+    icon[3] -= 1
+    if icon[3] <= 0:
+        del _icons[key]
+
+
+def get_rss():
+    """ Get the resident set size of this process
+
+    Returns:
+        the size in kB, or 0 if it can't be read
+    """
+
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+
+    return 0
+
+
+def main():
+    """Main function.
+
+    Debugging code can go here
+
+    Compare memory use of a 60 app dock where each app loads its own copy
+    of an icon with one where the icons are shared via the store. Give a
+    list of icon files on the command line, otherwise the stock execute
+    icon is used
+    """
+
+    import sys
+
+    gi.require_version("GdkPixbuf", "2.0")
+    from gi.repository import GdkPixbuf
+    from gi.repository import Gtk
+
+    num_apps = 60
+    size = 48
+    files = sys.argv[1:]
+
+    def load(i):
+        if files == []:
+            return Gtk.IconTheme.get_default().load_icon("system-run", size, 0)
+        return GdkPixbuf.Pixbuf.new_from_file_at_size(files[i % len(files)], size, size)
+
+    base = get_rss()
+    unshared = []
+    for i in range(num_apps):
+        pixbuf = load(i)
+        unshared.append((pixbuf, Gdk.cairo_surface_create_from_pixbuf(pixbuf, 1, None)))
+    unshared_rss = get_rss() - base
+    unshared = None
+
+    base = get_rss()
+    keys = []
+    for i in range(num_apps):
+        if files == []:
+            source = ("stock", size)
+        else:
+            source = file_source(files[i % len(files)])
+
+        key = (source, size, 1)
+        if contains(key):
+            acquire(key)
+        else:
+            acquire(key, load(i), (0, 0, 0))
+        keys.append(key)
+    shared_rss = get_rss() - base
+
+    print("%d apps, %d distinct icons" % (num_apps, len(_icons)))
+    print("unshared: RSS +%d kB" % unshared_rss)
+    print("shared:   RSS +%d kB" % shared_rss)
+
+    for key in keys:
+        release(key)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+"""
+    Keep track of the Unity LauncherEntry state (counts, progress and
+    urgency) of apps
+
+    The last known state of each app is kept in a compact snapshot on disk,
+    keyed by the app's .desktop file name, along with the D-Bus sender and
+    object path its updates came from. When the applet starts, the snapshot
+    is read and entries for apps which are no longer running are discarded,
+    so that badges can be restored straight away. Each app which is still
+    running is then sent a single LauncherEntry Query to get its current
+    state.
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+from gi.repository import GObject
+
+import os
+import os.path
+import json
+
+import dbus
+
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                         "mate-dock-applet")
+CACHE_FILE = os.path.join(CACHE_DIR, "unity_state.json")
+
+# the LauncherEntry properties which are kept
+PROPS = ["count", "count-visible", "progress", "progress-visible", "urgent"]
+
+# the delay (in ms) between the last change of state and the snapshot being
+# written
+SAVE_DELAY = 2000
+
+# the time (in seconds) to wait for an app to reply to a Query
+QUERY_TIMEOUT = 5
+
+# the state - a dict of .desktop file name -> dict containing the app's uri,
+# sender, object path and properties
+_state = {}
+_save_timer_id = 0
+
+
+def _df_name(app_uri):
+    """ Get the .desktop file name from an app uri
+
+    Args:
+        app_uri : the uri e.g. "application://pluma.desktop"
+
+    Returns:
+        the .desktop file name e.g. "pluma.desktop"
+    """
+
+    return app_uri.split("://")[-1]
+
+
+def _is_shown(props):
+    """ Determine whether a set of properties results in anything being
+        displayed on the app's icon
+
+    Args:
+        props : a dict of LauncherEntry properties
+
+    Returns:
+        bool
+    """
+
+    return bool(props.get("count-visible") or props.get("progress-visible") or
+                props.get("urgent"))
+
+
+def load(session_bus):
+    """ Read the snapshot from disk
+
+    Entries for apps whose D-Bus connection has gone (i.e. the app has exited
+    since the snapshot was written) are discarded
+
+    Args:
+        session_bus : the dbus.SessionBus
+    """
+
+    global _state
+
+    try:
+        with open(CACHE_FILE, "r") as cache_file:
+            snapshot = json.load(cache_file)
+    except (OSError, ValueError):
+        snapshot = {}
+
+    if not isinstance(snapshot, dict):
+        snapshot = {}
+
+    _state = {}
+    for df, entry in snapshot.items():
+        try:
+            if not session_bus.name_has_owner(entry["sender"]):
+                continue
+        except (KeyError, TypeError, dbus.exceptions.DBusException):
+            continue
+
+        _state[df] = entry
+
+
+def save():
+    """ Write the snapshot to disk
+
+    The snapshot is written to a temporary file which then replaces the old
+    one, so that a partially written snapshot is never read
+    """
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_file = "%s.%d.tmp" % (CACHE_FILE, os.getpid())
+        with open(tmp_file, "w") as cache_file:
+            json.dump(_state, cache_file, separators=(",", ":"))
+        os.replace(tmp_file, CACHE_FILE)
+    except OSError:
+        pass
+
+
+def do_save_timer():
+    """ Timer callback to write the snapshot
+
+    Returns:
+        False, so that the timer is not repeated
+    """
+
+    global _save_timer_id
+
+    _save_timer_id = 0
+    save()
+    return False
+
+
+def flush():
+    """ Write the snapshot now, if a write is pending """
+
+    global _save_timer_id
+
+    if _save_timer_id != 0:
+        GObject.source_remove(_save_timer_id)
+        _save_timer_id = 0
+        save()
+
+
+def update(app_uri, props, sender, path):
+    """ Record a change in an app's state
+
+    Args:
+        app_uri : the app's uri
+        props : a dict of the LauncherEntry properties which have changed
+        sender : the unique D-Bus name the change was sent from
+        path : the D-Bus object path the change was sent from
+    """
+
+    global _save_timer_id
+
+    df = _df_name(app_uri)
+    entry = _state.get(df, {"props": {}})
+
+    new_props = dict(entry["props"])
+    for key in PROPS:
+        if key in props:
+            # convert from dbus types, so that the value can be written as json
+            value = props[key]
+            if isinstance(value, dbus.Boolean):
+                value = bool(value)
+            elif isinstance(value, float):
+                value = float(value)
+            elif isinstance(value, int):
+                value = int(value)
+            new_props[key] = value
+
+    if _is_shown(new_props):
+        new_entry = {"uri": app_uri, "sender": sender, "path": path,
+                     "props": new_props}
+        if new_entry == _state.get(df):
+            return
+        _state[df] = new_entry
+    elif df in _state:
+        # nothing is displayed for the app, so there's nothing to restore
+        del _state[df]
+    else:
+        return
+
+    if _save_timer_id == 0:
+        _save_timer_id = GObject.timeout_add(SAVE_DELAY, do_save_timer)
+
+
+def get(df_name):
+    """ Get the last known state of an app
+
+    Args:
+        df_name : the app's .desktop file name e.g. "pluma.desktop"
+
+    Returns:
+        a dict of LauncherEntry properties, or None if nothing is known
+        about the app
+    """
+
+    entry = _state.get(df_name)
+    if entry is None:
+        return None
+
+    return entry["props"]
+
+
+def query_apps(session_bus, callback):
+    """ Ask each app in the snapshot for its current state
+
+    The calls are made asynchronously, and each reply is passed to callback
+    in the same way as a LauncherEntry Update signal. If an app doesn't
+    reply (e.g. it doesn't support Query, or it's stuck) its restored state
+    can't be confirmed, so callback is passed properties which clear it
+
+    Args:
+        session_bus : the dbus.SessionBus
+        callback : the function to call with each reply. It is called with
+                   the app's uri, a dict of properties, and the sender and
+                   path keyword arguments
+    """
+
+    def query_reply(entry, *reply):
+        # libunity replies with the app uri and the properties, but allow
+        # for the properties alone
+        if len(reply) == 2:
+            app_uri, props = reply
+        elif len(reply) == 1:
+            app_uri, props = entry["uri"], reply[0]
+        else:
+            return
+
+        callback(app_uri, props, sender=entry["sender"], path=entry["path"])
+
+    def query_error(entry, error):
+        # the app doesn't support Query, has gone, or the call timed out.
+        # Unless the app has sent an update since the state was restored,
+        # clear the restored state rather than risk showing a stale badge
+        if _state.get(_df_name(entry["uri"])) is not entry:
+            return
+
+        callback(entry["uri"], {"count-visible": False, "progress-visible": False,
+                                "urgent": False},
+                 sender=entry["sender"], path=entry["path"])
+
+    for entry in list(_state.values()):
+        session_bus.call_async(entry["sender"], entry["path"],
+                               "com.canonical.Unity.LauncherEntry", "Query",
+                               "", (),
+                               lambda *reply, entry=entry: query_reply(entry, *reply),
+                               lambda error, entry=entry: query_error(entry, error),
+                               timeout=QUERY_TIMEOUT)
+
+
+def main():
+    """Main function.
+
+    Debugging code can go here
+    """
+
+    try:
+        with open(CACHE_FILE, "r") as cache_file:
+            print(json.dumps(json.load(cache_file), indent=4))
+    except (OSError, ValueError) as error:
+        print(error)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+
+"""
+    Provide thumbnail images of windows for the window list
+
+    Windows are captured on a background thread which has its own connection
+    to the X server. Where the server supports the Composite extension and a
+    compositing window manager is running, windows are captured from their
+    off-screen pixmaps so that windows which are obscured are captured
+    correctly. Otherwise, the window's contents are read directly from the
+    screen.
+
+    Captured images are scaled down on the same thread and kept in a small
+    LRU cache, so that showing the window list never waits for a capture -
+    the cached thumbnail (if any) is shown straight away and replaced when a
+    new one is ready. Where the server supports the Damage extension, a
+    window is only captured again if its contents have changed since it was
+    last captured.
+
+    The capture code only needs an X server, so it can be tested under Xvfb
+    (see main())
+
+"""
+
+# Copyright (C) 1997-2003 Free Software Foundation, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Author:
+#     Robin Thompson
+
+from gi.repository import GLib
+from gi.repository import GdkPixbuf
+
+import threading
+import queue
+from collections import OrderedDict, namedtuple
+
+from Xlib import X, error
+from Xlib.display import Display
+
+try:
+    from Xlib.ext import damage
+except ImportError:
+    damage = None
+
+try:
+    import Image
+except ImportError:
+    from PIL import Image
+
+# the maximum width and height of a thumbnail
+THUMBNAIL_SIZE = 160
+
+# the maximum number of thumbnails which are cached
+MAX_THUMBNAILS = 32
+
+# the interval (in ms) at which the window list asks for its thumbnails to
+# be refreshed while it is visible
+REFRESH_INTERVAL = 1000
+
+Thumbnail = namedtuple("Thumbnail", ["pixbuf", "serial"])
+
+
+def get_toplevel(window):
+    """ Get the top level ancestor of a window i.e. the window manager's
+        frame window, if it has one
+
+    Args:
+        window : an Xlib window
+
+    Returns:
+        an Xlib window
+    """
+
+    while True:
+        tree = window.query_tree()
+        if (tree.parent == X.NONE) or (tree.parent == tree.root):
+            return window
+        window = tree.parent
+
+
+def capture_window(display, xid, size=THUMBNAIL_SIZE, use_composite=True):
+    """ Capture the contents of a window and scale them down
+
+    Args:
+        display : an Xlib Display
+        xid : the xid of the window
+        size : the maximum width and height of the scaled image
+        use_composite : whether to try to capture the window from its
+                        off-screen pixmap
+
+    Returns:
+        a PIL Image in RGB mode, or None if the window could not be captured
+        (e.g. it has been closed, or it is minimised and there is no
+        compositing window manager)
+    """
+
+    window = display.create_resource_object("window", xid)
+
+    try:
+        drawable = window
+        geom = None
+        if use_composite and display.has_extension("Composite"):
+            # the frame is the window which is redirected by the compositing
+            # window manager. Naming its pixmap fails if it isn't redirected
+            frame = get_toplevel(window)
+            catch = error.CatchError(error.BadMatch, error.BadWindow)
+            pixmap = frame.composite_name_window_pixmap(onerror=catch)
+            display.sync()
+            if catch.get_error():
+                display.free_resource_id(pixmap.id)
+            else:
+                drawable = pixmap
+                geom = frame.get_geometry()
+                width = geom.width + geom.border_width * 2
+                height = geom.height + geom.border_width * 2
+
+        if geom is None:
+            geom = window.get_geometry()
+            width = geom.width
+            height = geom.height
+
+        try:
+            image = drawable.get_image(0, 0, width, height, X.ZPixmap, 0xffffffff)
+        finally:
+            if drawable is not window:
+                drawable.free()
+    except error.XError:
+        return None
+
+    # only 24 and 32 bit visuals (i.e. 32 bits per pixel) are handled
+    if (image.depth not in [24, 32]) or (len(image.data) < width * height * 4):
+        return None
+
+    if display.display.info.image_byte_order == X.LSBFirst:
+        raw_mode = "BGRX"
+    else:
+        raw_mode = "XRGB"
+
+    img = Image.frombuffer("RGB", (width, height), image.data, "raw", raw_mode, 0, 1)
+    img.thumbnail((size, size))
+    return img
+
+
+def image_to_pixbuf(img):
+    """ Convert a PIL image to a pixbuf
+
+    Args:
+        img : a PIL Image in RGB mode
+
+    Returns:
+        a GdkPixbuf.Pixbuf
+    """
+
+    return GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(img.tobytes()),
+                                           GdkPixbuf.Colorspace.RGB, False, 8,
+                                           img.width, img.height, img.width * 3)
+
+
+class ThumbnailCapturer(threading.Thread):
+    """ Thread which captures window thumbnails on request
+
+        Attributes:
+            display : the thread's connection to the X server
+            requests : a queue of requests - tuples of xid, callback and the
+                       callback's args
+            cache : an OrderedDict of xid -> Thumbnail, with the most
+                    recently used last
+            lock : lock protecting cache
+            damages : a dict of the xid of a window -> tuple of the damage
+                      object monitoring it and the drawable it monitors
+            serials : a dict of the xid of a window -> the number of times
+                      its contents have been reported as changed
+            num_captured : the number of windows captured
+            num_skipped : the number of requests which didn't need a capture
+                          because the window hadn't changed
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.display = Display()
+
+        # errors about windows which have been closed are expected, and are
+        # not worth reporting
+        self.display.set_error_handler(lambda err, request: None)
+
+        self.requests = queue.Queue()
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.damages = {}
+        self.serials = {}
+        self.num_captured = 0
+        self.num_skipped = 0
+
+        self.use_damage = (damage is not None) and self.display.has_extension("DAMAGE")
+        if self.use_damage:
+            self.display.damage_query_version()
+
+    def get_thumbnail(self, xid, callback, *args):
+        """ Get a window's thumbnail, and request a new one if it has changed
+
+        Args:
+            xid : the window's xid
+            callback : the function to be called, on the main thread, when a
+                       new thumbnail is ready. It is called with the window's
+                       xid, the thumbnail pixbuf and args
+            args : any other args to pass to callback
+
+        Returns:
+            the cached thumbnail pixbuf, or None if there isn't one
+        """
+
+        with self.lock:
+            thumb = self.cache.get(xid)
+            if thumb is not None:
+                self.cache.move_to_end(xid)
+
+        self.requests.put((xid, callback, args))
+
+        if thumb is None:
+            return None
+
+        return thumb.pixbuf
+
+    def forget(self, xid):
+        """ Remove a window's thumbnail from the cache, e.g. because the window
+            has been closed
+
+        Args:
+            xid : the window's xid
+        """
+
+        self.requests.put((xid, None, None))
+
+    def process_damage(self):
+        """ Count the Damage events received for each window since the last
+            call
+        """
+
+        if not self.use_damage:
+            return
+
+        drawables = {drawable: xid for xid, (dmg, drawable) in self.damages.items()}
+        damage_notify = self.display.extension_event.DamageNotify
+        while self.display.pending_events() > 0:
+            event = self.display.next_event()
+            if (event.type & 0x7f) == damage_notify:
+                xid = drawables.get(event.drawable.id)
+                if xid is not None:
+                    self.serials[xid] = self.serials.get(xid, 0) + 1
+
+    def watch(self, xid):
+        """ Start monitoring a window for changes to its contents
+
+        Args:
+            xid : the window's xid
+        """
+
+        if (not self.use_damage) or (xid in self.damages):
+            return
+
+        try:
+            window = self.display.create_resource_object("window", xid)
+            drawable = get_toplevel(window)
+            dmg = drawable.damage_create(damage.DamageReportNonEmpty)
+        except error.XError:
+            return
+
+        self.damages[xid] = (dmg, drawable.id)
+        self.serials[xid] = 1
+
+    def unwatch(self, xid):
+        """ Stop monitoring a window
+
+        Args:
+            xid : the window's xid
+        """
+
+        dmg, drawable = self.damages.pop(xid, (None, None))
+        if dmg is not None:
+            self.display.damage_destroy(dmg)
+        self.serials.pop(xid, None)
+
+    def remove(self, xid):
+        """ Remove a window from the cache and stop monitoring it
+
+        Args:
+            xid : the window's xid
+        """
+
+        with self.lock:
+            self.cache.pop(xid, None)
+        self.unwatch(xid)
+
+    def capture(self, xid, callback, args):
+        """ Capture a window if it has changed since it was last captured, and
+            pass the new thumbnail to callback
+
+        Args:
+            xid : the window's xid
+            callback : the callback
+            args : the callback's args
+        """
+
+        self.watch(xid)
+        self.process_damage()
+
+        with self.lock:
+            thumb = self.cache.get(xid)
+
+        serial = self.serials.get(xid, 0)
+        if (thumb is not None) and self.use_damage and (thumb.serial == serial):
+            self.num_skipped += 1
+            return
+
+        if xid in self.damages:
+            # any changes made from now on will be reported
+            self.display.damage_subtract(self.damages[xid][0])
+
+        img = capture_window(self.display, xid)
+        if img is None:
+            return
+
+        self.num_captured += 1
+        pixbuf = image_to_pixbuf(img)
+        with self.lock:
+            self.cache[xid] = Thumbnail(pixbuf=pixbuf, serial=serial)
+            self.cache.move_to_end(xid)
+            evicted = []
+            while len(self.cache) > MAX_THUMBNAILS:
+                evicted.append(self.cache.popitem(last=False)[0])
+
+        for old_xid in evicted:
+            self.unwatch(old_xid)
+
+        GLib.idle_add(callback, xid, pixbuf, *args)
+
+    def run(self):
+        while True:
+            xid, callback, args = self.requests.get()
+            if callback is None:
+                self.remove(xid)
+            else:
+                self.capture(xid, callback, args)
+
+            self.display.flush()
+
+
+_capturer = None
+
+
+def get_capturer():
+    """ Get the ThumbnailCapturer shared by all window lists, starting it if
+        necessary
+
+    Returns:
+        a ThumbnailCapturer
+    """
+
+    global _capturer
+
+    if _capturer is None:
+        _capturer = ThumbnailCapturer()
+        _capturer.start()
+
+    return _capturer
+
+
+def get_thumbnail(xid, callback, *args):
+    """ Get a window's thumbnail, and request a new one if it has changed
+
+    Args:
+        xid : the window's xid
+        callback : the function to be called, on the main thread, when a
+                   new thumbnail is ready. It is called with the window's
+                   xid, the thumbnail pixbuf and args
+        args : any other args to pass to callback
+
+    Returns:
+        the cached thumbnail pixbuf, or None if there isn't one
+    """
+
+    return get_capturer().get_thumbnail(xid, callback, *args)
+
+
+def forget(xid):
+    """ Remove a window's thumbnail from the cache
+
+    Args:
+        xid : the window's xid
+    """
+
+    if _capturer is not None:
+        _capturer.forget(xid)
+
+
+def main():
+    """ Test window capture
+
+    Creates a window, captures it, changes it and captures it again,
+    checking that a capture is only made when the window has changed. Needs
+    only an X server, so can be run under Xvfb, e.g.
+
+        xvfb-run -s "-screen 0 1024x768x24" python3 win_thumbnails.py
+    """
+
+    import time
+
+    display = Display()
+    screen = display.screen()
+    window = screen.root.create_window(0, 0, 640, 480, 0, screen.root_depth,
+                                       background_pixel=screen.white_pixel)
+    gc = window.create_gc(foreground=screen.black_pixel)
+    window.map()
+    display.sync()
+    time.sleep(0.5)
+    window.fill_rectangle(gc, 0, 0, 320, 240)
+    display.sync()
+
+    start = time.monotonic()
+    img = capture_window(display, window.id)
+    print("capture_window: %s in %.1fms" % (img.size if img else None,
+                                            (time.monotonic() - start) * 1000))
+    if img is not None:
+        print("top left pixel = %s, bottom right pixel = %s" %
+              (img.getpixel((0, 0)), img.getpixel((img.width - 1, img.height - 1))))
+
+    loop = GLib.MainLoop()
+    results = []
+
+    def thumbnail_ready(xid, pixbuf):
+        results.append((pixbuf.get_width(), pixbuf.get_height()))
+
+    capturer = get_capturer()
+
+    def step(num):
+        get_thumbnail(window.id, thumbnail_ready)
+        if num == 1:
+            # change the window, so the next request has to capture it again
+            window.fill_rectangle(gc, 320, 240, 320, 240)
+            display.sync()
+        if num == 3:
+            loop.quit()
+            return False
+        return True
+
+    steps = iter(range(4))
+    GLib.timeout_add(300, lambda: step(next(steps)))
+    loop.run()
+
+    print("damage extension: %s" % capturer.use_damage)
+    print("thumbnails received: %s" % results)
+    print("captured %d, skipped %d" % (capturer.num_captured, capturer.num_skipped))
+
+
+if __name__ == "__main__":
+    main()